@@ -55,6 +55,7 @@ Example:
         data1, data2 = my_acquisition_coroutine(10)
 """
 from copy import copy
+import numpy as np
 from .async_utils import ensure_future, sleep_async, wait, Event
 
 from .module_attributes import *
@@ -64,6 +65,117 @@ class AcquisitionError(ValueError):
     pass
 
 
+class TraceStatistics(object):
+    """
+    Per-point statistics of the traces of an acquisition, accumulated in
+    place on preallocated arrays instead of storing the traces:
+
+        std: standard deviation (Welford's algorithm)
+        min, max: envelopes
+        peak: peak hold of the magnitude, i.e. the maximum of abs(trace)
+
+    The arrays are None before the first trace and are overwritten by each
+    update. For std, the traces are weighted as in data_avg: equally
+    (weight 1/n for the n-th trace) in single mode, and with an exponential
+    moving window of trace_average traces in continuous mode. min, max and
+    peak hold cover all traces since the last reset.
+
+    If ema_traces is set, exponential moving averages with a time constant
+    of ema_traces traces are accumulated as well, in single and continuous
+    mode:
+
+        ema: moving average of the traces
+        ema_min, ema_max, ema_peak: decaying envelopes, which follow new
+            extrema immediately and relax towards the traces otherwise
+    """
+    ema_names = ['ema', 'ema_min', 'ema_max', 'ema_peak']
+
+    def __init__(self, ema_traces=None):
+        self.ema_traces = ema_traces
+        self.count = 0
+        self.min = self.max = self.peak = None
+        self.ema = self.ema_min = self.ema_max = self.ema_peak = None
+        self._mean = self._var = self._scratch = None
+
+    @property
+    def names(self):
+        """ names of the statistics """
+        names = ['std', 'min', 'max', 'peak']
+        if self.ema_traces:
+            names += self.ema_names
+        return names
+
+    @property
+    def std(self):
+        if self._var is None:
+            return None
+        return np.sqrt(self._var)
+
+    def reset(self):
+        """ the next update starts new statistics """
+        self.count = 0
+
+    def update(self, trace, weight):
+        """ adds trace with the weight (0 < weight <= 1) in the mean """
+        trace = np.asarray(trace)
+        if self.count == 0:
+            if self._mean is None or self._mean.shape != trace.shape:
+                self._mean = np.empty(trace.shape)
+                self._var = np.empty(trace.shape)
+                self._scratch = np.empty(trace.shape)
+                self.min = np.empty(trace.shape)
+                self.max = np.empty(trace.shape)
+                self.peak = np.empty(trace.shape)
+            self._mean[...] = trace
+            self._var.fill(0)
+            self.min[...] = trace
+            self.max[...] = trace
+            np.abs(trace, out=self.peak)
+            self.count = 1
+            if self.ema_traces:
+                self._start_ema(trace)
+            return
+        # weighted Welford update: mean += w * delta,
+        # var = (1 - w) * (var + w * delta ** 2)
+        delta = np.subtract(trace, self._mean, out=self._scratch)
+        self._mean += weight * delta
+        delta *= delta
+        delta *= weight
+        self._var += delta
+        self._var *= 1. - weight
+        np.minimum(self.min, trace, out=self.min)
+        np.maximum(self.max, trace, out=self.max)
+        np.maximum(self.peak, np.abs(trace, out=self._scratch), out=self.peak)
+        self.count += 1
+        if self.ema_traces:
+            if self.ema is None or self.ema.shape != trace.shape:
+                self._start_ema(trace)  # ema_traces was set meanwhile
+            else:
+                self._update_ema(trace)
+
+    def _start_ema(self, trace):
+        self.ema = np.array(trace, dtype=float)
+        self.ema_min = np.array(trace, dtype=float)
+        self.ema_max = np.array(trace, dtype=float)
+        self.ema_peak = np.abs(trace).astype(float)
+        self._ema_count = 1
+
+    def _update_ema(self, trace):
+        self._ema_count += 1
+        alpha = 1. / min(self._ema_count, self.ema_traces)
+        magnitude = np.abs(trace, out=self._scratch)
+        for ema, target, extremum in [(self.ema, trace, None),
+                                      (self.ema_min, trace, np.minimum),
+                                      (self.ema_max, trace, np.maximum),
+                                      (self.ema_peak, magnitude,
+                                       np.maximum)]:
+            # ema += alpha * (target - ema)
+            ema *= 1. - alpha
+            ema += alpha * target
+            if extremum is not None:
+                extremum(ema, target, out=ema)
+
+
 class RunningStateProperty(SelectProperty):
     def __init__(self, options=["running_single",
                                 "running_continuous",
@@ -150,6 +262,9 @@ class AcquisitionModule(Module):
         data_avg (array of numbers): array containing the current averaged curve
         data_x (array of numbers): containing the abciss data
         current_avg (int): current number of averages
+        data_std, data_min, data_max, data_peak (arrays of numbers): per
+            point standard deviation, envelopes and peak hold of the
+            averaged traces (see :class:`TraceStatistics`)
 
     """
 
@@ -213,6 +328,7 @@ class AcquisitionModule(Module):
         self._last_run = None
         self.curve_name = self.name + " curve"
         self.current_avg = 0
+        self.statistics = TraceStatistics()
 
     def _emit_signal_by_name(self, signal_name, *args, **kwds):
         """Let's the module's signal_launcher emit signal name"""
@@ -224,7 +340,7 @@ class AcquisitionModule(Module):
         """
         self._start_trace_acquisition()
         await self._data_ready_async(min_delay_ms)
-        return self._get_trace()
+        return await self._get_trace_async()
 
     def single_async(self):
         """
@@ -244,7 +360,7 @@ class AcquisitionModule(Module):
         self._data_ready becomes eventually True.
         """
         await sleep_async(max(self._remaining_time(), min_delay_s))
-        while not self._data_ready():
+        while not await self._data_ready_async_check():
             await sleep_async(max(self._remaining_time(), min_delay_s))
 
     async def _do_average_single_async(self):
@@ -259,10 +375,9 @@ class AcquisitionModule(Module):
             self.current_avg+=1
             if self.running_state=='paused_single':
                 await self._resume_event.wait()
-            self.data_avg = (self.data_avg * (self.current_avg-1) + \
-                             await self._trace_async(0)) / self.current_avg
-            self._emit_signal_by_name('display_curve', [self.data_x,
-                                                        self.data_avg])
+            self._accumulate(await self._trace_async(0))
+            self._emit_signal_by_name('display_curve',
+                                      self._display_curve())
         self._running_state = 'stopped'
         self._free_up_resources()
         return self.data_avg
@@ -305,12 +420,10 @@ class AcquisitionModule(Module):
             if self.running_state == 'paused_continuous':
                 await self._resume_event.wait()
             self.current_avg = min(self.current_avg + 1, self.trace_average)
-            self.data_avg = (self.data_avg * (self.current_avg - 1) + \
-                             await self._trace_async(
-                                 self.MIN_DELAY_CONTINUOUS_MS * 0.001)) / \
-                            self.current_avg
-            self._emit_signal_by_name('display_curve', [self.data_x,
-                                                        self.data_avg])
+            self._accumulate(await self._trace_async(
+                self.MIN_DELAY_CONTINUOUS_MS * 0.001))
+            self._emit_signal_by_name('display_curve',
+                                      self._display_curve())
 
     async def _continuous_async(self):
         """
@@ -394,8 +507,81 @@ class AcquisitionModule(Module):
         curve = self._save_curve(self.data_x,
                                  self.data_avg,
                                  **params)
+        self._save_statistics(curve)
         return curve
 
+    @property
+    def data_std(self):
+        return self.statistics.std
+
+    @property
+    def data_min(self):
+        return self.statistics.min
+
+    @property
+    def data_max(self):
+        return self.statistics.max
+
+    @property
+    def data_peak(self):
+        return self.statistics.peak
+
+    @property
+    def ema_traces(self):
+        """
+        time constant [traces] of the exponential moving averages of the
+        statistics (data_ema, ...), None to not compute them
+        """
+        return self.statistics.ema_traces
+
+    @ema_traces.setter
+    def ema_traces(self, ema_traces):
+        self.statistics.ema_traces = ema_traces
+
+    @property
+    def data_ema(self):
+        return self.statistics.ema
+
+    @property
+    def data_ema_min(self):
+        return self.statistics.ema_min
+
+    @property
+    def data_ema_max(self):
+        return self.statistics.ema_max
+
+    @property
+    def data_ema_peak(self):
+        return self.statistics.ema_peak
+
+    def _display_curve(self):
+        """
+        Returns the curve [data_x, data_avg] emitted with display_curve.
+        Derived classes may reduce it to the resolution of the display.
+        """
+        return [self.data_x, self.data_avg]
+
+    def _accumulate(self, trace):
+        """
+        Adds the current_avg-th trace to data_avg and to the statistics.
+        """
+        self.statistics.update(trace, 1. / self.current_avg)
+        self.data_avg = self._average(trace)
+
+    def _save_statistics(self, curve, index=None):
+        """
+        Saves the statistics (row index of the arrays, if given) as childs
+        of curve, named after the statistics (e.g. curve.get_child('std')).
+        """
+        if self.statistics.count == 0:
+            return
+        curve.params['averages'] = self.statistics.count
+        for name in self.statistics.names:
+            data = getattr(self.statistics, name)
+            if index is not None:
+                data = data[index]
+            curve.add_child(self._save_curve(self.data_x, data, name=name))
+
     def _clear(self):
         super(AcquisitionModule, self)._clear()
         if self._last_run:
@@ -436,6 +622,30 @@ class AcquisitionModule(Module):
         """
         raise NotImplementedError  # pragma: no cover
 
+    def _average(self, trace):
+        """
+        Returns the new average of the (current_avg - 1) traces in
+        self.data_avg and the current_avg-th trace.
+        """
+        return (self.data_avg * (self.current_avg - 1) + trace) / \
+            self.current_avg
+
+    async def _data_ready_async_check(self):
+        """
+        Same as _data_ready(). Derived classes should override this
+        coroutine if the check involves the transfer of data, such that the
+        event loop is not blocked meanwhile.
+        """
+        return self._data_ready()
+
+    async def _get_trace_async(self):
+        """
+        Same as _get_trace(). Derived classes should override this
+        coroutine if they can retrieve the curve without blocking the event
+        loop.
+        """
+        return self._get_trace()
+
     def _start_trace_acquisition(self):
         """
         If anything has to be communicated to the hardware (such as make
@@ -462,6 +672,7 @@ class AcquisitionModule(Module):
         """
         self.attributes_last_run = copy(self._get_run_attributes())
         self.current_avg = 0
+        self.statistics.reset()
 
     def _free_up_resources(self):
         pass # pragma: no cover
@@ -16,6 +16,8 @@ place of wait) and the asynchronous sleep coroutine provided below (in
 place of sleep):
   * async_sleep(time_s): await this coroutine to stall the execution for a
                          time time_s within a coroutine.
+  * open_connection_async(host, port): await this coroutine in place of
+                         asyncio.open_connection to open a tcp stream.
 
 These functions are provided in place of the native asyncio functions in
 order to integrate properly within the IPython (Jupyter) Kernel. For this,
@@ -88,6 +90,19 @@ async def sleep_async(delay, result=None):
         h.cancel()
 
 
+async def open_connection_async(host, port):
+    """
+    Replaces asyncio.open_connection(host, port) inside coroutines. Returns
+    a (StreamReader, StreamWriter) pair attached to LOOP, which deals
+    properly with IPython kernel integration.
+    """
+    reader = asyncio.StreamReader(loop=LOOP)
+    protocol = asyncio.StreamReaderProtocol(reader, loop=LOOP)
+    transport, _ = await LOOP.create_connection(lambda: protocol, host, port)
+    writer = asyncio.StreamWriter(transport, protocol, reader, LOOP)
+    return reader, writer
+
+
 def ensure_future(coroutine):
     """
     Schedules the task described by the coroutine. Deals properly with
@@ -219,6 +219,16 @@ class BaseRegister(BaseProperty):
         else:
             return self.to_python(obj, obj._read(self.address) & self.bitmask)
 
+    async def get_value_async(self, obj):
+        """
+        Same as get_value, but without blocking the event loop during the
+        transfer. Only use inside coroutines.
+        """
+        value = await obj._read_async(self.address)
+        if self.bitmask is not None:
+            value &= self.bitmask
+        return self.to_python(obj, value)
+
     def set_value(self, obj, val):
         """
         Sets the value on the redpitaya device.
@@ -366,6 +376,9 @@ class IORegister(BoolRegister):
         self.direction(obj)
         return BoolRegister.get_value(self, obj)
 
+    async def get_value_async(self, obj):
+        return self.get_value(obj)  # direction must be set synchronously
+
     def set_value(self, obj, val):
         self.direction(obj)
         return BoolRegister.set_value(self, obj, val)
@@ -461,11 +474,26 @@ class ConstantIntRegister(IntRegister):
             setattr(obj, '_' + self.name, value)
             return value
 
+    async def get_value_async(self, obj):
+        try:
+            return getattr(obj, '_' + self.name)
+        except AttributeError:
+            value = await super(ConstantIntRegister,
+                                self).get_value_async(obj)
+            setattr(obj, '_' + self.name, value)
+            return value
+
 
 class LongRegister(IntRegister):
     """Interface for register of python type int/long with arbitrary length 'bits' (effectively unsigned)"""
     def get_value(self, obj):
-        values = obj._reads(self.address, self.size)
+        return self._to_long(obj, obj._reads(self.address, self.size))
+
+    async def get_value_async(self, obj):
+        return self._to_long(obj, await obj._reads_async(self.address,
+                                                         self.size))
+
+    def _to_long(self, obj, values):
         value = int(0)
         for i in range(self.size):
             value += int(values[i]) << (32 * i)
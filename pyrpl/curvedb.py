@@ -158,9 +158,10 @@ except:
                 self.logger.warning("Could not find and remove the file %s. ",
                                     filename)
             if parent:
-                parentchilds = parent.childs
-                parentchilds.remove(delpk)
-                parent.childs = parentchilds
+                parentchilds = parent.params["childs"] or []
+                if delpk in parentchilds:
+                    parentchilds.remove(delpk)
+                parent.params["childs"] = parentchilds
                 parent.save()
 
         # Implement the following methods if you want to use a hierarchical
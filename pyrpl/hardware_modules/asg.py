@@ -205,6 +205,7 @@ def make_asg(channel=0):
 
         # register set_a_rst
         sm_reset = BoolRegister(0x0, 6 + _BIT_OFFSET, doc='resets the state machine')
+        _volatile_registers = ["sm_reset"]
 
         # register set_a/b_once
         # deprecated since redpitaya v0.94
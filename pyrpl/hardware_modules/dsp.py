@@ -225,6 +225,10 @@ class DspModule(HardwareModule, SignalModule):
                                    doc="selects to which analog output the "
                                        "module signal is sent directly")
 
+    # registers that change without being written (see HardwareModule)
+    _volatile_registers = ["out1_saturated", "out2_saturated", "_sync",
+                           "_paused", "current_output_signal"]
+
     out1_saturated = BoolRegister(0x8, 0, doc="True if out1 is saturated")
 
     out2_saturated = BoolRegister(0x8, 1, doc="True if out2 is saturated")
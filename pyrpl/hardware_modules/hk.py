@@ -38,6 +38,10 @@ class HK(HardwareModule):
             doc="direction of the "
                 "port")
 
+    # the expansion inputs change by themselves
+    _volatile_registers = ['expansion_P' + str(i) for i in range(8)] + \
+                          ['expansion_N' + str(i) for i in range(8)]
+
     id = SelectRegister(0x0, doc="device ID", options={"prototype0": 0,
                                                        "release1": 1})
     digital_loop = IntRegister(0x0C, doc="enables digital loop")
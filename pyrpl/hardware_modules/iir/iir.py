@@ -282,6 +282,8 @@ class IIR(FilterModule):
                          call_setup=True
                          )
 
+    _volatile_registers = ["overflow_bitfield"]
+
     overflow_bitfield = IntRegister(0x108,
                                     doc="Bitmask for various overflow conditions")
 
@@ -88,3 +88,6 @@ for inp, num in DSP_INPUTS.items():
                 bits=14,
                 norm=2 ** 13 - 1,
                 doc="current value of " + inp))
+
+# all sampled signals change permanently
+Sampler._volatile_registers = list(DSP_INPUTS.keys())
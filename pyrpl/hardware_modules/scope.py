@@ -120,14 +120,20 @@ large an integrator gain will quickly saturate the outputs.
     print("First point in data buffer 1 [V]:", s.ch1_firstpoint)
 """
 
+import asyncio
 import time
 from .dsp import all_inputs, dsp_addr_base, InputSelectRegister
 from ..acquisition_module import AcquisitionModule
-from ..async_utils import wait, ensure_future, sleep_async
+from ..async_utils import wait, ensure_future, sleep, sleep_async, \
+    TimeoutError
 from ..pyrpl_utils import sorted_dict
 from ..attributes import *
 from ..modules import HardwareModule
-from ..pyrpl_utils import time
+from ..pyrpl_utils import time, minmax_decimate
+from ..scope_stream import ScopeStream
+from ..scope_persistence import PersistenceAccumulator
+from ..scope_measurements import MeasurementEngine
+from ..scope_alignment import AlignedAverager
 from ..widgets.module_widgets import ScopeWidget
 
 logger = logging.getLogger(name=__name__)
@@ -225,6 +231,24 @@ class Scope(HardwareModule, AcquisitionModule):
                        "xy_mode"]
     # running_state last for proper acquisition setup
     _setup_attributes = _gui_attributes + ["rolling_mode"]
+    # registers that change without being written (see HardwareModule)
+    _volatile_registers = ["_reset_writestate_machine",
+                           "_trigger_armed",
+                           "_trigger_source_register",
+                           "_trigger_delay_running",
+                           "_adc_we_keep",
+                           "_adc_we_cnt",
+                           "current_timestamp",
+                           "trigger_timestamp",
+                           "_write_pointer_current",
+                           "_write_pointer_trigger",
+                           "voltage_in1",
+                           "voltage_in2",
+                           "voltage_out1",
+                           "voltage_out2",
+                           "ch1_firstpoint",
+                           "ch2_firstpoint",
+                           "pretrig_ok"]
     # changing these resets the acquisition and autoscale (calls setup())
 
     data_length = data_length  # to use it in a list comprehension
@@ -471,53 +495,118 @@ class Scope(HardwareModule, AcquisitionModule):
         if new is not None:
             self.stop()
 
+    _raw_buffers = None  # reused by each readout of the data buffers
+    _trace_buffers = None  # decoded (float) traces, reused as well
+
+    def _raw_buffer(self, ch):
+        if self._raw_buffers is None:
+            self._raw_buffers = np.zeros((2, self.data_length),
+                                         dtype=np.uint32)
+        return self._raw_buffers[ch - 1]
+
+    def _trace_buffer(self, ch=None):
+        """ float buffer of channel ch, or of both channels if ch is None """
+        if self._trace_buffers is None:
+            self._trace_buffers = np.zeros((2, self.data_length))
+        if ch is None:
+            return self._trace_buffers
+        return self._trace_buffers[ch - 1]
+
+    @staticmethod
+    def _to_int14(buffer):
+        """
+        Converts the 14 bit data in the uint32 array buffer in-place and
+        returns an int16 view on the result.
+        """
+        x = buffer.view(np.int16)[::2]  # lower 16 bits of each value
+        x <<= 2  # sign extension of the 14 bit values
+        x >>= 2
+        return x
+
+    @classmethod
+    def _decode(cls, buffer, shift, out):
+        """
+        Decodes the raw data in the uint32 array buffer (in-place) into the
+        float array out, which is returned. Equivalent to
+        out[:] = np.roll(int14(buffer), -shift) / 2 ** 13, but the rotation
+        and normalization are done by two slice copies without temporary
+        arrays.
+        """
+        x = cls._to_int14(buffer)
+        shift %= len(x)
+        n = len(x) - shift
+        np.multiply(x[shift:], 1. / 2 ** 13, out=out[:n])
+        np.multiply(x[:shift], 1. / 2 ** 13, out=out[n:])
+        return out
+
+    def _read_buffer(self, ch):
+        """ reads the (undecoded) data of channel ch into its raw buffer """
+        buffer = self._raw_buffer(ch)
+        self._reads_into(0x10000 * ch, buffer)
+        return buffer
+
+    async def _read_buffer_async(self, ch):
+        buffer = self._raw_buffer(ch)
+        buffer[:] = await self._reads_async(0x10000 * ch, self.data_length)
+        return buffer
+
+    def _rawdata(self, ch):
+        """
+        raw data from channel ch (1 or 2). The returned array is a view on
+        a buffer that is overwritten by the next readout.
+        """
+        return self._to_int14(self._read_buffer(ch))
+
     @property
     def _rawdata_ch1(self):
         """raw data from ch1"""
-        # return np.array([self.to_pyint(v) for v in self._reads(0x10000,
-        # self.data_length)],dtype=np.int32)
-        x = np.array(self._reads(0x10000, self.data_length), dtype=np.int16)
-        x[x >= 2 ** 13] -= 2 ** 14
-        return x
+        return self._rawdata(1)
 
     @property
     def _rawdata_ch2(self):
         """raw data from ch2"""
-        # return np.array([self.to_pyint(v) for v in self._reads(0x20000,
-        # self.data_length)],dtype=np.int32)
-        x = np.array(self._reads(0x20000, self.data_length), dtype=np.int16)
-        x[x >= 2 ** 13] -= 2 ** 14
-        return x
+        return self._rawdata(2)
+
+    async def _rawdata_async(self, ch):
+        """raw data from channel ch (1 or 2)"""
+        return self._to_int14(await self._read_buffer_async(ch))
+
+    def _data(self, ch, pointer_register):
+        """
+        normalized data from channel ch, starting after the write pointer
+        read from pointer_register. The returned array is a view on a
+        buffer that is overwritten by the next readout.
+        """
+        buffer = self._read_buffer(ch)
+        return self._decode(buffer, self._trace_start(pointer_register),
+                            self._trace_buffer(ch))
+
+    def _trace_start(self, pointer_register):
+        """ index of the first point of the trace in the data buffers """
+        if pointer_register == '_write_pointer_trigger':
+            return self._write_pointer_trigger + \
+                self._trigger_delay_register + 1
+        return getattr(self, pointer_register) + 1
 
     @property
     def _data_ch1(self):
         """ acquired (normalized) data from ch1"""
-        return np.array(
-            np.roll(self._rawdata_ch1, - (self._write_pointer_trigger +
-                                          self._trigger_delay_register + 1)),
-            dtype=float) / 2 ** 13
+        return self._data(1, '_write_pointer_trigger')
 
     @property
     def _data_ch2(self):
         """ acquired (normalized) data from ch2"""
-        return np.array(
-            np.roll(self._rawdata_ch2, - (self._write_pointer_trigger +
-                                          self._trigger_delay_register + 1)),
-            dtype=float) / 2 ** 13
+        return self._data(2, '_write_pointer_trigger')
 
     @property
     def _data_ch1_current(self):
         """ (unnormalized) data from ch1 while acquisition is still running"""
-        return np.array(
-            np.roll(self._rawdata_ch1, -(self._write_pointer_current + 1)),
-            dtype=float) / 2 ** 13
+        return self._data(1, '_write_pointer_current')
 
     @property
     def _data_ch2_current(self):
         """ (unnormalized) data from ch2 while acquisition is still running"""
-        return np.array(
-            np.roll(self._rawdata_ch2, -(self._write_pointer_current + 1)),
-            dtype=float) / 2 ** 13
+        return self._data(2, '_write_pointer_current')
 
     @property
     def times(self):
@@ -536,8 +625,14 @@ class Scope(HardwareModule, AcquisitionModule):
 
     async def wait_for_pretrigger_async(self):
         """sleeps until scope trigger is ready (buffer has enough new data)"""
-        while not self.pretrig_ok:
-            await sleep_async(0.001)
+        if self._armed_delay is not None:
+            pretrigger = max(self.data_length - self._armed_delay, 0) * \
+                self.sampling_time
+            await sleep_async(pretrigger - (time() - self._last_time_setup))
+        interval = self.trigger_poll_min
+        while not await self._get_async('pretrig_ok'):
+            await sleep_async(interval)
+            interval = min(2 * interval, self.trigger_poll_max)
         ### For some reason, launching the trigger at that point would be too soon...
         await sleep_async(0.1)
 
@@ -574,19 +669,324 @@ class Scope(HardwareModule, AcquisitionModule):
         self.data_x = np.copy(self.times)
         self.data_avg = np.zeros((2, len(self.times)))
         self.current_avg = 0
+        if self.persistence is not None:
+            self.persistence.set_ranges(*self._persistence_ranges())
+        if self.measurements is not None:
+            self.measurements.reset()
+        if self.aligned_averager is not None:
+            self.aligned_averager.reset()
+            if self._alignment_channel is None:
+                self.aligned_averager.channel = \
+                    2 if self.trigger_source.startswith('ch2') else 1
+
+    def _acquired_channels(self):
+        """
+        Returns the channels (1 and/or 2) whose data are transferred: the
+        active ones, or both in xy-mode or with channel math.
+        """
+        if self.xy_mode or self.ch_math_active:
+            return (1, 2)
+        return tuple(ch for ch, active in ((1, self.ch1_active),
+                                           (2, self.ch2_active)) if active)
 
-
-    def _get_trace(self):
+    def _decode_trace(self, channels, shift):
+        """
+        decodes the raw buffers of channels into the trace buffer. The
+        traces of the other channels are set to NaN.
+        """
+        trace = self._trace_buffer()
+        for ch in (1, 2):
+            if ch in channels:
+                self._decode(self._raw_buffer(ch), shift, trace[ch - 1])
+            else:
+                trace[ch - 1].fill(np.nan)
+        return trace
+
+    def _read_trace(self, channels=None):
+        """
+        Transfers the data of channels (by default, _acquired_channels())
+        and returns them in the shared trace buffer (2, data_length), the
+        other channel being NaN. The buffer is overwritten by the next
+        readout, use _get_trace() to keep the data.
+        """
+        if channels is None:
+            channels = self._acquired_channels()
+        for ch in channels:
+            self._read_buffer(ch)
+        shift = self._trace_start('_write_pointer_trigger') if channels else 0
+        return self._decode_trace(channels, shift)
+
+    async def _read_trace_async(self, channels=None):
+        """
+        Same as _read_trace(), without blocking the event loop during the
+        transfer
+        """
+        if channels is None:
+            channels = self._acquired_channels()
+        for ch in channels:
+            await self._read_buffer_async(ch)
+        shift = 0
+        if channels:
+            shift = await self._get_async('_write_pointer_trigger') + \
+                await self._get_async('_trigger_delay_register') + 1
+        return self._decode_trace(channels, shift)
+
+    def _get_trace(self, channels=None):
         """
         Simply pack together channel 1 and channel 2 curves in a numpy array
+
+        Only the data of channels (by default, _acquired_channels()) are
+        transferred, the other channel is NaN.
+        """
+        return self._read_trace(channels).copy()
+
+    async def _get_trace_async(self, channels=None):
+        """
+        Same as _get_trace(), without blocking the event loop during the
+        transfer
         """
-        return np.array((self._get_ch(1), self._get_ch(2)))
+        return (await self._read_trace_async(channels)).copy()
+
+    # PersistenceAccumulator of the acquired traces (see enable_persistence)
+    persistence = None
+
+    def enable_persistence(self, bins=(512, 256), voltage_range=(-1, 1),
+                           decay=None):
+        """
+        Accumulates all acquired traces (not in rolling mode) into a 2D
+        histogram, time x voltage or ch1 x ch2 in xy_mode, and returns the
+        PersistenceAccumulator (see pyrpl.scope_persistence).
+
+        bins: number of bins (x, y)
+        voltage_range: (min, max) of the voltage axes [V]
+        decay: time constant of the exponential decay [traces] (None: the
+            histogram accumulates all traces)
+        """
+        self._persistence_voltage_range = tuple(voltage_range)
+        self.persistence = PersistenceAccumulator(
+            bins, *self._persistence_ranges(), decay=decay)
+        return self.persistence
+
+    def disable_persistence(self):
+        self.persistence = None
+
+    def _persistence_ranges(self):
+        """ (xrange, yrange) of the persistence histogram """
+        voltage_range = self._persistence_voltage_range
+        if self.xy_mode:
+            return voltage_range, voltage_range
+        times = self.times
+        return (times[0], 2 * times[-1] - times[-2]), voltage_range
+
+    # MeasurementEngine for the acquired traces (see enable_measurements)
+    measurements = None
+
+    def enable_measurements(self, names=None, channels=(1, 2)):
+        """
+        Computes the measurements names (by default all, see
+        pyrpl.scope_measurements) on each acquired trace of the channels
+        (not in rolling mode) and returns the MeasurementEngine. The results
+        and their statistics are emitted with display_curve and saved with
+        the curves.
+        """
+        self.measurements = MeasurementEngine(names, channels)
+        return self.measurements
+
+    def disable_measurements(self):
+        self.measurements = None
+
+    def _accumulate(self, trace):
+        super(Scope, self)._accumulate(trace)
+        if self.persistence is not None:
+            if self.xy_mode:
+                self.persistence.accumulate(trace[0], trace[1])
+            else:
+                self.persistence.accumulate(self.data_x, trace)
+        if self.measurements is not None:
+            self.measurements.measure(self.data_x, trace)
+
+    # AlignedAverager of the acquired traces (see enable_aligned_averaging)
+    aligned_averager = None
+    _alignment_channel = None
+
+    def enable_aligned_averaging(self, max_shift=8, channel=None, batch=8):
+        """
+        Aligns the traces with sub-sample precision before averaging them,
+        which removes the smearing of the average by the trigger jitter,
+        and returns the AlignedAverager (see pyrpl.scope_alignment).
+
+        max_shift: maximum offset of a trace [samples]
+        channel: channel (1 or 2) on which the traces are aligned (None: the
+            trigger channel, or ch1 for other trigger sources)
+        batch: number of traces processed together in continuous mode,
+            where data_avg is updated only every batch traces
+        """
+        self._alignment_channel = channel
+        self.aligned_averager = AlignedAverager(
+            self.data_length, channel=channel or 1, max_shift=max_shift,
+            batch=batch)
+        return self.aligned_averager
+
+    def disable_aligned_averaging(self):
+        self.aligned_averager = None
+
+    def _average(self, trace):
+        """
+        only the acquired channels are averaged, after their alignment if
+        enable_aligned_averaging() was called
+        """
+        averager = self.aligned_averager
+        if averager is not None:
+            averager.add(trace, 1. / self.current_avg,
+                         self._acquired_channels())
+            # only continuous acquisitions are processed in batches, such
+            # that a single acquisition never returns a partial average
+            if self.running_state in ['running_single', 'paused_single'] \
+                    or averager.average is None:
+                averager.flush()
+            return averager.average
+        data_avg = np.full(trace.shape, np.nan)
+        for ch in self._acquired_channels():
+            if np.isnan(self.data_avg[ch - 1, 0]):
+                # the channel was not acquired for the previous trace (the
+                # channel toggles do not restart the averaging)
+                data_avg[ch - 1] = trace[ch - 1]
+            else:
+                data_avg[ch - 1] = (self.data_avg[ch - 1] *
+                                    (self.current_avg - 1) +
+                                    trace[ch - 1]) / self.current_avg
+        return data_avg
+
+    _pushed_trigger_timestamp = None  # trigger timestamp of the last pushed trace
+
+    async def _trace_async(self, min_delay_s):
+        """
+        If the monitor_server supports it, the server watches the scope
+        state and pushes the trace as soon as it has been acquired.
+        Otherwise, the scope state is polled as for other acquisition
+        modules. The trace is returned in the shared trace buffer (see
+        _read_trace). The wait for a pushed trace is bounded by
+        trigger_timeout as in _data_ready_async.
+        """
+        self._start_trace_acquisition()
+        scope_trace_async = getattr(self._client, 'scope_trace_async', None)
+        if scope_trace_async is None:
+            await self._data_ready_async(min_delay_s)
+            return await self._read_trace_async()
+        start = time()
+        channels = self._acquired_channels()
+        pushed = channels or (1, 2)
+        timeout = None
+        if self.trigger_timeout is not None:
+            timeout = max(self._remaining_time(), 0) + self.trigger_timeout
+        try:
+            # cancelled on timeout, which abandons the request
+            data = await asyncio.wait_for(scope_trace_async(
+                self.addr_base, self.data_length, pushed), timeout)
+        except asyncio.TimeoutError:
+            if self.running_state != 'running_continuous':
+                raise TimeoutError("No scope trigger within %s s."
+                                   % self.trigger_timeout)
+            data = None  # continuous acquisitions keep waiting
+        if data is None:  # no push support, poll the scope state instead
+            await self._data_ready_async(min_delay_s)
+            return await self._read_trace_async()
+        self._pushed_trigger_timestamp = int(data[0]) + (int(data[1]) << 32)
+        for ch, samples in zip(pushed, np.split(data[2:], len(pushed))):
+            self._raw_buffer(ch)[:] = samples
+        trace = self._decode_trace(channels, 0)
+        remaining = min_delay_s - (time() - start)
+        if remaining > 0:
+            await sleep_async(remaining)
+        return trace
+
+    def _trigger_delay_samples(self, length):
+        """
+        Returns the value of the trigger delay register for a trace of
+        length samples, i.e. the number of samples written after the
+        trigger.
+        """
+        # 1. in mode "immediately", trace goes from 0 to duration,
+        if self.trigger_source == 'immediately':
+            return length
+        # 2. triggering on real signal: convert float delay into counts
+        delay = int(np.round(self.trigger_delay / self.sampling_time)) + \
+            length // 2
+        # Do the proper roundings of the trigger delay
+        if delay <= 0:
+            delay = 1  # bug in scope code: 0 does not work
+        elif delay > 2 ** 32 - 1:
+            delay = 2 ** 32 - 1
+        return delay
+
+    def _acquisition_time(self, delay):
+        """
+        Minimum time [s] from arming until the end of the acquisition: the
+        pretrigger part of the buffer (data_length - delay samples) must be
+        written before the trigger is accepted, and delay samples after it.
+        """
+        return max(self.data_length, delay) * self.sampling_time
+
+    _armed_delay = None  # trigger delay of the running acquisition
 
     def _remaining_time(self):
         """
-        :returns curve duration - ellapsed duration since last setup() call.
+        :returns minimum acquisition time - ellapsed time since the
+        acquisition was started.
+        """
+        if self._armed_delay is None:
+            acquisition_time = self.duration
+        else:
+            acquisition_time = self._acquisition_time(self._armed_delay)
+        return acquisition_time - (time() - self._last_time_setup)
+
+    # While the scope waits for its trigger, the status is polled with
+    # intervals growing from trigger_poll_min to trigger_poll_max [s].
+    trigger_poll_min = 0.001
+    trigger_poll_max = 0.05
+    # maximum time [s] that segmented() and single acquisitions wait for
+    # each trigger (None: no limit). Continuous acquisitions wait until
+    # they are stopped, polling the scope once a pushed trace is overdue.
+    trigger_timeout = 10.
+
+    async def _status_async(self):
+        """ (_trigger_armed, _trigger_delay_running) from one read """
+        state = int((await self._reads_async(0x0, 1))[0])
+        return (type(self)._trigger_armed.to_python(self, state),
+                type(self)._trigger_delay_running.to_python(self, state))
+
+    async def _data_ready_async(self, min_delay_s):
+        """
+        Sleeps until the predicted end of the acquisition and reads the
+        status once. While the scope waits for the trigger, the status is
+        polled at growing intervals, for at most trigger_timeout outside
+        of continuous acquisitions. Once the trigger has arrived, the
+        remaining time is computed from the fpga timestamps.
         """
-        return self.duration - (time() - self._last_time_setup)
+        await sleep_async(max(self._remaining_time(), min_delay_s))
+        start = time()
+        interval = self.trigger_poll_min
+        while self._acquisition_started:
+            armed, delay_running = await self._status_async()
+            if armed:  # waiting for the trigger
+                if self.trigger_timeout is not None and \
+                        self.running_state != 'running_continuous' and \
+                        time() - start > self.trigger_timeout:
+                    raise TimeoutError("No scope trigger within %s s."
+                                       % self.trigger_timeout)
+                await sleep_async(max(interval, min_delay_s))
+                interval = min(2 * interval, self.trigger_poll_max)
+            elif delay_running:  # acquisition of the samples after trigger
+                # 64 bit timestamps (low word first), the low words alone
+                # wrap around every 34 s
+                words = [int(v) for v in await self._reads_async(0x15C, 4)]
+                current = words[0] + (words[1] << 32)
+                trigger = words[2] + (words[3] << 32)
+                elapsed = (current - trigger) * 8e-9
+                remaining = self._armed_delay * self.sampling_time - elapsed
+                await sleep_async(max(remaining, min_delay_s))
+            else:
+                return
 
     async def _do_average_continuous_async(self):
         if not self._is_rolling_mode_active():
@@ -595,8 +995,31 @@ class Scope(HardwareModule, AcquisitionModule):
             self._start_acquisition_rolling_mode()
             while(self.running_state=="running_continuous"):
                 await sleep_async(self.MIN_DELAY_CONTINUOUS_ROLLING_MS*0.001)
-                self.data_x, self.data_avg = self._get_rolling_curve()
-                self._emit_signal_by_name('display_curve', [self.data_x, self.data_avg])
+                self.data_x, self.data_avg = \
+                    await self._get_rolling_curve_async()
+                self._emit_signal_by_name('display_curve',
+                                          self._display_curve())
+
+    # number of points of the curves emitted with display_curve, set by the
+    # ScopeWidget to twice its width in pixels (None: full resolution).
+    # data_x and data_avg always keep the full resolution.
+    display_points = None
+
+    def _display_curve(self):
+        """
+        min/max-decimates the curves to display_points points. Curves for
+        xy-mode or channel math are emitted with full resolution. The
+        summary of the measurements (if enabled) is appended.
+        """
+        if self.display_points is None or self.xy_mode or \
+                self.ch_math_active:
+            curve = [self.data_x, self.data_avg]
+        else:
+            curve = list(minmax_decimate(self.data_x, self.data_avg,
+                                         self.display_points))
+        if self.measurements is not None:
+            curve.append(self.measurements.summary())
+        return curve
 
     def _data_ready(self):
         """
@@ -604,6 +1027,10 @@ class Scope(HardwareModule, AcquisitionModule):
         """
         return self.curve_ready()
 
+    async def _data_ready_async_check(self):
+        armed, delay_running = await self._status_async()
+        return not armed and not delay_running and self._acquisition_started
+
     def _start_trace_acquisition(self):
         """
         Start acquisition of a curve in rolling_mode=False
@@ -617,21 +1044,9 @@ class Scope(HardwareModule, AcquisitionModule):
         # 0. reset state machine
         self._reset_writestate_machine = True
 
-        # set the trigger delay:
-        # 1. in mode "immediately", trace goes from 0 to duration,
-        if self.trigger_source == 'immediately':
-            self._trigger_delay_register = self.data_length
-        else: #  2. triggering on real signal
-            #  a. convert float delay into counts
-            delay = int(np.round(self.trigger_delay / self.sampling_time)) + \
-                    self.data_length // 2
-            #  b. Do the proper roundings of the trigger delay
-            if delay <= 0:
-                delay = 1  # bug in scope code: 0 does not work
-            elif delay > 2 ** 32 - 1:
-                delay = 2 ** 32 - 1
-            # c. set the trigger_delay in the right fpga register
-            self._trigger_delay_register = delay
+        # set the trigger delay
+        self._armed_delay = self._trigger_delay_samples(self.data_length)
+        self._trigger_delay_register = self._armed_delay
 
         # 4. Arm the trigger: curve acquisition will only start passed this
         self._trigger_armed = True
@@ -646,6 +1061,7 @@ class Scope(HardwareModule, AcquisitionModule):
         self._start_trace_acquisition()
         self._trigger_source_register = 'off'
         self._trigger_armed = True
+        self._rolling_write_pointer = None  # the next readout is complete
 
     # Rolling_mode related methods:
     # -----------------------------
@@ -667,39 +1083,204 @@ class Scope(HardwareModule, AcquisitionModule):
         """
         return self.rolling_mode and self._rolling_mode_allowed()
 
-    def _get_ch_no_roll(self, ch):
-        if ch not in [1, 2]:
-            raise ValueError("channel should be 1 or 2, got " + str(ch))
-        return self._rawdata_ch1 * 1. / 2 ** 13 if ch == 1 else \
-            self._rawdata_ch2 * 1. / 2 ** 13
+    def _write_pointer_and_timestamp(self):
+        """ current write pointer and timestamp, read in one batch """
+        self._prefetch(['_write_pointer_current', 'current_timestamp'])
+        try:
+            return self._write_pointer_current, self.current_timestamp
+        finally:
+            self._prefetched = None
 
-    def _get_rolling_curve(self):
-        datas = np.zeros((2, len(self.times)))
-        # Rolling mode
-        wp0 = self._write_pointer_current  # write pointer
-        # before acquisition
+    def stream(self, filename=None, duration=None, channels=None):
+        """
+        Returns a ScopeStream that records the scope inputs without gaps
+        (see pyrpl.scope_stream). Iterate over it to acquire the data.
+
+        filename: .npy file for the data (None: no file)
+        duration: duration of the recording in seconds (None: unlimited)
+        channels: the recorded channels, by default the active ones
+        """
+        return ScopeStream(self, filename=filename, duration=duration,
+                           channels=channels)
+
+    def segmented(self, segments, length=None, timeout=None):
+        """
+        Acquires segments triggered traces of length samples (default:
+        data_length) back-to-back, e.g. for the statistics of pulse trains
+        or ringdowns. As with single(), each segment is centered at
+        trigger_delay after its trigger.
+
+        Returns (data, timestamps): data is an array of shape (segments,
+        2, length) in volts (NaN for the channels that are not acquired),
+        timestamps holds the trigger_timestamp of each segment [cycles].
+
+        The scope is re-armed by the same batch that transfers the previous
+        segment, right after the data have been read on the board. The
+        triggers arriving during this round trip are missed, and so are
+        those before the buffer holds the data_length - length // 2
+        samples that precede the segment (fpga condition pretrig_ok).
+        timeout [s] limits the wait for each trigger (default:
+        trigger_timeout), a TimeoutError is raised when it expires.
+        """
+        return wait(ensure_future(self.segmented_async(
+            segments, length=length, timeout=timeout)))
+
+    async def segmented_async(self, segments, length=None, timeout=None):
+        """ coroutine version of segmented() """
+        n = self.data_length
+        length = n if length is None else int(length)
+        if not 0 < length <= n:
+            raise ValueError("length must be between 1 and %d, got %d."
+                             % (n, length))
+        if timeout is None:
+            timeout = self.trigger_timeout
+        if self.running_state != 'stopped':
+            self.stop()
+        channels = self._acquired_channels()
+        delay = self._trigger_delay_samples(length)
+        self._trigger_delay_register = delay
+        # reset of the write state machine, arm, trigger source. As with
+        # the BoolRegisters, the other bits of the control word (e.g.
+        # _adc_we_keep) are written back unchanged.
+        control = self._read(0x0) & ~0b111
+        arm = [(0x0, [control | 2]),
+               (0x0, [control | 1,
+                      self._trigger_sources[self.trigger_source]])]
+        acquisition_time = self._acquisition_time(delay)
+        data = np.full((segments, 2, length), np.nan)
+        timestamps = np.zeros(segments, dtype=np.int64)
+        self._transfer_segment([], arm)
+        armed = time()
+        for i in range(segments):
+            await sleep_async(acquisition_time - (time() - armed))
+            wp, timestamps[i] = await self._wait_for_segment_async(timeout)
+            first = (wp + delay + 1 - length) % n
+            ranges = [(first, first + length)] if first + length <= n \
+                else [(first, n), (0, first + length - n)]
+            reads = [(0x10000 * ch + 4 * a, b - a)
+                     for ch in channels for a, b in ranges]
+            results = self._transfer_segment(
+                reads, arm if i < segments - 1 else [])
+            armed = time()
+            for j, ch in enumerate(channels):
+                buffer = np.concatenate(
+                    results[j * len(ranges):(j + 1) * len(ranges)])
+                self._decode(buffer, 0, data[i, ch - 1])
+        return data, timestamps
+
+    def _transfer_segment(self, reads, writes):
+        """
+        Transfers the reads [(addr, length), ...] and then the writes
+        [(addr, values), ...] in one batch, returns the values read.
+        """
+        self._flush_writes()
+        try:
+            batch = self._client.batch()
+        except AttributeError:  # client without batch support
+            results = [self._reads(addr, length) for addr, length in reads]
+            for addr, values in writes:
+                self._writes(addr, values)
+            return results
+        requests = [batch.reads(self._addr_base + addr, length)
+                    for addr, length in reads]
+        for addr, values in writes:
+            batch.writes(self._addr_base + addr, values)
+        batch.send()
+        return [request.result() for request in requests]
+
+    async def _wait_for_segment_async(self, timeout=None):
+        """
+        Polls the scope at intervals growing from trigger_poll_min to
+        trigger_poll_max until the armed acquisition is finished, returns
+        the trigger write pointer and trigger_timestamp.
+        """
+        start = time()
+        interval = self.trigger_poll_min
+        while True:
+            self._prefetch(['_trigger_armed', '_trigger_delay_running',
+                            '_write_pointer_trigger', 'trigger_timestamp'])
+            try:
+                if not (self._trigger_armed or self._trigger_delay_running):
+                    return self._write_pointer_trigger, self.trigger_timestamp
+            finally:
+                self._prefetched = None
+            if timeout is not None and time() - start > timeout:
+                raise TimeoutError("No scope trigger within %s s." % timeout)
+            await sleep_async(interval)
+            interval = min(2 * interval, self.trigger_poll_max)
+
+    # In rolling mode, the raw buffers mirror the circular buffers of the
+    # fpga. Each readout only transfers the samples written since the
+    # previous one (one or two contiguous segments).
+    _rolling_write_pointer = None  # last sample of the previous readout
+    _rolling_time = 0  # time of the previous readout
+    _rolling_channels = ()  # channels mirrored by the previous readout
+
+    def _rolling_segments(self, wp, channels):
+        """
+        Returns the (start, stop) index ranges of the samples of channels
+        written since the previous readout, up to the write pointer wp, and
+        whether the whole buffer must be transferred.
+        """
+        last = self._rolling_write_pointer
+        if last is None or time() - self._rolling_time > self.duration or \
+                tuple(channels) != self._rolling_channels:
+            # buffer fully overwritten, or not mirrored for all channels
+            return [(0, self.data_length)], True
+        if last == wp:  # no new samples
+            return [], False
+        start = (last + 1) % self.data_length
+        if start <= wp:
+            return [(start, wp + 1)], False
+        return [(start, self.data_length), (0, wp + 1)], False
+
+    def _rolling_curve(self, wp, channels, overwritten=0):
+        """
+        Returns times and the curves of the mirrored buffers, ending with
+        the sample at wp. The oldest samples that were overwritten during
+        a full readout are NaN.
+        """
+        self._rolling_write_pointer = wp
+        self._rolling_channels = tuple(channels)
         times = self.times
         times -= times[-1]
-
-        for ch, active in (
-                (0, self.ch1_active),
-                (1, self.ch2_active)):
-            if active:
-                datas[ch] = self._get_ch_no_roll(ch + 1)
-        wp1 = self._write_pointer_current  # write pointer after
-        #  acquisition
-        for index, active in [(0, self.ch1_active),
-                              (1, self.ch2_active)]:
-            if active:
-                data = datas[index]
-                to_discard = (wp1 - wp0) % self.data_length  # remove
-                #  data that have been affected during acq.
-                data = np.roll(data, self.data_length - wp0)[
-                       to_discard:]
-                data = np.concatenate([[np.nan] * to_discard, data])
-                datas[index] = data
+        datas = self._decode_trace(channels, wp + 1).copy()
+        datas[:, :overwritten] = np.nan
         return times, datas
 
+    def _get_rolling_curve(self):
+        channels = self._acquired_channels()
+        start = time()
+        wp = self._write_pointer_current
+        segments, full = self._rolling_segments(wp, channels)
+        for ch in channels:
+            buffer = self._raw_buffer(ch)
+            for a, b in segments:
+                self._reads_into(0x10000 * ch + 4 * a, buffer[a:b])
+        overwritten = 0
+        if full:  # samples after wp might have changed during the transfer
+            overwritten = (self._write_pointer_current - wp) % \
+                self.data_length
+        self._rolling_time = start
+        return self._rolling_curve(wp, channels, overwritten)
+
+    async def _get_rolling_curve_async(self):
+        channels = self._acquired_channels()
+        start = time()
+        wp = await self._get_async('_write_pointer_current')
+        segments, full = self._rolling_segments(wp, channels)
+        for ch in channels:
+            buffer = self._raw_buffer(ch)
+            for a, b in segments:
+                buffer[a:b] = await self._reads_async(0x10000 * ch + 4 * a,
+                                                      b - a)
+        overwritten = 0
+        if full:
+            overwritten = (await self._get_async('_write_pointer_current') -
+                           wp) % self.data_length
+        self._rolling_time = start
+        return self._rolling_curve(wp, channels, overwritten)
+
     # Custom behavior of AcquisitionModule methods for scope:
     # -------------------------------------------------------
 
@@ -715,7 +1296,10 @@ class Scope(HardwareModule, AcquisitionModule):
             if active:
                 d.update({'ch': ch,
                           'name': self.curve_name + ' ch' + str(ch + 1)})
+                if self.measurements is not None:
+                    d['measurements'] = self.measurements.summary()
                 curves[ch] = self._save_curve(self.data_x,
                                               self.data_avg[ch],
                                               **d)
+                self._save_statistics(curves[ch], ch)
         return curves
@@ -30,6 +30,8 @@ class Trig(FilterModule):
 
     armed = BoolRegister(0x100, 0, doc="Set to True to arm trigger")
 
+    _volatile_registers = ["armed", "current_timestamp", "trigger_timestamp"]
+
     auto_rearm = BoolRegister(0x104, 0, doc="Automatically re-arm trigger?")
 
     phase_abs = BoolRegister(0x104, 1, doc="Output the absolute value of the phase")
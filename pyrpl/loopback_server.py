@@ -0,0 +1,372 @@
+"""
+A pure-Python implementation of the monitor_server protocol on localhost.
+
+LoopbackServer speaks the same wire protocol as monitor_server.c (version
+1 and 2 commands, readv/writev and scope push, see the description in
+monitor_server.c), such that MonitorClient and AsyncMonitorClient can be
+benchmarked and tested through real sockets without a Red Pitaya. The
+registers are provided by a memory model, i.e. any object with the methods
+reads(addr, length) and writes(addr, values): by default an ArrayMemory,
+but e.g. a SimulatorClient can be served as well.
+
+The network conditions can be degraded in a controlled way:
+
+- latency: delay in seconds between the reception of a command and the
+  transmission of its reply. Pipelined commands overlap their latencies,
+  as for a real network link.
+- bandwidth: maximum transfer rate in bytes per second in each direction
+  (None for no limit).
+- drop_probability: probability that the connection is dropped instead of
+  executing a command. drop_connections() drops all connections at once.
+
+The server runs its own event loop in a background thread, such that
+blocking clients can be used in the main thread:
+
+    with LoopbackServer(latency=1e-3) as server:
+        client = MonitorClient('127.0.0.1', server.port,
+                               restartserver=server.restart)
+        client.reads(0x40000000, 10)
+"""
+import logging
+import asyncio
+import threading
+import numpy as np
+
+from .redpitaya_client import V2_HEADER, CAP_MULTICLIENT, CAP_VECTOR, \
+    CAP_SCOPE_PUSH, SCOPE_CH1, SCOPE_CH2, STATUS_OK, STATUS_TOO_LONG, \
+    STATUS_CANCELLED
+
+MEMORY_BASE = 0x40000000
+MEMORY_SIZE = 0x800000
+MAX_READ_LENGTH = MEMORY_SIZE // 4
+MAX_WRITE_LENGTH = 65536
+MAX_SCOPE_LENGTH = 16384  # size of the circular buffer of each channel
+SCOPE_POLL_INTERVAL = 100e-6
+
+# scope registers used for pushing traces (see monitor_server.c)
+SCOPE_STATE = 0x0
+SCOPE_ARMED = 1
+SCOPE_DELAY_RUNNING = 4
+SCOPE_TRIGGER_DELAY = 0x10
+SCOPE_WP_TRIGGER = 0x1C
+SCOPE_TRIGGER_TIMESTAMP = 0x164
+SCOPE_DATA = 0x10000
+
+
+class ArrayMemory(object):
+    """
+    The address space 0x40000000 to 0x40800000 of the Red Pitaya as a
+    plain numpy array. Reads outside return zeros, writes outside are
+    ignored, like the local test mode of monitor_server.
+    """
+    def __init__(self):
+        self.memory = np.zeros(MEMORY_SIZE // 4, dtype=np.uint32)
+
+    def reads(self, addr, length):
+        values = np.zeros(length, dtype=np.uint32)
+        start = (addr - MEMORY_BASE) // 4
+        lo, hi = max(start, 0), min(start + length, len(self.memory))
+        if hi > lo:
+            values[lo - start:hi - start] = self.memory[lo:hi]
+        return values
+
+    def writes(self, addr, values):
+        start = (addr - MEMORY_BASE) // 4
+        lo, hi = max(start, 0), min(start + len(values), len(self.memory))
+        if hi > lo:
+            self.memory[lo:hi] = values[lo - start:hi - start]
+
+
+class LoopbackServer(object):
+    def __init__(self, memory=None, host='127.0.0.1', port=0, latency=0.,
+                 bandwidth=None, drop_probability=0., protocol_version=2,
+                 capabilities=CAP_MULTICLIENT | CAP_VECTOR | CAP_SCOPE_PUSH,
+                 max_read_length=MAX_READ_LENGTH,
+                 max_write_length=MAX_WRITE_LENGTH, seed=None):
+        """
+        memory: the memory model (ArrayMemory() if None)
+        port: the port to listen on, 0 to choose a free port
+        protocol_version: with 1, the server behaves like an old
+                 monitor_server that ignores the version request
+        latency, bandwidth, drop_probability: see the module docstring
+        """
+        self.logger = logging.getLogger(name=__name__)
+        self.memory = ArrayMemory() if memory is None else memory
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.drop_probability = drop_probability
+        self.protocol_version = protocol_version
+        self.capabilities = capabilities
+        self.max_read_length = max_read_length
+        self.max_write_length = max_write_length
+        self._random = np.random.RandomState(seed)
+        # statistics for tests and benchmarks
+        self.connections = 0  # number of accepted connections
+        self.commands = 0  # number of executed commands
+        self.dropped = 0  # number of dropped connections
+        self._loop = None
+        self._thread = None
+        self._server = None
+        self._writers = set()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """ starts the server in a background thread and returns self """
+        if self._thread is not None:
+            return self
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(started,),
+                                        name='LoopbackServer')
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        if self._server is None:
+            self._thread.join()
+            self._thread = None
+            raise IOError("LoopbackServer could not listen on %s:%s."
+                          % (self.host, self.port))
+        return self
+
+    def stop(self):
+        """ closes all connections and stops the server """
+        if self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+        self._server = None
+
+    def restart(self):
+        """
+        drops all connections and returns the port, such that the
+        server can serve as restartserver function of MonitorClient
+        """
+        self.drop_connections()
+        return self.port
+
+    def drop_connections(self):
+        """ closes all client connections without further replies """
+        if self._thread is not None:
+            asyncio.run_coroutine_threadsafe(self._drop_all(),
+                                             self._loop).result()
+
+    # the event loop thread
+    def _run(self, started):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            self.logger.error("LoopbackServer failed to start: %s", e)
+            started.set()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        started.set()
+        try:
+            self._loop.run_forever()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+        finally:
+            self._loop.close()
+
+    async def _close(self):
+        self._server.close()
+        await self._drop_all()
+        await self._server.wait_closed()
+
+    async def _drop_all(self):
+        for writer in list(self._writers):
+            self._abort(writer)
+        await asyncio.sleep(0)
+
+    def _abort(self, writer):
+        if writer in self._writers:
+            self._writers.discard(writer)
+            writer.transport.abort()
+
+    async def _throttle(self, nbytes):
+        if self.bandwidth:
+            await asyncio.sleep(nbytes / float(self.bandwidth))
+
+    async def _receive(self, reader, nbytes):
+        data = await reader.readexactly(nbytes)
+        await self._throttle(nbytes)
+        return data
+
+    def _reply(self, replies, *data):
+        replies.put_nowait((self._loop.time() + self.latency, b''.join(data)))
+
+    async def _send_replies(self, writer, replies):
+        while True:
+            due, data = await replies.get()
+            delay = due - self._loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._throttle(len(data))
+            writer.write(data)
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        replies = asyncio.Queue()
+        sender = asyncio.ensure_future(self._send_replies(writer, replies))
+        # the pending scope push of this client: [task, header]
+        scope = [None, None]
+        try:
+            while True:
+                header = await self._receive(reader, 8)
+                if self.drop_probability and \
+                        self._random.uniform() < self.drop_probability:
+                    self.dropped += 1
+                    self.logger.debug("Dropping connection.")
+                    break
+                if header[:1].islower():
+                    keep = await self._process_v1(header, reader, replies)
+                elif self.protocol_version >= 2:
+                    header += await self._receive(reader, 8)
+                    keep = await self._process_v2(header, reader, replies,
+                                                  scope)
+                else:
+                    keep = False
+                if not keep:
+                    break
+                self.commands += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if scope[0] is not None:
+                scope[0].cancel()
+            sender.cancel()
+            self._abort(writer)
+
+    async def _process_v1(self, header, reader, replies):
+        command = header[:1]
+        length = header[2] + (header[3] << 8)
+        addr = int.from_bytes(header[4:], 'little')
+        if command == b'c':
+            return False
+        if command == b'v':
+            if self.protocol_version >= 2:
+                self._reply(replies, V2_HEADER.pack(
+                    b'v', STATUS_OK, self.protocol_version,
+                    self.capabilities, self.max_read_length,
+                    self.max_write_length))
+            return True
+        if length == 0:
+            return True
+        if command == b'r':
+            self._reply(replies, header,
+                        self.memory.reads(addr, length).tobytes())
+            return True
+        if command == b'w':
+            data = await self._receive(reader, 4 * length)
+            self.memory.writes(addr, np.frombuffer(data, dtype=np.uint32))
+            self._reply(replies, header)
+            return True
+        self.logger.error("Unknown control character %s - server and client "
+                          "out of sync.", command)
+        return False
+
+    async def _process_v2(self, header, reader, replies, scope):
+        command, _, _, request_id, length, addr = V2_HEADER.unpack(header)
+
+        def reply(status, n, *data):
+            self._reply(replies, V2_HEADER.pack(command, status, 0,
+                                                request_id, n, addr), *data)
+        if command == b'C':
+            return False
+        if command == b'R':
+            if length > self.max_read_length:
+                reply(STATUS_TOO_LONG, 0)
+            else:
+                reply(STATUS_OK, length,
+                      self.memory.reads(addr, length).tobytes())
+        elif command == b'W':
+            data = await self._receive(reader, 4 * length)
+            if length > self.max_write_length:
+                reply(STATUS_TOO_LONG, 0)
+            else:
+                self.memory.writes(addr, np.frombuffer(data, dtype=np.uint32))
+                reply(STATUS_OK, length)
+        elif command in (b'V', b'X') and self.capabilities & CAP_VECTOR:
+            if 2 * length > self.max_write_length:
+                if command == b'X':  # the length of the data is unknown
+                    return False
+                await self._receive(reader, 8 * length)
+                reply(STATUS_TOO_LONG, 0)
+                return True
+            segments = np.frombuffer(await self._receive(reader, 8 * length),
+                                     dtype=np.uint32).reshape(-1, 2)
+            total = int(segments[:, 1].sum(dtype=np.uint64))
+            if command == b'V':
+                if total > self.max_read_length:
+                    reply(STATUS_TOO_LONG, 0)
+                else:
+                    reply(STATUS_OK, total, *[
+                        self.memory.reads(int(a), int(n)).tobytes()
+                        for a, n in segments])
+            else:
+                data = np.frombuffer(await self._receive(reader, 4 * total),
+                                     dtype=np.uint32)
+                if 2 * length + total > self.max_write_length:
+                    reply(STATUS_TOO_LONG, 0)
+                else:
+                    for (a, n), values in zip(segments, np.split(
+                            data, np.cumsum(segments[:-1, 1]))):
+                        self.memory.writes(int(a), values)
+                    reply(STATUS_OK, total)
+        elif command == b'S' and self.capabilities & CAP_SCOPE_PUSH:
+            if length == 0 or length > MAX_SCOPE_LENGTH:
+                reply(STATUS_TOO_LONG, 0)
+            else:
+                if scope[0] is not None:
+                    scope[0].cancel()
+                    self._reply(replies, scope[1][:1] +
+                                bytes([STATUS_CANCELLED]) + scope[1][2:8] +
+                                bytes(4) + scope[1][12:])
+                scope[1] = header
+                scope[0] = asyncio.ensure_future(
+                    self._push_scope_trace(header, replies, scope))
+        else:
+            self.logger.error("Unknown control character %s - server and "
+                              "client out of sync.", command)
+            return False
+        return True
+
+    async def _push_scope_trace(self, header, replies, scope):
+        """ waits for the end of the acquisition and sends the trace """
+        command, flags, _, request_id, n, addr = V2_HEADER.unpack(header)
+        channels = flags & (SCOPE_CH1 | SCOPE_CH2) or SCOPE_CH1 | SCOPE_CH2
+        memory = self.memory
+        while memory.reads(addr + SCOPE_STATE, 1)[0] & \
+                (SCOPE_ARMED | SCOPE_DELAY_RUNNING):
+            await asyncio.sleep(SCOPE_POLL_INTERVAL)
+        delay = int(memory.reads(addr + SCOPE_TRIGGER_DELAY, 1)[0])
+        wp_trigger = int(memory.reads(addr + SCOPE_WP_TRIGGER, 1)[0])
+        # the last n samples up to the end of the acquisition at
+        # wp_trigger + delay
+        indices = (wp_trigger + delay + 1 - n + np.arange(n)) \
+            % MAX_SCOPE_LENGTH
+        data = [memory.reads(addr + SCOPE_TRIGGER_TIMESTAMP, 2)]
+        for flag, offset in ((SCOPE_CH1, SCOPE_DATA),
+                             (SCOPE_CH2, 2 * SCOPE_DATA)):
+            if channels & flag:
+                data.append(memory.reads(addr + offset,
+                                         MAX_SCOPE_LENGTH)[indices])
+        data = np.concatenate(data)
+        scope[0], scope[1] = None, None
+        self._reply(replies, V2_HEADER.pack(command, STATUS_OK, 0, request_id,
+                                            len(data), addr), data.tobytes())
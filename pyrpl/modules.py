@@ -15,7 +15,7 @@ their attributes in the GUI having their state load and saved in the config
 file.
 """
 
-from .attributes import BaseAttribute, ModuleAttribute
+from .attributes import BaseAttribute, BaseRegister, ModuleAttribute
 from .widgets.module_widgets import ModuleWidget
 from .curvedb import CurveDB
 from .pyrpl_utils import unique_list, DuplicateFilter
@@ -157,6 +157,7 @@ class ModuleMetaClass(type):
             # a. generate a setup function
             def setup(self, **kwds):
                 self._setup_ongoing = True
+                self._begin_write_coalescing()
                 try:
                     # user can redefine any setup_attribute through kwds
                     for key in self._setup_attributes:
@@ -172,6 +173,7 @@ class ModuleMetaClass(type):
                         self._setup()
                 finally:
                     self._setup_ongoing = False
+                    self._end_write_coalescing()
             # b. place the new setup function in the module class
             self.setup = setup
         # 3. if setup has no docstring, then make one
@@ -235,15 +237,20 @@ class DoSetup(object):
             # even if _setup fails, _setup_ongoing is False afterwards or in
             # the next call to _setup()
             assert self._setup_ongoing == False
+
+    Register writes of a HardwareModule inside the block are coalesced
+    and transmitted at its end (see HardwareModule._writes).
     """
     def __init__(self, parent):
         self.parent = parent
 
     def __enter__(self):
         self.parent._setup_ongoing = True
+        self.parent._begin_write_coalescing()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.parent._setup_ongoing = False
+        self.parent._end_write_coalescing()
         if exc_type is not None:
             self.parent._logger.warning("Exception %s was raised while "
                                         "_setup_ongoing was True: %s, %s",
@@ -404,6 +411,16 @@ class Module(with_metaclass(ModuleMetaClass, object)):
         """
         return self.name.rstrip(string.digits)
 
+    def _begin_write_coalescing(self):
+        """
+        Called when a setup starts. HardwareModule buffers its register
+        writes until the matching call of _end_write_coalescing().
+        """
+        pass
+
+    def _end_write_coalescing(self):
+        pass
+
     def _init_module(self):
         """
         To implement in child class if needed.
@@ -732,6 +749,25 @@ class HardwareModule(Module):
 
     parent = None  # parent will be redpitaya instance
 
+    _prefetched = None  # {addr: value} of a running batch readout
+
+    # [[addr, values], ...] of the writes coalesced during a setup, in the
+    # order in which they were issued (None while not coalescing)
+    _write_buffer = None
+    _write_coalescing_depth = 0
+    # all modules that are coalescing writes, whose buffers are flushed
+    # before any module reads a register that might depend on them
+    _coalescing_modules = set()
+    # longer writes (e.g. waveform data) are never buffered
+    _max_coalesced_length = 4096
+
+    # Set shadow_registers to True (per module class or instance) to serve
+    # reads of all registers that only change when they are written from a
+    # local copy (write-through cache). Registers that change by themselves
+    # (data, timestamps, status flags) must be listed in _volatile_registers.
+    shadow_registers = False
+    _volatile_registers = []
+
     def __init__(self, parent, name=None):
         """ Creates the prototype of a RedPitaya Module interface
 
@@ -740,6 +776,11 @@ class HardwareModule(Module):
         self._client = parent.client
         self._addr_base = self.addr_base
         self._rp = parent
+        # shadow register file, shared between the modules of one board
+        try:
+            self._shadow = parent._shadow_registers
+        except AttributeError:
+            self._shadow = dict()
         super(HardwareModule, self).__init__(parent, name=name)
         #self.__doc__ = "Available registers: \r\n\r\n" + self.help()
 
@@ -766,11 +807,317 @@ class HardwareModule(Module):
                                  "'frequency_correction'. ", self.name)
             return 1.0
 
+    @Module.setup_attributes.getter
+    def setup_attributes(self):
+        """
+        :return: a dict with the current values of the setup attributes.
+        All registers are read from the board in a single batch before the
+        values are assembled.
+        """
+        if self._prefetched is not None:  # nested call
+            return Module.setup_attributes.fget(self)
+        self._prefetch(self._setup_attributes)
+        try:
+            return Module.setup_attributes.fget(self)
+        finally:
+            self._prefetched = None
+
+    @classmethod
+    def _register_addresses(cls, attribute_names):
+        """
+        Returns the set of all (relative) addresses occupied by the
+        registers among attribute_names.
+        """
+        addresses = set()
+        for name in attribute_names:
+            attribute = getattr(cls, name, None)
+            if isinstance(attribute, BaseRegister):
+                size = getattr(attribute, 'size', 1)
+                for i in range(size):
+                    addresses.add(attribute.address + 4 * i)
+                for extra in ['read_address', 'write_address']:  # IORegister
+                    if hasattr(attribute, extra):
+                        addresses.add(getattr(attribute, extra))
+        return addresses
+
+    @staticmethod
+    def _contiguous_ranges(addresses):
+        """
+        Returns a sorted list of contiguous (addr, length) ranges that cover
+        all addresses.
+        """
+        ranges = []
+        for addr in sorted(addresses):
+            if ranges and ranges[-1][0] + 4 * ranges[-1][1] == addr:
+                ranges[-1][1] += 1
+            else:
+                ranges.append([addr, 1])
+        return [tuple(r) for r in ranges]
+
+    def _register_ranges(self, attribute_names):
+        """
+        Returns a sorted list of contiguous (addr, length) ranges that cover
+        all registers among attribute_names.
+        """
+        return self._contiguous_ranges(
+            self._register_addresses(attribute_names))
+
+    def _prefetch(self, attribute_names):
+        """
+        Reads all registers of attribute_names in one batch. Until
+        self._prefetched is reset to None, reads of these registers are
+        served from the prefetched values.
+        """
+        self._flush_writes()  # the board must hold all written values
+        prefetched = dict()
+        addresses = self._register_addresses(attribute_names)
+        if self.shadow_registers:  # no need to fetch shadowed registers
+            for addr in self._cacheable_addresses() & addresses:
+                if self._addr_base + addr in self._shadow:
+                    prefetched[addr] = self._shadow[self._addr_base + addr]
+            addresses -= set(prefetched.keys())
+        try:
+            batch = self._client.batch()
+        except AttributeError:  # client without batch support
+            return
+        requests = [(addr, batch.reads(self._addr_base + addr, length))
+                    for addr, length in self._contiguous_ranges(addresses)]
+        batch.send()
+        for addr, request in requests:
+            values = request.result()
+            self._update_shadow(addr, values, fetched=True)
+            for i, value in enumerate(values):
+                prefetched[addr + 4 * i] = value
+        self._prefetched = prefetched
+
+    # Shadow register file
+    # --------------------
+
+    @classmethod
+    def _cacheable_addresses(cls):
+        """
+        Returns the set of (relative) addresses of all registers of the
+        module that only change when they are written, i.e. the addresses of
+        all registers except for those listed in _volatile_registers.
+        """
+        if '_cacheable_addresses_cache' not in cls.__dict__:
+            volatile_names = set()
+            for base in cls.__mro__:
+                volatile_names.update(base.__dict__.get('_volatile_registers',
+                                                        []))
+            names = [name for name in dir(cls)
+                     if isinstance(getattr(cls, name, None), BaseRegister)]
+            cacheable = cls._register_addresses(
+                [name for name in names if name not in volatile_names])
+            volatile = cls._register_addresses(
+                [name for name in names if name in volatile_names])
+            cls._cacheable_addresses_cache = frozenset(cacheable - volatile)
+            cls._volatile_addresses_cache = frozenset(volatile)
+        return cls._cacheable_addresses_cache
+
+    @classmethod
+    def _volatile_addresses(cls):
+        """
+        Returns the set of (relative) addresses of the registers listed in
+        _volatile_registers.
+        """
+        cls._cacheable_addresses()
+        return cls._volatile_addresses_cache
+
+    def clear_shadow_registers(self):
+        """
+        Forgets all shadowed register values, such that subsequent reads
+        are served by the board again. Call this after the board state was
+        modified from outside this python session.
+        """
+        self._shadow.clear()
+
+    def _update_shadow(self, addr, values, fetched=False):
+        """
+        Write-through of values to the shadow register file. fetched=True
+        indicates that the values were just read from the board.
+        """
+        if self.shadow_registers:
+            cacheable = self._cacheable_addresses()
+        elif not self._shadow or fetched:
+            return
+        else:
+            cacheable = ()
+        for i, value in enumerate(values):
+            key = self._addr_base + addr + 4 * i
+            # also update registers that were shadowed by another module
+            if addr + 4 * i in cacheable or key in self._shadow:
+                self._shadow[key] = int(value)
+
+    def _cached_reads(self, addr, length):
+        """
+        Returns the values from coalesced writes, prefetched or shadowed
+        registers, or None if they must be read from the board.
+        """
+        if not self._cacheable_range(addr, length):
+            # e.g. status registers, possibly of another module
+            self._flush_all_writes()
+        elif self._write_buffer:
+            values = self._buffered_reads(addr, length)
+            if values is not None:
+                return values
+        if self._prefetched is not None:
+            try:
+                return np.array([self._prefetched[addr + 4 * i]
+                                 for i in range(length)], dtype=np.uint32)
+            except KeyError:
+                pass
+        if self.shadow_registers:
+            try:
+                return np.array([self._shadow[self._addr_base + addr + 4 * i]
+                                 for i in range(length)], dtype=np.uint32)
+            except KeyError:
+                pass
+        return None
+
+    def _update_prefetched(self, addr, values):
+        if self._prefetched is not None:  # keep prefetched values up to date
+            for i, value in enumerate(values):
+                if addr + 4 * i in self._prefetched:
+                    self._prefetched[addr + 4 * i] = value
+
     def _reads(self, addr, length):
-        return self._client.reads(self._addr_base + addr, length)
+        values = self._cached_reads(addr, length)
+        if values is None:
+            values = self._client.reads(self._addr_base + addr, length)
+            self._update_shadow(addr, values, fetched=True)
+        return values
+
+    def _reads_into(self, addr, out):
+        """
+        Same as _reads(addr, len(out)), but fills the uint32 array out
+        without allocating a new array, and returns out.
+        """
+        values = self._cached_reads(addr, len(out))
+        if values is None:
+            self._client.reads_into(self._addr_base + addr, out)
+            self._update_shadow(addr, out, fetched=True)
+        else:
+            out[:] = values
+        return out
+
+    # Write coalescing
+    # ----------------
+    # During setup() and inside 'with module.do_setup:' blocks, register
+    # writes are buffered. Writes to consecutive addresses are merged into
+    # one burst, and all bursts are transmitted in a single batch at the
+    # end of the block. Every write still reaches the board, in the
+    # original order, such that e.g. reset pulses (writing 1, then 0 to the
+    # same bit) are preserved. Reads of buffered registers return the
+    # buffered values. Reads that partially overlap the buffer flush it
+    # first, and reads of volatile registers flush the buffers of all
+    # modules. Writes to volatile registers (e.g. arm or reset bits) and
+    # the writes of modules that are not coalescing are never buffered:
+    # they flush the buffers of all modules and go straight to the board,
+    # such that they keep their place in the order of the writes.
+
+    def _begin_write_coalescing(self):
+        self._write_coalescing_depth += 1
+        if self._write_buffer is None:
+            self._write_buffer = []
+            HardwareModule._coalescing_modules.add(self)
+
+    def _end_write_coalescing(self):
+        self._write_coalescing_depth = max(self._write_coalescing_depth - 1,
+                                           0)
+        if self._write_coalescing_depth == 0:
+            try:
+                self._flush_writes()
+            finally:
+                self._write_buffer = None
+                HardwareModule._coalescing_modules.discard(self)
+
+    @classmethod
+    def _flush_all_writes(cls):
+        """ transmits the coalesced writes of all modules """
+        for module in list(HardwareModule._coalescing_modules):
+            module._flush_writes()
+
+    def _cacheable_range(self, addr, length):
+        """
+        True if all registers between addr and addr + 4 * length are
+        cacheable (see _cacheable_addresses)
+        """
+        cacheable = self._cacheable_addresses()
+        return addr in cacheable and all(a in cacheable for a in
+                                         range(addr + 4, addr + 4 * length,
+                                               4))
+
+    def _volatile_range(self, addr, length):
+        """
+        True if any register between addr and addr + 4 * length is
+        volatile (see _volatile_addresses)
+        """
+        volatile = self._volatile_addresses()
+        return bool(volatile) and any(a in volatile for a in
+                                      range(addr, addr + 4 * length, 4))
+
+    def _flush_writes(self):
+        """ transmits the coalesced writes in one batch """
+        buffer = self._write_buffer
+        if not buffer:
+            return
+        self._write_buffer = []
+        try:
+            batch = self._client.batch()
+        except AttributeError:  # client without batch support
+            for addr, values in buffer:
+                self._client.writes(self._addr_base + addr, values)
+            return
+        for addr, values in buffer:
+            batch.writes(self._addr_base + addr, values)
+        batch.send()
+
+    def _coalesce_writes(self, addr, values):
+        buffer = self._write_buffer
+        if buffer and buffer[-1][0] + 4 * len(buffer[-1][1]) == addr \
+                and len(buffer[-1][1]) + len(values) \
+                <= self._max_coalesced_length:
+            buffer[-1][1] = np.concatenate((buffer[-1][1], values))
+        else:
+            buffer.append([addr, values])
+
+    def _buffered_reads(self, addr, length):
+        """
+        Returns the latest buffered values if all (cacheable) registers
+        between addr and addr + 4 * length are buffered. Otherwise, the
+        buffer is flushed if it overlaps these registers, and None is
+        returned.
+        """
+        stop = addr + 4 * length
+        values, covered = None, None
+        for start, data in self._write_buffer:  # later writes win
+            a, b = max(addr, start), min(stop, start + 4 * len(data))
+            if a >= b:
+                continue
+            if values is None:
+                values = np.empty(length, dtype=np.uint32)
+                covered = np.zeros(length, dtype=bool)
+            values[(a - addr) // 4:(b - addr) // 4] = \
+                data[(a - start) // 4:(b - start) // 4]
+            covered[(a - addr) // 4:(b - addr) // 4] = True
+        if values is None:
+            return None
+        if covered.all():
+            return values
+        self._flush_writes()
+        return None
 
     def _writes(self, addr, values):
-        self._client.writes(self._addr_base + addr, values)
+        self._update_prefetched(addr, values)
+        if self._write_buffer is not None \
+                and len(values) <= self._max_coalesced_length \
+                and not self._volatile_range(addr, len(values)):
+            self._coalesce_writes(addr, np.array(values, dtype=np.uint32))
+        else:
+            self._flush_all_writes()  # keep the order of the writes
+            self._client.writes(self._addr_base + addr, values)
+        self._update_shadow(addr, values)
 
     def _read(self, addr):
         return int(self._reads(addr, 1)[0])
@@ -778,6 +1125,34 @@ class HardwareModule(Module):
     def _write(self, addr, value):
         self._writes(addr, [int(value)])
 
+    # Coroutines for register access that do not block the event loop. Only
+    # use these inside other coroutines.
+    async def _reads_async(self, addr, length):
+        values = self._cached_reads(addr, length)
+        if values is None:
+            values = await self._client.reads_async(self._addr_base + addr,
+                                                    length)
+            self._update_shadow(addr, values, fetched=True)
+        return values
+
+    async def _writes_async(self, addr, values):
+        if self._write_buffer is not None:
+            return self._writes(addr, values)
+        self._update_prefetched(addr, values)
+        self._flush_all_writes()  # keep the order of the writes
+        await self._client.writes_async(self._addr_base + addr, values)
+        self._update_shadow(addr, values)
+
+    async def _read_async(self, addr):
+        return int((await self._reads_async(addr, 1))[0])
+
+    async def _write_async(self, addr, value):
+        await self._writes_async(addr, [int(value)])
+
+    async def _get_async(self, name):
+        """ returns the value of the register 'name' """
+        return await getattr(type(self), name).get_value_async(self)
+
     def _to_pyint(self, v, bitlength=14):
         v = v & (2 ** bitlength - 1)
         if v >> (bitlength - 1):
@@ -1,10 +1,10 @@
- /* COPYRIGHT NOTICE OF MONITOR.C 
+ /* COPYRIGHT NOTICE OF MONITOR.C
  * $Id$
  *
  * @brief Simple program to read/write from/to any location in memory.
  *
  * @Author Crt Valentincic <crt.valentincic@redpitaya.com>
- *         
+ *
  * (c) Red Pitaya  http://www.redpitaya.com
  *
  * This part of code is written in C programming language.
@@ -28,35 +28,86 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
-############################################################################### 
+###############################################################################
  */
 
 
 
- 
-/* 
+
+/*
 Communication protocol for the data server:
 
-The program is launched on the redpitaya with 
+The program is launched on the redpitaya with
+
+./monitor-server PORT-NUMBER, where the default port number is 2222.
+
+./monitor-server PORT-NUMBER -l starts the server in local test mode: instead
+of the FPGA registers, an anonymous memory block of the same size is served.
+This allows to build and benchmark the server on any Linux PC (make local).
 
-./monitor-server PORT-NUMBER, where the default port number is 2222.  
+We allow for bidirectional data transfer. Any number of clients (python
+programs) can connect to the server at the same time. Each client sends
+commands of 8 bytes:
+Byte 1 is interpreted as a character: 'r' for read and 'w' for write, and 'c' for close. All other messages are ignored.
+Byte 2 is reserved.
+Bytes 3+4 are interpreted as unsigned int. This number n is the amount of 4-byte-units to be read or written. Maximum is 2^16.
+Bytes 5-8 are the start address to be written to.
 
-We allow for bidirectional data transfer. The client (python program) connects to the server, which in return accepts the connection. 
-The client sends 8 bytes of data:
-Byte 1 is interpreted as a character: 'r' for read and 'w' for write, and 'c' for close. All other messages are ignored. 
-Byte 2 is reserved. 
-Bytes 3+4 are interpreted as unsigned int. This number n is the amount of 4-byte-units to be read or written. Maximum is 2^16. 
-Bytes 5-8 are the start address to be written to. 
+If the command is read, the server will send back the 8 command bytes, followed by the requested 4*n bytes.
+If the command is write, the server will wait for 4*n bytes of data from the client and write them to the designated FPGA address space.
+After this, it sends back the 8 command bytes.
+Commands with n=0 are ignored.
+If the command is close, or if the connection is broken, the connection to this client is closed.
+If an unknown command is received, the connection to this client is closed, too.
 
-If the command is read, the server will then send the requested 4*n bytes to the client. 
-If the command is write, the server will wait for 4*n bytes of data from the server and write them to the designated FPGA address space. 
-If the command is close, or if the connection is broken, the server program will terminate. 
+Protocol version 2
+------------------
+Commands of version 2 are denoted by capital letters and have a 16 byte header (all numbers little-endian):
+Byte 1: command character
+Byte 2: flags (channels of the 'S' command, otherwise send 0)
+Bytes 3+4: reserved, send 0
+Bytes 5-8: request id, an arbitrary number that is copied into the reply
+Bytes 9-12: length n (32 bit)
+Bytes 13-16: address
 
-After this, the server will wait for the next command. 
+'R' (read): the server replies with a header followed by 4*n bytes of data.
+'W' (write): the header is followed by 4*n bytes of data. The server replies with a header.
+'V' (readv): n is a number of segments. The header is followed by n pairs of 32 bit numbers (address, length).
+             The server replies with a header followed by the data of all segments.
+'X' (writev): like readv, but the segment list is followed by the data to write into all segments.
+              The server replies with a header.
+'S' (scope trace): n is the number of samples per channel and the address is the base address of the scope.
+             The flags select the channels (bit 0: channel 1, bit 1: channel 2, 0: both channels).
+             Once the scope is neither armed nor waiting for the end of the trigger delay, the server replies
+             with a header of length 2 + k*n for k selected channels, followed by the 64 bit trigger
+             timestamp and the last n samples of each selected channel up to the end of the acquisition,
+             in the order in which they were acquired. The scope state is polled by the server, i.e. the
+             command should be sent after the scope has been armed.
+             A client can wait for one trace at a time: a new 'S' command cancels the previous one, whose
+             reply then has the status 2.
+'C' (close): closes the connection.
+
+The reply header has the same format: Byte 1 is the command character, Byte 2 a status (0: success,
+1: the request exceeded the maximum length and was not executed, 2: the request was cancelled), bytes 5-8 the request id of the
+command, bytes 9-12 the number of words that follow the reply header (read commands) or that were
+written (write commands), and bytes 13-16 the address of the command.
+
+Both protocol versions can be mixed on the same connection. A client finds out whether the server
+supports version 2 by sending the version 1 command 'v' with n=0. A version 1 server ignores this
+command, whereas a version 2 server replies with a 16 byte header: Byte 1 is 'v', Byte 2 is 0,
+bytes 3+4 hold the protocol version, bytes 5-8 a bitfield of capabilities (see CAP_*), bytes 9-12 the
+maximum length of a read (in words) and bytes 13-16 the maximum length of the data of a write, readv
+or writev command including the segment list (in words).
+
+The commands of each client are executed in the order in which they are received, and the client may send
+further commands before the replies to the previous ones have arrived (pipelining).
+Commands of different clients are interleaved.
+
+The server is event-driven: all sockets are non-blocking and are monitored with epoll. Each client has an
+input buffer where commands are assembled, and an output queue for the replies. A client whose output
+queue is full is not read from until the queue has been transmitted.
 */
- 
- /* for now the program is utterly unoptimized... */
- 
+
 #define _GNU_SOURCE
 
 
@@ -70,218 +121,713 @@ After this, the server will wait for the next command.
 #include <ctype.h>
 #include <sys/types.h>
 #include <sys/mman.h>
+#include <sys/epoll.h>
+#include <sys/timerfd.h>
 #include <stdint.h>
 #include <sys/socket.h>
 #include <netinet/in.h>
+#include <netinet/tcp.h>
 
 void error(const char *msg);
 
 #define FATAL do { fprintf(stderr,"Error at line %d, file %s (%d) [%s]\n", __LINE__, __FILE__, errno, strerror(errno)); \
 									error("FATAL ERROR"); exit(1); } while(0)
- 
-//#define MAP_SIZE 4096UL
-//#define MAP_SIZE 65536UL
-#define MAP_SIZE 131072UL
+
 //allowed address space: 0x40000000 to 0x40800000 has size 0x800000 = 128*65536 = 8388608
-//#define MAP_SIZE 8388608UL
-#define MAP_MASK (MAP_SIZE - 1)
+#define MAP_ADDR 0x40000000UL
+#define MAP_SIZE 8388608UL
+//size of the mapping for accesses outside the allowed address space
+#define SLOW_MAP_SIZE 131072UL
+#define SLOW_MAP_MASK (SLOW_MAP_SIZE - 1)
 #define MAX_LENGTH 65535
 
+#define HEADER_SIZE 8
+#define V2_HEADER_SIZE 16
+#define PROTOCOL_VERSION 2
+//capabilities of the server
+#define CAP_MULTICLIENT 1  //several clients can be connected at once
+#define CAP_VECTOR 2  //readv and writev commands
+#define CAP_SCOPE_PUSH 4  //scope trace command
+//maximum length of version 2 commands (in words)
+#define MAX_READ_LENGTH (MAP_SIZE / 4)
+#define MAX_WRITE_LENGTH 65536
+//status of a version 2 reply
+#define STATUS_OK 0
+#define STATUS_TOO_LONG 1
+#define STATUS_CANCELLED 2
+//scope registers (offsets from the scope base address)
+#define SCOPE_STATE 0x0
+#define SCOPE_ARMED 1
+#define SCOPE_DELAY_RUNNING 4
+#define SCOPE_TRIGGER_DELAY 0x10
+#define SCOPE_WP_TRIGGER 0x1C
+#define SCOPE_TRIGGER_TIMESTAMP 0x164
+#define SCOPE_DATA 0x10000  //offset of the data of channel 1, channel 2 follows at twice this offset
+#define MAX_SCOPE_LENGTH 16384  //size of the circular buffer of each channel
+#define SCOPE_CH1 1  //channel flags of the 'S' command
+#define SCOPE_CH2 2
+//interval at which the scope state is polled while a client waits for a trace
+#define SCOPE_POLL_INTERVAL_NS 100000
+//input buffer size: one maximum-size write command
+#define IN_BUFFER_SIZE (V2_HEADER_SIZE + 4 * MAX_WRITE_LENGTH)
+//stop reading from a client whose output queue exceeds this size
+#define MAX_OUT_QUEUE (4 * (HEADER_SIZE + 4 * MAX_LENGTH))
+#define MAX_EVENTS 64
+
 #define DEBUG_MONITOR 0
 
-unsigned long read_value(unsigned long a_addr);
-unsigned long* read_values(unsigned long a_addr, unsigned long* a_values_buffer, unsigned long a_len);
-void write_value(unsigned long a_addr, unsigned long a_value);
-void write_values(unsigned long a_addr, unsigned long* a_values, unsigned long a_len);
+void read_values(uint32_t a_addr, uint32_t* a_values_buffer, uint32_t a_len);
+void write_values(uint32_t a_addr, const uint32_t* a_values, uint32_t a_len);
 
 //FPGA memory handlers
-void* map_base = (void*)(-1);
-int fd = -1;
+volatile uint32_t* map_base = NULL;
+int local_mode = 0;
 
 //sockets are globally defined for error handling
-int sockfd;
-int newsockfd;
+int sockfd = -1;
+int epollfd = -1;
+int timerfd = -1;
+
+//state of a connected client
+typedef struct client {
+	int fd;
+	//commands are assembled here
+	char* in_buffer;
+	size_t in_len;
+	//number of bytes of a rejected command to skip
+	size_t discard;
+	//replies waiting for transmission
+	char* out_buffer;
+	size_t out_len;
+	size_t out_pos;
+	size_t out_size;
+	//1 if the client is not read from because of a full output queue
+	int throttled;
+	//header of the pending scope trace command and the next client waiting for a trace
+	char scope_header[V2_HEADER_SIZE];
+	int subscribed;
+	struct client* next_subscriber;
+} client_t;
+
+int flush_output(client_t* client);
+
+//clients that wait for a scope trace
+client_t* subscribers = NULL;
+int timer_armed = 0;
 
 //open and close memory mapping to FPGA registers
 void open_map_base() {
-    int addr = 0x40000000;
-    if((fd = open("/dev/mem", O_RDWR | O_SYNC)) == -1) FATAL;
-    map_base = mmap(0, MAP_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED, fd, addr & ~MAP_MASK);
-	if(map_base == (void *) -1) FATAL;
+	void* base;
+	if (local_mode) {
+		base = mmap(0, MAP_SIZE, PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+		if(base == MAP_FAILED) FATAL;
+	}
+	else {
+		int fd = -1;
+		if((fd = open("/dev/mem", O_RDWR | O_SYNC)) == -1) FATAL;
+		base = mmap(0, MAP_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED, fd, MAP_ADDR);
+		close(fd);
+		if(base == MAP_FAILED) {
+			//fall back to one mapping per access
+			perror("Persistent memory mapping failed");
+			return;
+		}
+	}
+	map_base = (volatile uint32_t*) base;
 }
 
 void close_map_base() {
-	/*if (map_base != (void*)(-1)) {
-		if(munmap(map_base, MAP_SIZE) == -1) FATAL;
-		map_base = (void*)(-1);
-	}
-	if (fd != -1) {
-		close(fd);
+	if (map_base != NULL) {
+		munmap((void*) map_base, MAP_SIZE);
+		map_base = NULL;
 	}
-	*/;
 }
-/*
-//basic read and write operations
-unsigned long* read_values(unsigned long a_addr, unsigned long* a_values_buffer, unsigned long a_len) {
-	unsigned long* virt_addr = map_base + (a_addr & MAP_MASK);
-	unsigned long i;
-	printf("address to read %d",(int)a_addr);
-	for (i = 0; i < a_len; i++) {;
-		a_values_buffer[i] = virt_addr[i];
+
+//returns a pointer to a_len words at a_addr in the persistent mapping, or NULL if outside of it
+volatile uint32_t* mapped_address(uint32_t a_addr, uint32_t a_len) {
+	if (map_base == NULL || a_addr < MAP_ADDR || (a_addr & 3))
+		return NULL;
+	if ((uint64_t) a_addr - MAP_ADDR + 4 * (uint64_t) a_len > MAP_SIZE)
+		return NULL;
+	return map_base + ((a_addr - MAP_ADDR) >> 2);
+}
+
+//access with a temporary mapping of the memory (slow)
+void* open_slow_map(uint32_t a_addr, int* fd) {
+	void* base;
+	if((*fd = open("/dev/mem", O_RDWR | O_SYNC)) == -1) FATAL;
+	base = mmap(0, SLOW_MAP_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED, *fd, a_addr & ~SLOW_MAP_MASK);
+	if(base == MAP_FAILED) FATAL;
+	return base;
+}
+
+void close_slow_map(void* base, int fd) {
+	if(munmap(base, SLOW_MAP_SIZE) == -1) FATAL;
+	close(fd);
+}
+
+//basic read and write operations, 32 bits at a time
+void read_values(uint32_t a_addr, uint32_t* a_values_buffer, uint32_t a_len) {
+	volatile uint32_t* virt_addr = mapped_address(a_addr, a_len);
+	uint32_t i;
+	if (virt_addr != NULL) {
+		for (i = 0; i < a_len; i++)
+			a_values_buffer[i] = virt_addr[i];
+	}
+	else if (local_mode) { //nothing outside of the simulated memory
+		memset(a_values_buffer, 0, 4 * a_len);
+	}
+	else {
+		while (a_len > 0) { //one mapping per page
+			int fd;
+			void* base = open_slow_map(a_addr, &fd);
+			uint32_t n = (SLOW_MAP_SIZE - (a_addr & SLOW_MAP_MASK)) / 4;
+			if (n > a_len)
+				n = a_len;
+			virt_addr = (volatile uint32_t*) ((char*) base + (a_addr & SLOW_MAP_MASK));
+			for (i = 0; i < n; i++)
+				a_values_buffer[i] = virt_addr[i];
+			close_slow_map(base, fd);
+			a_addr += 4 * n;
+			a_values_buffer += n;
+			a_len -= n;
+		}
 	}
-	return a_values_buffer;
 }
 
-void write_values(unsigned long a_addr, unsigned long* a_values, unsigned long a_len) {
-	void* virt_addr = map_base + (a_addr & MAP_MASK);
-	unsigned long i;
-	for (i = 0; i < a_len; i++) {
-		((unsigned long *) virt_addr)[i] = a_values[i];
+void write_values(uint32_t a_addr, const uint32_t* a_values, uint32_t a_len) {
+	volatile uint32_t* virt_addr = mapped_address(a_addr, a_len);
+	uint32_t i;
+	if (virt_addr != NULL) {
+		for (i = 0; i < a_len; i++)
+			virt_addr[i] = a_values[i];
+	}
+	else if (!local_mode) {
+		while (a_len > 0) { //one mapping per page
+			int fd;
+			void* base = open_slow_map(a_addr, &fd);
+			uint32_t n = (SLOW_MAP_SIZE - (a_addr & SLOW_MAP_MASK)) / 4;
+			if (n > a_len)
+				n = a_len;
+			virt_addr = (volatile uint32_t*) ((char*) base + (a_addr & SLOW_MAP_MASK));
+			for (i = 0; i < n; i++)
+				virt_addr[i] = a_values[i];
+			close_slow_map(base, fd);
+			a_addr += 4 * n;
+			a_values += n;
+			a_len -= n;
+		}
 	}
 }
-*/
 
 /* server process and error handling */
 
 void error(const char *msg)
 {
-    perror(msg);
-    close(newsockfd); 
-    close(sockfd);
+	perror(msg);
+	if (epollfd >= 0)
+		close(epollfd);
+	if (sockfd >= 0)
+		close(sockfd);
 	//clean up the memory mapping
 	close_map_base();
-    exit(-1);
+	exit(-1);
 }
 
-int main(int argc, char *argv[])
-{
-     int portno;
-	 unsigned int data_length;
-	 unsigned long address;
-     socklen_t clilen;
-
-     char data_buffer[8+sizeof(unsigned long)*MAX_LENGTH];
-	 unsigned long * rw_buffer =(unsigned long*)&(data_buffer[8]);
-	 char* buffer = (char*)&(data_buffer[0]);
-     
-     struct sockaddr_in serv_addr, cli_addr;
-     int n;
-     if (argc < 2) {
-         fprintf(stderr,"ERROR, no port provided\n");
-         exit(1);
-     }
-     sockfd = socket(AF_INET, SOCK_STREAM, 0);
-     if (sockfd < 0) 
-        error("ERROR opening socket");
+int set_nonblocking(int fd) {
+	int flags = fcntl(fd, F_GETFL, 0);
+	if (flags < 0)
+		return -1;
+	return fcntl(fd, F_SETFL, flags | O_NONBLOCK);
+}
+
+//(re-)registers the events a client is interested in
+void update_events(client_t* client) {
+	struct epoll_event ev;
+	ev.events = 0;
+	if (!client->throttled)
+		ev.events |= EPOLLIN;
+	if (client->out_len > client->out_pos)
+		ev.events |= EPOLLOUT;
+	ev.data.ptr = client;
+	epoll_ctl(epollfd, EPOLL_CTL_MOD, client->fd, &ev);
+}
+
+//polls the scope state as long as clients wait for a trace
+void update_timer() {
+	struct itimerspec interval;
+	int armed = (subscribers != NULL);
+	if (armed == timer_armed)
+		return;
+	memset(&interval, 0, sizeof(interval));
+	if (armed) {
+		interval.it_value.tv_nsec = SCOPE_POLL_INTERVAL_NS;
+		interval.it_interval.tv_nsec = SCOPE_POLL_INTERVAL_NS;
+	}
+	if (timerfd_settime(timerfd, 0, &interval, NULL) == 0)
+		timer_armed = armed;
+}
+
+void unsubscribe(client_t* client) {
+	client_t** p = &subscribers;
+	while (*p != NULL) {
+		if (*p == client) {
+			*p = client->next_subscriber;
+			break;
+		}
+		p = &(*p)->next_subscriber;
+	}
+	client->next_subscriber = NULL;
+	client->subscribed = 0;
+	update_timer();
+}
+
+void close_client(client_t* client) {
+	if (client->subscribed)
+		unsubscribe(client);
+	epoll_ctl(epollfd, EPOLL_CTL_DEL, client->fd, NULL);
+	close(client->fd);
+	free(client->in_buffer);
+	free(client->out_buffer);
+	free(client);
+}
+
+void accept_clients() {
+	struct sockaddr_in cli_addr;
+	socklen_t clilen;
+	struct epoll_event ev;
 	int enable = 1;
-	if (setsockopt(sockfd,SOL_SOCKET,SO_REUSEADDR,&enable,sizeof(int))<0)
-		error("setsockopt(SO_REUSEADDR) failed");
-     bzero((char *) &serv_addr, sizeof(serv_addr));
-     portno = atoi(argv[1]);
-     serv_addr.sin_family = AF_INET;
-     serv_addr.sin_addr.s_addr = INADDR_ANY;
-     serv_addr.sin_port = htons(portno);
-     if (bind(sockfd, (struct sockaddr *) &serv_addr,
-              sizeof(serv_addr)) < 0) 
-              error("ERROR on binding");
-     listen(sockfd,5);
-     clilen = sizeof(cli_addr);
-     newsockfd = accept(sockfd, 
-                 (struct sockaddr *) &cli_addr, 
-                 &clilen);
-     if (newsockfd < 0) 
-          error("ERROR on accept");
-	 else
-		 printf("Incoming client connection accepted!");
-	
-	//open_map_base();
-	 //service loop
-     while (0==0) {
-		 //read next header from client
-		 bzero(buffer,8);
-		 n = recv(newsockfd,buffer,8,MSG_WAITALL);
-		 if (n < 0) error("ERROR reading from socket");
-		 if (n != 8) error("ERROR reading from socket - incorrect header length");
-		 //confirm control sequence
-	 ////n=send(newsockfd,buffer,8,0); 
-	 ////if (n != 8) error("ERROR control sequence mirror incorreclty transmitted");
-	     //interpret the header
-    	 address = ((unsigned long*)buffer)[1]; //address to be read/written
-		 data_length = buffer[2]+(buffer[3]<<8); //number of "unsigned long" to be read/written
-		 if (data_length > MAX_LENGTH)
-			 data_length = MAX_LENGTH;
-		 if (data_length == 0)
+	while (1) {
+		clilen = sizeof(cli_addr);
+		int newsockfd = accept(sockfd, (struct sockaddr *) &cli_addr, &clilen);
+		if (newsockfd < 0) {
+			if (errno != EAGAIN && errno != EWOULDBLOCK && errno != EINTR)
+				perror("ERROR on accept");
+			return;
+		}
+		client_t* client = calloc(1, sizeof(client_t));
+		if (client != NULL)
+			client->in_buffer = malloc(IN_BUFFER_SIZE);
+		if (client == NULL || client->in_buffer == NULL || set_nonblocking(newsockfd) < 0) {
+			perror("ERROR setting up client");
+			if (client != NULL)
+				free(client->in_buffer);
+			free(client);
+			close(newsockfd);
+			continue;
+		}
+		//replies are small and should not wait for more data
+		setsockopt(newsockfd, IPPROTO_TCP, TCP_NODELAY, &enable, sizeof(int));
+		client->fd = newsockfd;
+		ev.events = EPOLLIN;
+		ev.data.ptr = client;
+		if (epoll_ctl(epollfd, EPOLL_CTL_ADD, newsockfd, &ev) < 0) {
+			perror("ERROR adding client");
+			close_client(client);
 			continue;
-		 //test for various cases Read, Write, Close
-		 else if (buffer[0] == 'r') { //read from FPGA
-			read_values(address, rw_buffer, data_length);
-			//send the data
-			n = send(newsockfd,(void*)data_buffer,data_length*sizeof(unsigned long)+8,0);
-			if (n < 0) error("ERROR writing to socket");
-			if (n != data_length*sizeof(unsigned long)+8) error("ERROR wrote incorrect number of bytes to socket");
-		 }
-		 else if  (buffer[0] == 'w') { //write to FPGA
-			//read new data from socket
-			n = recv(newsockfd,(void*)rw_buffer,data_length*sizeof(unsigned long),MSG_WAITALL);
-			if (n < 0) error("ERROR reading from socket");
-			if (n != data_length*sizeof(unsigned long)) error("ERROR read incorrect number of bytes to socket");
-			//write FPGA memory
-			write_values(address, rw_buffer, data_length);
-			n=send(newsockfd,buffer,8,0);
-			if (n != 8) error("ERROR control sequence mirror incorreclty transmitted");
-		 }
-		 else if (buffer[0] == 'c') break; //close program
-		 else error("ERROR unknown control character - server and client out of sync"); //if an unknown control sequence is received, terminate for security reasons
-	 }
-	 //close the socket
-     close(newsockfd); 
-	 close(sockfd);
-	 //clean up the memory mapping
-	 close_map_base();
-	 return 0; 
+		}
+		if (DEBUG_MONITOR)
+			printf("Incoming client connection accepted!\n");
+	}
 }
 
+//returns a pointer to n free bytes at the end of the output queue, or NULL
+char* reserve_output(client_t* client, size_t n) {
+	if (client->out_pos > 0 && client->out_pos == client->out_len) {
+		client->out_pos = client->out_len = 0;
+	}
+	if (client->out_len + n > client->out_size) {
+		//compact the queue before growing it
+		//(keeping the replies 4-byte aligned)
+		size_t offset = client->out_pos & ~(size_t) 3;
+		if (offset > 0) {
+			memmove(client->out_buffer, client->out_buffer + offset, client->out_len - offset);
+			client->out_len -= offset;
+			client->out_pos -= offset;
+		}
+		if (client->out_len + n > client->out_size) {
+			size_t size = client->out_size ? client->out_size : 65536;
+			while (size < client->out_len + n)
+				size *= 2;
+			char* buffer = realloc(client->out_buffer, size);
+			if (buffer == NULL)
+				return NULL;
+			client->out_buffer = buffer;
+			client->out_size = size;
+		}
+	}
+	char* p = client->out_buffer + client->out_len;
+	client->out_len += n;
+	return p;
+}
 
-// old version with steady reinstantiation of mmap (slow)
-unsigned long* read_values(unsigned long a_addr, unsigned long* a_values_buffer, unsigned long a_len) {
-    int fd = -1;
-    if((fd = open("/dev/mem", O_RDWR | O_SYNC)) == -1) FATAL;
-    map_base = mmap(0, MAP_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED, fd, a_addr & ~MAP_MASK);
-	if(map_base == (void *) -1) FATAL;
-	
-	void* virt_addr = map_base + (a_addr & MAP_MASK);
-	unsigned long i;
-	for (i = 0; i < a_len; i++) {
-		a_values_buffer[i] = ((unsigned long*) virt_addr)[i];
+//appends a version 2 reply header with length n to the output queue
+//returns a pointer to the space for the data words that follow, or NULL
+char* v2_reply(client_t* client, const char* header, uint8_t status, uint32_t n, uint32_t data_words) {
+	char* reply = reserve_output(client, V2_HEADER_SIZE + 4 * (size_t) data_words);
+	if (reply == NULL)
+		return NULL;
+	memcpy(reply, header, V2_HEADER_SIZE);
+	reply[1] = status;
+	memcpy(reply + 8, &n, 4);
+	return reply + V2_HEADER_SIZE;
+}
+
+//reads n words of a scope channel, starting at index start of its circular buffer
+void read_circular(uint32_t a_addr, uint32_t* values, uint32_t n, uint32_t start) {
+	uint32_t first = n < MAX_SCOPE_LENGTH - start ? n : MAX_SCOPE_LENGTH - start;
+	read_values(a_addr + 4 * start, values, first);
+	if (first < n)
+		read_values(a_addr, values + first, n - first);
+}
+
+//appends the trace of the subscribed scope to the output queue, returns -1 on error
+int push_scope_trace(client_t* client) {
+	uint32_t address, n, delay, wp_trigger, start, k = 0;
+	uint8_t channels = client->scope_header[1] & (SCOPE_CH1 | SCOPE_CH2);
+	memcpy(&n, client->scope_header + 8, 4);
+	memcpy(&address, client->scope_header + 12, 4);
+	if (channels == 0)
+		channels = SCOPE_CH1 | SCOPE_CH2;
+	uint32_t words = 2 + n * (((channels & SCOPE_CH1) != 0) + ((channels & SCOPE_CH2) != 0));
+	uint32_t* data = (uint32_t*) v2_reply(client, client->scope_header, STATUS_OK, words, words);
+	if (data == NULL)
+		return -1;
+	read_values(address + SCOPE_TRIGGER_DELAY, &delay, 1);
+	read_values(address + SCOPE_WP_TRIGGER, &wp_trigger, 1);
+	read_values(address + SCOPE_TRIGGER_TIMESTAMP, data, 2);
+	//the acquisition ends with the sample at wp_trigger + delay, the trace
+	//consists of the n samples up to there
+	start = (uint32_t) (((uint64_t) wp_trigger + delay + 1 + MAX_SCOPE_LENGTH - n) % MAX_SCOPE_LENGTH);
+	if (channels & SCOPE_CH1)
+		read_circular(address + SCOPE_DATA, data + 2 + n * k++, n, start);
+	if (channels & SCOPE_CH2)
+		read_circular(address + 2 * SCOPE_DATA, data + 2 + n * k++, n, start);
+	return 0;
+}
+
+//pushes the traces of all scopes whose acquisition is complete
+void poll_subscriptions() {
+	uint64_t expirations;
+	client_t* client = subscribers;
+	if (read(timerfd, &expirations, sizeof(expirations)) < 0 && errno != EAGAIN)
+		perror("ERROR reading timer");
+	while (client != NULL) {
+		client_t* next = client->next_subscriber;
+		uint32_t address, state;
+		memcpy(&address, client->scope_header + 12, 4);
+		read_values(address + SCOPE_STATE, &state, 1);
+		if (!(state & (SCOPE_ARMED | SCOPE_DELAY_RUNNING))) {
+			unsubscribe(client);
+			//errors are handled when epoll reports the broken connection,
+			//since the client might still appear in the current list of events
+			if (push_scope_trace(client) < 0)
+				shutdown(client->fd, SHUT_RDWR);
+			flush_output(client);
+			update_events(client);
+		}
+		client = next;
 	}
+}
 
-	if (map_base != (void*)(-1)) {
-		if(munmap(map_base, MAP_SIZE) == -1) FATAL;
-		map_base = (void*)(-1);
+//executes a version 1 command, returns the number of bytes consumed, 0 if the command is incomplete or -1 to close
+long process_v1(client_t* client, const char* buffer, size_t available) {
+	if (available < HEADER_SIZE)
+		return 0;
+	uint32_t data_length = (unsigned char) buffer[2] + ((unsigned char) buffer[3] << 8);
+	uint32_t address;
+	memcpy(&address, buffer + 4, 4); //address to be read/written
+	char* reply;
+	if (buffer[0] == 'c') //close connection
+		return -1;
+	if (buffer[0] == 'v') { //protocol version request
+		char header[V2_HEADER_SIZE];
+		uint16_t version = PROTOCOL_VERSION;
+		uint32_t values[3] = {CAP_MULTICLIENT | CAP_VECTOR | CAP_SCOPE_PUSH, MAX_READ_LENGTH, MAX_WRITE_LENGTH};
+		header[0] = 'v';
+		header[1] = STATUS_OK;
+		memcpy(header + 2, &version, 2);
+		memcpy(header + 4, values, 12);
+		reply = reserve_output(client, V2_HEADER_SIZE);
+		if (reply == NULL)
+			return -1;
+		memcpy(reply, header, V2_HEADER_SIZE);
+		return HEADER_SIZE;
 	}
-	if (fd != -1) {
-		close(fd);
+	if (data_length == 0)
+		return HEADER_SIZE;
+	if (buffer[0] == 'r') { //read from FPGA
+		reply = reserve_output(client, HEADER_SIZE + 4 * data_length);
+		if (reply == NULL)
+			return -1;
+		memcpy(reply, buffer, HEADER_SIZE);
+		read_values(address, (uint32_t*) (reply + HEADER_SIZE), data_length);
+		return HEADER_SIZE;
+	}
+	if (buffer[0] == 'w') { //write to FPGA
+		if (available < HEADER_SIZE + 4 * data_length)
+			return 0; //wait for the rest of the data
+		write_values(address, (const uint32_t*) (buffer + HEADER_SIZE), data_length);
+		reply = reserve_output(client, HEADER_SIZE);
+		if (reply == NULL)
+			return -1;
+		memcpy(reply, buffer, HEADER_SIZE);
+		return HEADER_SIZE + 4 * data_length;
 	}
-	return a_values_buffer;
+	//if an unknown control sequence is received, close the connection for security reasons
+	fprintf(stderr, "ERROR unknown control character - server and client out of sync\n");
+	return -1;
 }
 
-void write_values(unsigned long a_addr, unsigned long* a_values, unsigned long a_len) {
-    int fd = -1;
-    if((fd = open("/dev/mem", O_RDWR | O_SYNC)) == -1) FATAL;
-    map_base = mmap(0, MAP_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED, fd, a_addr & ~MAP_MASK);
-	if(map_base == (void *) -1) FATAL;
-	
-	void* virt_addr = map_base + (a_addr & MAP_MASK);
-	unsigned long i;
-	for (i = 0; i < a_len; i++) {
-				((unsigned long *) virt_addr)[i] = a_values[i];
+//executes a version 2 command, returns the number of bytes consumed, 0 if the command is incomplete or -1 to close
+long process_v2(client_t* client, const char* buffer, size_t available) {
+	if (available < V2_HEADER_SIZE)
+		return 0;
+	uint32_t length, address, i;
+	memcpy(&length, buffer + 8, 4);
+	memcpy(&address, buffer + 12, 4);
+	const uint32_t* segments = (const uint32_t*) (buffer + V2_HEADER_SIZE);
+	uint64_t total = 0;
+	char* data;
+	switch (buffer[0]) {
+	case 'C': //close connection
+		return -1;
+	case 'S': //wait for the next scope trace
+		if (length == 0 || length > MAX_SCOPE_LENGTH)
+			return v2_reply(client, buffer, STATUS_TOO_LONG, 0, 0) ? V2_HEADER_SIZE : -1;
+		if (client->subscribed) {
+			if (v2_reply(client, client->scope_header, STATUS_CANCELLED, 0, 0) == NULL)
+				return -1;
+		}
+		else {
+			client->next_subscriber = subscribers;
+			subscribers = client;
+			client->subscribed = 1;
+			update_timer();
+		}
+		memcpy(client->scope_header, buffer, V2_HEADER_SIZE);
+		return V2_HEADER_SIZE;
+	case 'R': //read from FPGA
+		if (length > MAX_READ_LENGTH)
+			return v2_reply(client, buffer, STATUS_TOO_LONG, 0, 0) ? V2_HEADER_SIZE : -1;
+		data = v2_reply(client, buffer, STATUS_OK, length, length);
+		if (data == NULL)
+			return -1;
+		read_values(address, (uint32_t*) data, length);
+		return V2_HEADER_SIZE;
+	case 'W': //write to FPGA
+		if (length > MAX_WRITE_LENGTH) {
+			client->discard = 4 * (size_t) length;
+			return v2_reply(client, buffer, STATUS_TOO_LONG, 0, 0) ? V2_HEADER_SIZE : -1;
+		}
+		if (available < V2_HEADER_SIZE + 4 * (size_t) length)
+			return 0; //wait for the rest of the data
+		write_values(address, segments, length);
+		if (v2_reply(client, buffer, STATUS_OK, length, 0) == NULL)
+			return -1;
+		return V2_HEADER_SIZE + 4 * length;
+	case 'V': //read several segments
+		if (2 * (uint64_t) length > MAX_WRITE_LENGTH) {
+			client->discard = 8 * (size_t) length;
+			return v2_reply(client, buffer, STATUS_TOO_LONG, 0, 0) ? V2_HEADER_SIZE : -1;
+		}
+		if (available < V2_HEADER_SIZE + 8 * (size_t) length)
+			return 0; //wait for the segment list
+		for (i = 0; i < length; i++)
+			total += segments[2 * i + 1];
+		if (total > MAX_READ_LENGTH) {
+			data = v2_reply(client, buffer, STATUS_TOO_LONG, 0, 0);
+		}
+		else {
+			data = v2_reply(client, buffer, STATUS_OK, (uint32_t) total, (uint32_t) total);
+			for (i = 0; data != NULL && i < length; i++) {
+				read_values(segments[2 * i], (uint32_t*) data, segments[2 * i + 1]);
+				data += 4 * (size_t) segments[2 * i + 1];
+			}
+		}
+		return data == NULL ? -1 : V2_HEADER_SIZE + 8 * (long) length;
+	case 'X': //write several segments
+		if (2 * (uint64_t) length > MAX_WRITE_LENGTH)
+			return -1; //the amount of data that follows is unknown
+		if (available < V2_HEADER_SIZE + 8 * (size_t) length)
+			return 0; //wait for the segment list
+		for (i = 0; i < length; i++)
+			total += segments[2 * i + 1];
+		if (2 * (uint64_t) length + total > MAX_WRITE_LENGTH) {
+			client->discard = 4 * total;
+			return v2_reply(client, buffer, STATUS_TOO_LONG, 0, 0) ? V2_HEADER_SIZE + 8 * (long) length : -1;
+		}
+		if (available < V2_HEADER_SIZE + 8 * (size_t) length + 4 * total)
+			return 0; //wait for the rest of the data
+		data = (char*) (segments + 2 * length);
+		for (i = 0; i < length; i++) {
+			write_values(segments[2 * i], (const uint32_t*) data, segments[2 * i + 1]);
+			data += 4 * (size_t) segments[2 * i + 1];
+		}
+		if (v2_reply(client, buffer, STATUS_OK, (uint32_t) total, 0) == NULL)
+			return -1;
+		return V2_HEADER_SIZE + 8 * (long) length + 4 * (long) total;
+	default:
+		//if an unknown control sequence is received, close the connection for security reasons
+		fprintf(stderr, "ERROR unknown control character - server and client out of sync\n");
+		return -1;
 	}
-	
-	if (map_base != (void*)(-1)) {
-		if(munmap(map_base, MAP_SIZE) == -1) FATAL;
-		map_base = (void*)(-1);
+}
+
+//executes all complete commands in the input buffer, returns -1 if the client must be closed
+int process_commands(client_t* client) {
+	size_t pos = 0;
+	while (pos < client->in_len) {
+		size_t available = client->in_len - pos;
+		long consumed;
+		if (client->discard > 0) { //skip the data of a rejected command
+			consumed = available < client->discard ? available : client->discard;
+			client->discard -= consumed;
+		}
+		else if (islower((unsigned char) client->in_buffer[pos]))
+			consumed = process_v1(client, client->in_buffer + pos, available);
+		else
+			consumed = process_v2(client, client->in_buffer + pos, available);
+		if (consumed < 0)
+			return -1;
+		if (consumed == 0)
+			break; //wait for the rest of the command
+		pos += consumed;
+		if (client->out_len - client->out_pos > MAX_OUT_QUEUE)
+			break; //continue once the output queue has been transmitted
 	}
-	if (fd != -1) {
-		close(fd);
+	//keep incomplete commands for later
+	if (pos > 0) {
+		memmove(client->in_buffer, client->in_buffer + pos, client->in_len - pos);
+		client->in_len -= pos;
 	}
+	return 0;
+}
+
+//transmits as much of the output queue as possible, returns -1 on error
+int flush_output(client_t* client) {
+	while (client->out_pos < client->out_len) {
+		ssize_t n = send(client->fd, client->out_buffer + client->out_pos, client->out_len - client->out_pos, MSG_NOSIGNAL);
+		if (n < 0) {
+			if (errno == EAGAIN || errno == EWOULDBLOCK)
+				return 0;
+			if (errno == EINTR)
+				continue;
+			return -1;
+		}
+		client->out_pos += n;
+	}
+	return 0;
+}
+
+//receives and executes commands, returns -1 if the client must be closed
+int serve_client(client_t* client, uint32_t events) {
+	if (events & (EPOLLERR | EPOLLHUP) && !(events & EPOLLIN))
+		return -1;
+	if (events & EPOLLOUT) {
+		if (flush_output(client) < 0)
+			return -1;
+	}
+	if (events & EPOLLIN && !client->throttled && client->in_len < IN_BUFFER_SIZE) {
+		ssize_t n = recv(client->fd, client->in_buffer + client->in_len, IN_BUFFER_SIZE - client->in_len, 0);
+		if (n == 0)
+			return -1; //connection closed by client
+		if (n < 0 && errno != EAGAIN && errno != EWOULDBLOCK && errno != EINTR)
+			return -1;
+		if (n > 0)
+			client->in_len += n;
+	}
+	//execute pending commands as long as the output queue is not full
+	while (client->out_len - client->out_pos <= MAX_OUT_QUEUE) {
+		size_t in_len = client->in_len;
+		if (process_commands(client) < 0) {
+			flush_output(client); //try to deliver replies before closing
+			return -1;
+		}
+		if (flush_output(client) < 0)
+			return -1;
+		if (client->in_len == in_len)
+			break; //only an incomplete command is left
+	}
+	client->throttled = (client->out_len - client->out_pos > MAX_OUT_QUEUE);
+	update_events(client);
+	return 0;
+}
+
+int main(int argc, char *argv[])
+{
+	int portno;
+	int i, n;
+	struct sockaddr_in serv_addr;
+	struct epoll_event ev, events[MAX_EVENTS];
+
+	if (argc < 2) {
+		fprintf(stderr,"ERROR, no port provided\n");
+		exit(1);
+	}
+	for (i = 2; i < argc; i++) {
+		if (strcmp(argv[i], "-l") == 0)
+			local_mode = 1;
+	}
+	signal(SIGPIPE, SIG_IGN);
+	sockfd = socket(AF_INET, SOCK_STREAM, 0);
+	if (sockfd < 0)
+		error("ERROR opening socket");
+	int enable = 1;
+	if (setsockopt(sockfd,SOL_SOCKET,SO_REUSEADDR,&enable,sizeof(int))<0)
+		error("setsockopt(SO_REUSEADDR) failed");
+	bzero((char *) &serv_addr, sizeof(serv_addr));
+	portno = atoi(argv[1]);
+	serv_addr.sin_family = AF_INET;
+	serv_addr.sin_addr.s_addr = INADDR_ANY;
+	serv_addr.sin_port = htons(portno);
+	if (bind(sockfd, (struct sockaddr *) &serv_addr,
+			 sizeof(serv_addr)) < 0)
+		error("ERROR on binding");
+	if (listen(sockfd, 16) < 0)
+		error("ERROR on listen");
+	if (set_nonblocking(sockfd) < 0)
+		error("ERROR on fcntl");
+
+	epollfd = epoll_create1(0);
+	if (epollfd < 0)
+		error("ERROR on epoll_create1");
+	ev.events = EPOLLIN;
+	ev.data.ptr = NULL; //marks the listening socket
+	if (epoll_ctl(epollfd, EPOLL_CTL_ADD, sockfd, &ev) < 0)
+		error("ERROR on epoll_ctl");
+
+	timerfd = timerfd_create(CLOCK_MONOTONIC, TFD_NONBLOCK);
+	if (timerfd < 0)
+		error("ERROR on timerfd_create");
+	ev.events = EPOLLIN;
+	ev.data.ptr = &timerfd; //marks the timer
+	if (epoll_ctl(epollfd, EPOLL_CTL_ADD, timerfd, &ev) < 0)
+		error("ERROR on epoll_ctl");
+
+	open_map_base();
+
+	//service loop
+	while (1) {
+		n = epoll_wait(epollfd, events, MAX_EVENTS, -1);
+		if (n < 0) {
+			if (errno == EINTR)
+				continue;
+			error("ERROR on epoll_wait");
+		}
+		for (i = 0; i < n; i++) {
+			client_t* client = (client_t*) events[i].data.ptr;
+			if (client == NULL)
+				accept_clients();
+			else if (events[i].data.ptr == &timerfd)
+				poll_subscriptions();
+			else if (serve_client(client, events[i].events) < 0)
+				close_client(client);
+		}
+	}
+	//never reached - the server is terminated with a signal
+	close(epollfd);
+	close(sockfd);
+	close_map_base();
+	return 0;
 }
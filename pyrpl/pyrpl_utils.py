@@ -1,6 +1,7 @@
 import time
 from timeit import default_timer
 import logging
+import numpy as np
 logger = logging.getLogger(__file__)
 from collections import OrderedDict, Counter
 
@@ -24,6 +25,26 @@ def time():
     """ returns the time. used instead of time.time for rapid portability"""
     return default_timer()
 
+def minmax_decimate(x, y, points):
+    """
+    Reduces the curve(s) y(x) to points points for display. The curve is
+    divided into points // 2 bins that are represented by their minimum and
+    maximum, such that peaks and the envelope of noise remain visible. y
+    may hold several curves along its first axes (e.g. shape (2, len(x))).
+    x, y are returned unchanged if they do not hold more than points points.
+    """
+    n = len(x)
+    bins = int(points) // 2
+    if bins < 1 or n <= 2 * bins:
+        return x, y
+    y = np.asarray(y)
+    starts = (np.arange(bins) * n) // bins
+    decimated = np.empty(y.shape[:-1] + (2 * bins,), dtype=y.dtype)
+    decimated[..., 0::2] = np.minimum.reduceat(y, starts, axis=-1)
+    decimated[..., 1::2] = np.maximum.reduceat(y, starts, axis=-1)
+    return np.repeat(np.asarray(x)[starts], 2), decimated
+
+
 def get_unique_name_list_from_class_list(cls_list):
     """
     returns a list of names using cls.name if unique or cls.name1, cls.name2... otherwise.
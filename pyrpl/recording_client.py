@@ -0,0 +1,325 @@
+###############################################################################
+#    pyrpl - DSP servo controller for quantum optics with the RedPitaya
+#    Copyright (C) 2014-2016  Leonhard Neuhaus  (neuhaus@spectro.jussieu.fr)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+"""
+Record and replay of the register transfers with a Red Pitaya.
+
+RecordingClient wraps a client (MonitorClient or SimulatorClient) and logs
+every transfer to a binary file. ReplayClient serves a recorded session
+back without the board, such that the Python-side overhead of e.g.
+Lockbox.lock or a network analyzer sweep can be benchmarked offline:
+
+    r = RedPitaya(hostname='192.168.1.100', record='lock.rec')
+    ...  # lock once on the hardware
+    r = RedPitaya(replay='lock.rec')  # in CI, without the board
+
+The file starts with MAGIC and the file format version (uint32). Each
+transfer is one record: a RECORD header with the command ('r' read, 'w'
+write, 's' pushed scope trace), flags, the time in seconds since the
+start of the recording, the address and the number of words, followed by
+the words read or written (uint32, little endian).
+"""
+import logging
+import struct
+import numpy as np
+
+from .redpitaya_client import MonitorBatch
+from .pyrpl_utils import time
+
+MAGIC = b'PYRPLREC'
+VERSION = 1
+RECORD = struct.Struct('<cBHdII')
+# record flags
+FLAG_FAILED = 1  # the transfer failed (no payload)
+FLAG_ASYNC = 2  # transferred by a coroutine
+
+
+def _pushed_words(length, channels):
+    """ number of words of a pushed scope trace (timestamp and samples) """
+    return 2 + length * len(channels or (1, 2))
+
+
+class ReplayError(ValueError):
+    """ a transfer does not match the recorded session """
+    pass
+
+
+def load_recording(filename):
+    """
+    Returns the records of a recorded session as a list of tuples
+    (command, flags, timestamp, addr, length, payload), where command is
+    one of 'r', 'w' and 's' and payload is a numpy array of uint32.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("%s is not a pyrpl recording." % filename)
+    version, = struct.unpack_from('<I', data, len(MAGIC))
+    if version > VERSION:
+        raise ValueError("Recording %s has the unsupported format version "
+                         "%d." % (filename, version))
+    records = []
+    offset = len(MAGIC) + 4
+    while offset + RECORD.size <= len(data):
+        command, flags, _, timestamp, addr, length = \
+            RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        nwords = 0 if flags & FLAG_FAILED else length
+        payload = np.frombuffer(data, dtype='<u4', count=nwords,
+                                offset=offset).astype(np.uint32)
+        offset += 4 * nwords
+        records.append((command.decode(), flags, timestamp, addr, length,
+                        payload))
+    return records
+
+
+class RecordingClient(object):
+    """
+    Wraps client and records all its transfers to the file filename.
+
+    All other attributes (e.g. statistics) are those of the wrapped client.
+    """
+    def __init__(self, client, filename):
+        self.logger = logging.getLogger(name=__name__)
+        self._client = client
+        self.filename = filename
+        self._file = open(filename, 'wb')
+        self._file.write(MAGIC + struct.pack('<I', VERSION))
+        self._start_time = time()
+        self.count = 0  # number of records
+
+    def __getattr__(self, name):
+        if name == '_client':  # not yet initialized
+            raise AttributeError(name)
+        return getattr(self._client, name)
+
+    def reads(self, addr, length):
+        start = time()
+        values = self._client.reads(addr, length)
+        self._record('r', start, addr, length, values)
+        return values
+
+    def writes(self, addr, values):
+        start = time()
+        result = self._client.writes(addr, values)
+        self._record('w', start, addr, len(values), values)
+        return result
+
+    def reads_into(self, addr, out):
+        start = time()
+        result = self._client.reads_into(addr, out)
+        self._record('r', start, addr, len(out), result)
+        return result
+
+    def batch(self):
+        return MonitorBatch(self)
+
+    def transfers(self, requests):
+        start = time()
+        results = self._client.transfers(requests)
+        if results is None:
+            results = [None] * len(requests)
+        for request, result in zip(requests, results):
+            if request.command == 'r':
+                self._record('r', start, request.addr, request.length, result)
+            else:
+                self._record('w', start, request.addr, request.length,
+                             request.values)
+        return results
+
+    async def reads_async(self, addr, length):
+        start = time()
+        values = await self._client.reads_async(addr, length)
+        self._record('r', start, addr, length, values, FLAG_ASYNC)
+        return values
+
+    async def writes_async(self, addr, values):
+        start = time()
+        result = await self._client.writes_async(addr, values)
+        self._record('w', start, addr, len(values), values, FLAG_ASYNC)
+        return result
+
+    async def scope_trace_async(self, addr, length, channels=(1, 2)):
+        start = time()
+        scope_trace_async = getattr(self._client, 'scope_trace_async', None)
+        values = None
+        if scope_trace_async is not None:
+            values = await scope_trace_async(addr, length, channels)
+        # the record holds the number of pushed words
+        self._record('s', start, addr, _pushed_words(length, channels),
+                     values, FLAG_ASYNC)
+        return values
+
+    def _record(self, command, start, addr, length, values, flags=0):
+        if values is None:
+            flags |= FLAG_FAILED
+        self._file.write(RECORD.pack(command.encode(), flags, 0,
+                                     start - self._start_time, addr, length))
+        if values is not None:
+            self._file.write(
+                np.asarray(values).astype('<u4', copy=False).tobytes())
+        self.count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def restart(self):
+        self._client.restart()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        self._client.close()
+
+
+class ReplayClient(object):
+    """
+    Serves the transfers of a session recorded with RecordingClient.
+
+    The transfers are expected in the recorded order. Reads return the
+    recorded values, writes are only checked against the recording: their
+    address, length and values. If a transfer does not match the next
+    record, ReplayClient raises a ReplayError if strict is True. Otherwise
+    (e.g. a status register was polled a different number of times), the
+    next record with the same command, address and length within
+    lookahead records is used, or the values last read from or written to
+    the address, if there is none. Written values that differ from the
+    record are counted in mismatches as well.
+    """
+    def __init__(self, filename, strict=False, lookahead=1000):
+        self.logger = logging.getLogger(name=__name__)
+        self.filename = filename
+        self.strict = strict
+        self.lookahead = lookahead
+        self._records = load_recording(filename)
+        self._cursor = 0
+        self.mismatches = 0
+        # (addr, length) -> values of writes that were not in the recording
+        self._unmatched = dict()
+
+    @property
+    def remaining(self):
+        """ number of records that have not been replayed yet """
+        return len(self._records) - self._cursor
+
+    def rewind(self):
+        """ restarts the replay with the first record """
+        self._cursor = 0
+        self.mismatches = 0
+        self._unmatched.clear()
+
+    def reads(self, addr, length):
+        return self._replay('r', addr, length)
+
+    def writes(self, addr, values):
+        self._replay('w', addr, len(values), values)
+        return True
+
+    def reads_into(self, addr, out):
+        out[:] = self._replay('r', addr, len(out))
+        return out
+
+    def batch(self):
+        return MonitorBatch(self)
+
+    def transfers(self, requests):
+        return [self.reads(request.addr, request.length)
+                if request.command == 'r'
+                else self.writes(request.addr, request.values)
+                for request in requests]
+
+    async def reads_async(self, addr, length):
+        return self.reads(addr, length)
+
+    async def writes_async(self, addr, values):
+        return self.writes(addr, values)
+
+    async def scope_trace_async(self, addr, length, channels=(1, 2)):
+        index = self._find('s', addr, _pushed_words(length, channels))
+        if index is None:
+            return None  # the scope is polled instead
+        self._cursor = index + 1
+        command, flags, timestamp, addr, length, payload = self._records[index]
+        return None if flags & FLAG_FAILED else payload.copy()
+
+    def restart(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _find(self, command, addr, length):
+        """ index of the record matching the transfer, or None """
+        stop = min(self._cursor + 1 + self.lookahead, len(self._records))
+        for index in range(self._cursor, stop):
+            record = self._records[index]
+            if record[0] == command and record[3] == addr \
+                    and record[4] == length:
+                if index != self._cursor:
+                    self.mismatches += 1
+                return index
+            if self.strict:
+                break
+        if self.strict:
+            raise ReplayError(
+                "Transfer %s of %d words at %s does not match record %d of "
+                "%s: %s." % (command, length, hex(addr), self._cursor,
+                             self.filename,
+                             self._records[self._cursor][:5]
+                             if self._cursor < len(self._records)
+                             else 'end of recording'))
+        return None
+
+    def _replay(self, command, addr, length, values=None):
+        index = self._find(command, addr, length)
+        if index is None:
+            self.mismatches += 1
+            self.logger.debug("No record for transfer %s of %d words at %s.",
+                              command, length, hex(addr))
+            if command == 'w':
+                self._unmatched[(addr, length)] = \
+                    np.asarray(values).astype(np.uint32)
+                return None
+            return self._last_values(addr, length)
+        payload = self._records[index][5]
+        if command == 'w':
+            if len(payload) == length and not np.array_equal(
+                    payload, np.asarray(values, dtype=np.uint32)):
+                if self.strict:
+                    raise ReplayError(
+                        "Values written at %s differ from record %d of %s."
+                        % (hex(addr), index, self.filename))
+                self.mismatches += 1
+                self.logger.debug("Values written at %s differ from record "
+                                  "%d.", hex(addr), index)
+            self._cursor = index + 1
+            return None
+        self._cursor = index + 1
+        if len(payload) != length:  # the recorded read failed
+            return self._last_values(addr, length)
+        return payload.copy()
+
+    def _last_values(self, addr, length):
+        """ the values last read from or written to addr before the cursor """
+        if (addr, length) in self._unmatched:
+            return self._unmatched[(addr, length)].copy()
+        for index in range(self._cursor - 1, -1, -1):
+            command, flags, timestamp, a, n, payload = self._records[index]
+            if a == addr and n == length and len(payload) == length \
+                    and command != 's':
+                return payload.copy()
+        return np.zeros(length, dtype=np.uint32)
@@ -21,6 +21,7 @@ from . import hardware_modules as rp
 from .sshshell import SshShell
 from .pyrpl_utils import get_unique_name_list_from_class_list, update_with_typeconversion
 from .memory import MemoryTree
+from .recording_client import RecordingClient, ReplayClient
 from .errors import ExpectedPyrplError
 from .widgets.startup_widget import HostnameSelectorWidget
 
@@ -45,6 +46,7 @@ except NameError:  # Python 3
 defaultparameters = dict(
     hostname='', #'192.168.1.100', # the ip or hostname of the board, '' triggers gui
     port=2222,  # port for PyRPL datacommunication
+    async_transport=False,  # non-blocking second connection for coroutines?
     sshport=22,  # port of ssh server - default 22
     user='root',
     password='root',
@@ -59,7 +61,9 @@ defaultparameters = dict(
     timeout=1,  # timeout in seconds for ssh communication
     monitor_server_name='monitor_server',  # name of the server program on redpitaya
     silence_env=False,   # suppress all environment variables that may override the configuration?
-    gui=True  # show graphical user interface or work on command-line only?
+    gui=True,  # show graphical user interface or work on command-line only?
+    record='',  # file to record all transfers with the board to (see pyrpl.recording_client)
+    replay='',  # recorded session to replay instead of connecting to the board
     )
 
 
@@ -83,6 +87,7 @@ class RedPitaya(object):
         Possible keyword arguments and their defaults are:
             hostname='192.168.1.100', # the ip or hostname of the board
             port=2222,  # port for PyRPL datacommunication
+            async_transport=False,  # non-blocking second connection for coroutines (needs a multi-client server)?
             sshport=22,  # port of ssh server - default 22
             user='root',
             password='root',
@@ -98,7 +103,9 @@ class RedPitaya(object):
             timeout=3,  # timeout in seconds for ssh communication
             monitor_server_name='monitor_server',  # name of the server program on redpitaya
             silence_env=False,   # suppress all environment variables that may override the configuration?
-            gui=True  # show graphical user interface or work on command-line only?
+            gui=True,  # show graphical user interface or work on command-line only?
+            record='',  # file to record all transfers with the board to (see pyrpl.recording_client)
+            replay='',  # recorded session to replay instead of connecting to the board
 
         if you are experiencing problems, try to increase delay, or try
         logging.getLogger().setLevel(logging.DEBUG)"""
@@ -171,8 +178,10 @@ class RedPitaya(object):
                     hostname_kwds['password'] = password
             self.parameters.update(hostname_kwds)
 
-        # optional: write configuration back to config file
-        self.c["redpitaya"] = self.parameters
+        # optional: write configuration back to config file (recording and
+        # replay only apply to the current session)
+        self.c["redpitaya"] = {k: v for k, v in self.parameters.items()
+                               if k not in ('record', 'replay')}
 
         # save default port definition for possible automatic port change
         self.parameters['defaultport'] = self.parameters['port']
@@ -181,9 +190,18 @@ class RedPitaya(object):
         # memorize whether server is running - nearly obsolete
         self._serverrunning = False
         self.client = None  # client class
+        # copies of register values shared by all modules (if enabled)
+        self._shadow_registers = dict()
         self._slaves = []  # slave interfaces to same redpitaya
         self.modules = OrderedDict()  # all submodules
 
+        # replay a recorded session without the board
+        if self.parameters['replay']:
+            self.startreplayclient()
+            self.logger.warning("Replaying the session recorded in %s "
+                                "instead of connecting to a RedPitaya.",
+                                self.parameters['replay'])
+            return
         # provide option to simulate a RedPitaya
         if self.parameters['hostname'] in ['_FAKE_REDPITAYA_', '_FAKE_']:
             self.startdummyclient()
@@ -285,6 +303,7 @@ class RedPitaya(object):
             except KeyError:
                 source = None
         self.end()
+        self._shadow_registers.clear()  # the new bitfile resets all registers
         sleep(self.parameters['delay'])
         self.ssh.ask('rw')
         sleep(self.parameters['delay'])
@@ -464,18 +483,42 @@ class RedPitaya(object):
 
     def startclient(self):
         self.client = redpitaya_client.MonitorClient(
-            self.parameters['hostname'], self.parameters['port'], restartserver=self.restartserver)
+            self.parameters['hostname'], self.parameters['port'], restartserver=self.restartserver,
+            async_transport=self.parameters['async_transport'])
+        self.startrecording()
         self.makemodules()
         self.logger.debug("Client started successfully. ")
 
     def startdummyclient(self):
+        # simulates the Red Pitaya in this process (see pyrpl.simulator)
         self.client = redpitaya_client.DummyClient()
+        self.startrecording()
+        self.makemodules()
+
+    def startreplayclient(self):
+        self.client = ReplayClient(self.parameters['replay'])
         self.makemodules()
 
+    def startrecording(self):
+        """ records all transfers of the client if parameters['record'] """
+        if self.parameters['record']:
+            self.client = RecordingClient(self.client,
+                                          self.parameters['record'])
+
     def makemodule(self, name, cls):
         module = cls(self, name)
         setattr(self, name, module)
         self.modules[name] = module
+        # attribute the transfers of the module in the client statistics
+        statistics = getattr(self.client, 'statistics', None)
+        if statistics is not None and hasattr(module, 'addr_base'):
+            statistics.register_module(name, module.addr_base)
+        # writes to volatile registers are not repeated after reconnection
+        register_volatile = getattr(self.client, 'register_volatile', None)
+        if register_volatile is not None \
+                and hasattr(module, '_volatile_addresses'):
+            register_volatile([module.addr_base + addr
+                               for addr in module._volatile_addresses()])
 
     def makemodules(self):
         """
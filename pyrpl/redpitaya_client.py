@@ -19,28 +19,335 @@
 
 import numpy as np
 import socket
+import struct
 import logging
+import asyncio
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import sleep
 try:
     raise  # disable sound output for now
     from pysine import sine  # for debugging read/write calls
 except:
     def sine(frequency, duration):
         print("Called sine(frequency=%f, duration=%f)" % (frequency, duration))
-from .hardware_modules.dsp import dsp_addr_base, DSP_INPUTS
+from .async_utils import LOOP, ensure_future, open_connection_async
 from .pyrpl_utils import time
 
+class MonitorProtocolError(IOError):
+    """ the server replied with an invalid message """
+    pass
+
+
 # global conter to assign a number to each client
 # only used for debugging purposes
 CLIENT_NUMBER = 0
 
+# version 2 of the monitor protocol (see monitor_server.c): command, status,
+# reserved, request id, length, address
+V2_HEADER = struct.Struct('<cBHIII')
+# capabilities announced by the monitor_server
+CAP_MULTICLIENT = 1  # several clients can be connected at once
+CAP_VECTOR = 2  # readv and writev commands
+CAP_SCOPE_PUSH = 4  # the server pushes scope traces once they are acquired
+# channel flags of a scope trace command (0: both channels)
+SCOPE_CH1 = 1
+SCOPE_CH2 = 2
+# status of a version 2 reply
+STATUS_OK = 0
+STATUS_TOO_LONG = 1
+STATUS_CANCELLED = 2
+
+
+class BatchRequest(object):
+    """
+    A read or write request queued in a :class:`MonitorBatch`.
+
+    Behaves like a minimal future: result() returns the read values
+    (numpy array of uint32) or True for a successful write once the batch
+    has been transmitted.
+    """
+    def __init__(self, command, addr, length, values=None):
+        self.command = command  # 'r' or 'w'
+        self.addr = addr
+        self.length = length
+        self.values = values
+        self._result = None
+        self._done = False
+
+    def done(self):
+        return self._done
+
+    def set_result(self, result):
+        self._result = result
+        self._done = True
+
+    def result(self):
+        if not self._done:
+            raise ValueError("The batch containing this request has not "
+                             "been transmitted yet.")
+        return self._result
+
+    def __repr__(self):
+        return "<%s %s addr=%s length=%d>" % (self.__class__.__name__,
+                                              self.command, hex(self.addr),
+                                              self.length)
+
+
+class MonitorBatch(object):
+    """
+    Queues reads and writes at arbitrary addresses and transmits them to
+    the client in a single pipelined burst, i.e. with only one network
+    round trip for the whole batch.
+
+    Usage::
+
+        with r.client.batch() as batch:
+            gains = batch.reads(0x40300110, 4)
+            batch.writes(0x40300100, [1])
+            status = batch.read(0x40300104)
+        print(gains.result(), status.result())
+
+    Requests are executed in the order in which they were queued. Leaving
+    the with-block transmits the batch (unless an exception occured), and
+    send() can be used to do so explicitly. send() returns the list of all
+    results.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+
+    def reads(self, addr, length):
+        """ queues a read of length values at addr, returns a BatchRequest """
+        request = BatchRequest('r', addr, length)
+        self.requests.append(request)
+        return request
+
+    def read(self, addr):
+        """ queues a read of one value at addr, returns a BatchRequest """
+        return self.reads(addr, 1)
+
+    def writes(self, addr, values):
+        """ queues a write of values to addr, returns a BatchRequest """
+        values = np.array(values, dtype=np.uint32)
+        request = BatchRequest('w', addr, len(values), values=values)
+        self.requests.append(request)
+        return request
+
+    def write(self, addr, value):
+        """ queues a write of value to addr, returns a BatchRequest """
+        return self.writes(addr, [int(value)])
+
+    def send(self):
+        """ transmits all queued requests and returns their results """
+        requests, self.requests = self.requests, []
+        if len(requests) == 0:
+            return []
+        results = self.client.transfers(requests)
+        if results is None:
+            raise IOError("Batch of %d requests could not be transmitted."
+                          % len(requests))
+        for request, result in zip(requests, results):
+            request.set_result(result)
+        return results
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.send()
+
+
+class TransferStatistics(object):
+    """
+    Records the transfers of a MonitorClient for profiling.
+
+    Each transfer is stored in a ring buffer that holds the last size
+    transfers: its time, command ('r' or 'w'), address, number of words,
+    number of bytes on the wire, round-trip time in seconds and the number
+    of retries and resynchronizations it needed. The requests of a batch
+    are recorded individually, each with an equal share of the round-trip
+    time of the batch.
+
+    snapshot() aggregates the records per address, per module or per
+    command, report() formats a snapshot as a table and export() saves the
+    records as csv file. Addresses are attributed to the module with the
+    closest lower addr_base (see register_module). To profile a block of
+    code::
+
+        with r.client.statistics.profile() as profile:
+            r.scope.single()
+        print(profile.report())
+    """
+    RECORD = np.dtype([('time', 'f8'), ('command', 'S1'), ('addr', 'u4'),
+                       ('words', 'u4'), ('bytes', 'u4'), ('duration', 'f8'),
+                       ('retries', 'u2'), ('resyncs', 'u2')])
+    # bin edges of the round-trip time histograms in seconds (1 us to 10 s)
+    BINS = np.logspace(-6, 1, 29)
+
+    def __init__(self, size=65536):
+        self.enabled = True
+        self.count = 0  # number of transfers recorded since the last clear()
+        self._records = np.zeros(size, dtype=self.RECORD)
+        self._profiles = []
+        # sorted base addresses of the modules and their names
+        self._module_bases = []
+        self._module_names = []
+
+    def register_module(self, name, addr_base):
+        """ attributes the addresses from addr_base upwards to module name """
+        i = bisect_right(self._module_bases, addr_base)
+        if i > 0 and self._module_bases[i - 1] == addr_base:
+            if name not in self._module_names[i - 1].split('/'):
+                self._module_names[i - 1] += '/' + name
+        else:
+            self._module_bases.insert(i, addr_base)
+            self._module_names.insert(i, name)
+
+    def module_names(self, addresses):
+        """ returns the module names for an array of addresses """
+        index = np.searchsorted(self._module_bases, addresses,
+                                side='right') - 1
+        names = np.array(['unknown'] + self._module_names, dtype=object)
+        return names[index + 1]
+
+    def record(self, command, addr, words, nbytes, duration, retries=0,
+               resyncs=0):
+        """ records one transfer """
+        self._records[self.count % len(self._records)] = (
+            time(), command, addr, words, nbytes, duration, retries, resyncs)
+        self.count += 1
+        for profile in self._profiles:
+            profile.record(command, addr, words, nbytes, duration, retries,
+                           resyncs)
+
+    def record_batch(self, requests, header_size, duration, retries=0,
+                     resyncs=0):
+        """ records the BatchRequests that were transmitted together """
+        n = len(requests)
+        records = np.zeros(n, dtype=self.RECORD)
+        records['time'] = time()
+        records['command'] = [request.command for request in requests]
+        records['addr'] = [request.addr for request in requests]
+        records['words'] = [request.length for request in requests]
+        records['bytes'] = 2 * header_size + 4 * records['words']
+        records['duration'] = duration / n
+        records['retries'] = retries
+        records['resyncs'] = resyncs
+        self._append(records)
+
+    def _append(self, records):
+        size = len(self._records)
+        if len(records) > size:
+            self.count += len(records) - size
+            records = records[-size:]
+        self._records[(self.count + np.arange(len(records))) % size] = records
+        self.count += len(records)
+        for profile in self._profiles:
+            profile._append(records)
+
+    def records(self):
+        """ returns a copy of the recorded transfers, oldest first """
+        size = len(self._records)
+        if self.count <= size:
+            return self._records[:self.count].copy()
+        return np.roll(self._records, -(self.count % size))
+
+    def clear(self):
+        self.count = 0
+
+    def snapshot(self, by='module'):
+        """
+        aggregates the records by 'module', 'addr' or 'command'. Returns an
+        OrderedDict of dicts with the statistics of each key, starting with
+        the key with the largest total round-trip time.
+        """
+        records = self.records()
+        if by == 'module':
+            keys = self.module_names(records['addr'])
+        elif by == 'addr':
+            keys = records['addr']
+        elif by == 'command':
+            keys = records['command'].astype(str)
+        else:
+            raise ValueError("by must be 'module', 'addr' or 'command', "
+                             "got %s" % by)
+        stats = []
+        for key in np.unique(keys):
+            selected = records[keys == key]
+            duration = selected['duration']
+            stats.append((key, dict(
+                count=len(selected),
+                reads=int(np.sum(selected['command'] == b'r')),
+                writes=int(np.sum(selected['command'] == b'w')),
+                words=int(selected['words'].sum()),
+                bytes=int(selected['bytes'].sum()),
+                total_time=float(duration.sum()),
+                mean_time=float(duration.mean()),
+                max_time=float(duration.max()),
+                retries=int(selected['retries'].sum()),
+                resyncs=int(selected['resyncs'].sum()),
+                histogram=np.histogram(duration, self.BINS)[0])))
+        stats.sort(key=lambda item: -item[1]['total_time'])
+        return OrderedDict((key if by != 'addr' else int(key), value)
+                           for key, value in stats)
+
+    def report(self, by='module', n=20):
+        """ returns a table of the n keys with the largest total time """
+        lines = ["%-16s %8s %8s %10s %10s %10s %7s %7s"
+                 % (by, "count", "words", "total [s]", "mean [us]",
+                    "max [us]", "retries", "resyncs")]
+        for key, stats in list(self.snapshot(by=by).items())[:n]:
+            lines.append("%-16s %8d %8d %10.4f %10.1f %10.1f %7d %7d" % (
+                hex(key) if by == 'addr' else key, stats['count'],
+                stats['words'], stats['total_time'], stats['mean_time'] * 1e6,
+                stats['max_time'] * 1e6, stats['retries'], stats['resyncs']))
+        return "\n".join(lines)
+
+    def export(self, filename):
+        """ saves the records as csv file """
+        records = self.records()
+        with open(filename, 'w') as f:
+            f.write(",".join(self.RECORD.names + ('module',)) + "\n")
+            for record, module in zip(records,
+                                      self.module_names(records['addr'])):
+                f.write("%r,%s,%s,%d,%d,%r,%d,%d,%s\n" % (
+                    float(record['time']), record['command'].decode(),
+                    hex(record['addr']), record['words'], record['bytes'],
+                    float(record['duration']), record['retries'],
+                    record['resyncs'], module))
+
+    @contextmanager
+    def profile(self, size=65536):
+        """
+        context manager that yields a TransferStatistics with the
+        transfers of the with-block only
+        """
+        profile = TransferStatistics(size=size)
+        profile._module_bases = self._module_bases
+        profile._module_names = self._module_names
+        self._profiles.append(profile)
+        try:
+            yield profile
+        finally:
+            self._profiles.remove(profile)
+
 
 class MonitorClient(object):
-    def __init__(self, hostname="192.168.1.0", port=2222, restartserver=None):
+    def __init__(self, hostname="192.168.1.0", port=2222, restartserver=None,
+                 async_transport=False):
         """initiates a client connected to monitor_server
 
         hostname: server address, e.g. "localhost" or "192.168.1.0"
         port:    the port that the server is running on. 2222 by default
         restartserver: a function to call that restarts the server in case of problems
+        async_transport: if True, reads_async and writes_async use a second,
+                 non-blocking connection (see AsyncMonitorClient)
         """
         self.logger = logging.getLogger(name=__name__)
         # update global client counter and assign a number to this client
@@ -54,7 +361,33 @@ class MonitorClient(object):
         self._port = port
         self._read_counter = 0 # For debugging and unittests
         self._write_counter = 0 # For debugging and unittests
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.statistics = TransferStatistics()
+        self._resyncs = 0
+        self._retries = 0  # failed attempts of the last transfer
+        self._async_transport = async_transport
+        self._async_client = None  # created upon first use
+        self._header_buffer = bytearray(8)  # receives the reply headers
+        self._v2_header_buffer = bytearray(V2_HEADER.size)
+        self._request_id = 0
+        # absolute addresses of registers whose writes must not be replayed
+        self._volatile_addresses = set()
+        self._reconnects = 0
+        self._last_transfer = time()
+        self.socket = None
+        self._connect()
+
+    # reconnection after connection problems (see reconnect())
+    timeout = 1.0  # seconds for socket operations
+    backoff_start = 0.01  # delay before the second reconnection attempt
+    backoff_factor = 2.0  # the delay grows by this factor for each attempt
+    backoff_max = 1.0
+    reconnect_attempts = 5  # before the server is restarted
+    # a connection that has been idle for longer than this (in seconds) is
+    # pinged before a request that cannot be replayed is transmitted
+    ping_interval = 5.0
+
+    def _connect(self):
+        """ initial connection, restarting the server in between attempts """
         # try to connect at least 5 times
         for i in range(5):
             if not self._port > 0:
@@ -69,7 +402,7 @@ class MonitorClient(object):
                                      "check your connection parameters!"
                                      % (self._hostname, self._port))
             try:
-                self.socket.connect((self._hostname, self._port))
+                self._open_socket()
             except socket.error:  # mostly because port is still closed
                 self.logger.warning("Socket error during connection "
                                     "attempt %s.", i)
@@ -77,15 +410,103 @@ class MonitorClient(object):
                 self._port = self._restartserver()
             else:
                 break
-        self.socket.settimeout(1.0)  # 1 second timeout for socket operations
+        try:
+            self._negotiate()
+        except socket.error as e:
+            self.logger.warning("Protocol negotiation with monitor_server "
+                                "failed (%s). Using protocol version 1.", e)
+
+    def _open_socket(self):
+        """ replaces the socket by a new connection to the server """
+        self._close_socket()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.settimeout(self.timeout)
+        self.socket.connect((self._hostname, self._port))
+        # protocol version 1 until the server has announced version 2
+        self.protocol_version = 1
+        self.capabilities = 0
+        self.max_read_length = 65535
+        self.max_write_length = 65535 - 2
+        self._last_transfer = time()
+
+    def _close_socket(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except socket.error:
+                pass
+            self.socket = None
+
+    def ping(self):
+        """
+        Checks that the server replies and returns the round-trip time in
+        seconds. Raises socket.error if the connection is broken.
+
+        The version request 'v' serves as ping, since it does not access
+        the fpga. Version 1 servers ignore it, such that one register is
+        read instead.
+        """
+        start = time()
+        if self.protocol_version >= 2:
+            self.socket.sendall(self._header(b'v', 0, 0))
+            self._recv_into(self._v2_header_buffer)
+            if self._v2_header_buffer[:1] != b'v':
+                self.emptybuffer()
+                raise socket.error("Wrong reply to ping: %s"
+                                   % bytes(self._v2_header_buffer))
+        else:
+            header = self._header(b'r', 0x40000000, 1)
+            self.socket.sendall(header)
+            if not self._recv_header(header):
+                raise socket.error("Wrong reply to ping")
+            self._recv_into(bytearray(4))
+        self._last_transfer = time()
+        return self._last_transfer - start
+
+    def reconnect(self):
+        """
+        Replaces a broken connection by a new one to the same server. The
+        delay between failed attempts grows exponentially from backoff_start
+        to backoff_max. Only after reconnect_attempts failed attempts, the
+        server is restarted (over ssh) with the function restartserver.
+
+        Returns True if the new connection replies to a ping.
+        """
+        delay = self.backoff_start
+        for i in range(self.reconnect_attempts):
+            if i > 0:
+                sleep(delay)
+                delay = min(delay * self.backoff_factor, self.backoff_max)
+            try:
+                self._open_socket()
+                self._negotiate()
+                self.ping()
+            except socket.error as e:
+                self.logger.warning("Reconnection attempt %s of client %s "
+                                    "failed: %s", i, self.client_number, e)
+            else:
+                self._reconnects += 1
+                self.logger.info("Client %s reconnected after %s failed "
+                                 "attempts.", self.client_number, i)
+                return True
+        self._close_socket()
+        if self._restartserver is None:
+            return False
+        self.restart()
+        return self.socket is not None
 
     def close(self):
+        if self._async_client is not None:
+            self._async_client.close()
+            self._async_client = None
+        if self.socket is None:
+            return
         try:
             self.socket.send(
                 b'c' + bytes(bytearray([0, 0, 0, 0, 0, 0, 0])))
-            self.socket.close()
         except socket.error:
-            return
+            pass
+        self._close_socket()
 
     def __del__(self):
         self.close()
@@ -95,177 +516,713 @@ class MonitorClient(object):
         self._read_counter+=1
         if hasattr(self, '_sound_debug') and self._sound_debug:
             sine(440, 0.05)
-        return self.try_n_times(self._reads, addr, length)
+        return self._recorded('r', addr, length, self._reads, length)
 
     def writes(self, addr, values):
         self._write_counter += 1
         if hasattr(self, '_sound_debug') and self._sound_debug:
             sine(880, 0.05)
-        return self.try_n_times(self._writes, addr, values)
-    
+        return self._recorded('w', addr, len(values), self._writes, values,
+                              replay=self._replayable(addr, len(values)))
+
+    def reads_into(self, addr, out):
+        """
+        Same as reads(addr, len(out)), but the data is received directly
+        into the contiguous uint32 array out, which is returned.
+        """
+        self._read_counter += 1
+        return self._recorded('r', addr, len(out), self._reads_into, out)
+
+    def batch(self):
+        """ returns a MonitorBatch to pipeline many reads and writes """
+        return MonitorBatch(self)
+
+    # coroutines that do not block the event loop while waiting for data
+    async def reads_async(self, addr, length):
+        client = self._get_async_client()
+        if client is not None:
+            start = time()
+            try:
+                values = await client.reads_async(addr, length)
+            except (OSError, EOFError, asyncio.TimeoutError) as e:
+                self._async_failed(e)
+            else:
+                self._read_counter += 1
+                if self.statistics.enabled:
+                    self.statistics.record('r', addr, length,
+                                           self._transfer_bytes(length),
+                                           time() - start)
+                return values
+        return self.reads(addr, length)
+
+    async def writes_async(self, addr, values):
+        client = self._get_async_client()
+        if client is not None:
+            start = time()
+            try:
+                result = await client.writes_async(addr, values)
+            except (OSError, EOFError, asyncio.TimeoutError) as e:
+                self._async_failed(e)
+            else:
+                self._write_counter += 1
+                if self.statistics.enabled:
+                    self.statistics.record('w', addr, len(values),
+                                           self._transfer_bytes(len(values)),
+                                           time() - start)
+                return result
+        return self.writes(addr, values)
+
+    async def scope_trace_async(self, addr, length, channels=(1, 2)):
+        """
+        Waits until the acquisition of the scope at addr is complete and
+        returns the trace as pushed by the server: the 64 bit trigger
+        timestamp (2 words) followed by the last length raw samples of each
+        of the channels, in the order of their acquisition.
+
+        Returns None if the server cannot push scope traces. Only one trace
+        can be awaited at a time.
+        """
+        if not self.capabilities & CAP_SCOPE_PUSH:
+            return None
+        client = self._get_async_client()
+        if client is None:
+            return None
+        try:
+            values = await client.scope_trace_async(addr, length, channels)
+        except (OSError, EOFError, asyncio.TimeoutError) as e:
+            self._async_failed(e)
+            return None
+        self._read_counter += 1
+        return values
+
+    def _get_async_client(self):
+        """ returns the AsyncMonitorClient, or None if unavailable """
+        if not self._async_transport:
+            return None
+        if not self.capabilities & CAP_MULTICLIENT:
+            self.logger.warning("The monitor_server does not accept a second "
+                                "client for asynchronous transport. Using "
+                                "blocking transfers instead.")
+            self._async_transport = False
+            return None
+        if self._async_client is None:
+            self._async_client = AsyncMonitorClient(
+                self._hostname,
+                self._port,
+                timeout=self.socket.gettimeout(),
+                protocol_version=self.protocol_version,
+                max_read_length=self.max_read_length,
+                max_write_length=self.max_write_length)
+        if not self._async_client.available:
+            return None
+        return self._async_client
+
+    def _async_failed(self, error):
+        """
+        Connection failures and timeouts only make the current request fall
+        back to a blocking transfer (the asynchronous client reconnects
+        later), whereas invalid replies disable the asynchronous transport.
+        """
+        if isinstance(error, MonitorProtocolError):
+            self.logger.warning("Asynchronous transport is unavailable (%s). "
+                                "Using blocking transfers instead.", error)
+            self._async_transport = False
+        else:
+            self.logger.error("Error in asynchronous transfer by client %s: "
+                              "%s. Falling back to blocking transfer.",
+                              self.client_number, error)
+
+    def transfers(self, requests):
+        """
+        Transmits a list of BatchRequests in one burst and returns the list
+        of their results. Usually called through MonitorBatch.send().
+        """
+        for request in requests:
+            if request.command == 'r':
+                self._read_counter += 1
+            else:
+                self._write_counter += 1
+        replay = all(self._replayable(request.addr, request.length)
+                     for request in requests if request.command == 'w')
+        if not self.statistics.enabled:
+            return self.try_n_times(self._transfers, requests, None,
+                                    replay=replay)
+        start, resyncs = time(), self._resyncs
+        results = self.try_n_times(self._transfers, requests, None,
+                                   replay=replay)
+        self.statistics.record_batch(requests, self._header_size(),
+                                     time() - start, self._retries,
+                                     self._resyncs - resyncs)
+        return results
+
+    def _recorded(self, command, addr, words, function, value, replay=True):
+        """ try_n_times(function, addr, value), recorded in statistics """
+        if not self.statistics.enabled:
+            return self.try_n_times(function, addr, value, replay=replay)
+        start, resyncs = time(), self._resyncs
+        result = self.try_n_times(function, addr, value, replay=replay)
+        self.statistics.record(command, addr, words,
+                               self._transfer_bytes(words), time() - start,
+                               self._retries, self._resyncs - resyncs)
+        return result
+
+    def _header_size(self):
+        return V2_HEADER.size if self.protocol_version >= 2 else 8
+
+    def _transfer_bytes(self, words):
+        """ bytes on the wire for a read or write of words """
+        return 2 * self._header_size() + 4 * words
+
     # the actual code
-    def _reads(self, addr, length):
-        if length > 65535:
-            length = 65535
-            self.logger.warning("Maximum read-length is %d", length)
-        header = b'r' + bytes(bytearray([0,
-                                         length & 0xFF, (length >> 8) & 0xFF,
-                                         addr & 0xFF, (addr >> 8) & 0xFF, (addr >> 16) & 0xFF, (addr >> 24) & 0xFF]))
-        self.socket.send(header)
-        data = self.socket.recv(length * 4 + 8)
-        while (len(data) < length * 4 + 8):
-            data += self.socket.recv(length * 4 - len(data) + 8)
-        if data[:8] == header:  # check for in-sync transmission
-            return np.frombuffer(data[8:], dtype=np.uint32)
-        else:  # error handling
-            self.logger.error("Wrong control sequence from server: %s", data[:8])
+    def _header(self, command, addr, length):
+        return command + bytes(bytearray([0,
+                                          length & 0xFF,
+                                          (length >> 8) & 0xFF,
+                                          addr & 0xFF,
+                                          (addr >> 8) & 0xFF,
+                                          (addr >> 16) & 0xFF,
+                                          (addr >> 24) & 0xFF]))
+
+    def _recv_into(self, buffer):
+        """ fills buffer (any writable contiguous buffer) from the socket """
+        view = memoryview(buffer).cast('B')
+        while len(view) > 0:
+            n = self.socket.recv_into(view)
+            if n == 0:
+                raise socket.error("Connection closed by server")
+            view = view[n:]
+
+    def _negotiate(self):
+        """
+        asks the server for its protocol version and capabilities.
+
+        A version 1 server ignores the version request 'v' and only answers
+        the read of one register that follows it.
+        """
+        probe = self._header(b'r', 0x40000000, 1)
+        self.socket.sendall(self._header(b'v', 0, 0) + probe)
+        self._recv_into(self._header_buffer)
+        if self._header_buffer[:1] == b'v':
+            reply = bytearray(V2_HEADER.size)
+            reply[:8] = self._header_buffer
+            self._recv_into(memoryview(reply)[8:])
+            _, _, version, capabilities, max_read, max_write = \
+                V2_HEADER.unpack(reply)
+            self.protocol_version = min(version, 2)
+            self.capabilities = capabilities
+            self.max_read_length = max_read
+            self.max_write_length = max_write
+            self.logger.debug("Monitor_server supports protocol version %d "
+                              "with capabilities %s.", version, capabilities)
+            if not self._recv_header(probe):
+                return
+        elif self._header_buffer != probe:
+            self.logger.error("Wrong control sequence from server: %s",
+                              bytes(self._header_buffer))
             self.emptybuffer()
+            return
+        self._recv_into(bytearray(4))  # the value of the probe register
+
+    def _next_request_id(self):
+        self._request_id = (self._request_id + 1) & 0xFFFFFFFF
+        return self._request_id
+
+    def _send_v2(self, command, addr, length, *data):
+        """ sends a version 2 command and returns its request id """
+        request_id = self._next_request_id()
+        self.socket.sendall(b''.join((V2_HEADER.pack(command, 0, 0, request_id,
+                                                     length, addr),) + data))
+        return request_id
+
+    def _recv_v2_reply(self, request_id):
+        """
+        receives the reply to the version 2 command request_id and returns
+        the length field of the reply, or None if the command failed.
+        Replies to earlier commands (e.g. of a transfer that timed out) are
+        skipped, such that no resynchronization is needed.
+        """
+        while True:
+            self._recv_into(self._v2_header_buffer)
+            command, status, _, reply_id, length, addr = \
+                V2_HEADER.unpack(self._v2_header_buffer)
+            if reply_id == request_id:
+                break
+            self.logger.debug("Skipping the reply to request %d.", reply_id)
+            if command in (b'R', b'V', b'S') and status == STATUS_OK:
+                self._recv_into(np.empty(length, dtype=np.uint32))
+            elif command not in (b'R', b'V', b'W', b'X', b'S'):
+                self.logger.error("Wrong control sequence from server: %s",
+                                  bytes(self._v2_header_buffer))
+                self.emptybuffer()
+                return None
+        if status != STATUS_OK:
+            self.logger.error("Monitor_server rejected command %s of "
+                              "length %d at address %s with status %d.",
+                              command, length, hex(addr), status)
             return None
+        return length
+
+    def _recv_header(self, header):
+        """ receives a reply header and checks that it matches header """
+        self._recv_into(self._header_buffer)
+        if self._header_buffer == header:  # check for in-sync transmission
+            return True
+        self.logger.error("Wrong control sequence from server: %s",
+                          bytes(self._header_buffer))
+        self.emptybuffer()
+        return False
+
+    @staticmethod
+    def _chunks(length, max_length):
+        """ returns the (start, stop) indices of chunks of max_length """
+        return [(start, min(start + max_length, length))
+                for start in range(0, length, max_length)]
+
+    def _reads(self, addr, length):
+        return self._reads_into(addr, np.empty(length, dtype=np.uint32))
+
+    def _reads_into(self, addr, out):
+        """
+        Reads of more than max_read_length words are split into chunks.
+        All chunks are requested at once and received directly into out.
+        """
+        chunks = self._chunks(len(out), self.max_read_length)
+        if self.protocol_version >= 2:
+            request_ids = [self._next_request_id() for chunk in chunks]
+            self.socket.sendall(b''.join(
+                V2_HEADER.pack(b'R', 0, 0, request_id, stop - start,
+                               addr + 4 * start)
+                for request_id, (start, stop) in zip(request_ids, chunks)))
+            for request_id, (start, stop) in zip(request_ids, chunks):
+                if self._recv_v2_reply(request_id) is None:
+                    return None
+                self._recv_into(out[start:stop])
+            return out
+        headers = [self._header(b'r', addr + 4 * start, stop - start)
+                   for start, stop in chunks]
+        self.socket.sendall(b''.join(headers))
+        for header, (start, stop) in zip(headers, chunks):
+            if not self._recv_header(header):
+                return None
+            self._recv_into(out[start:stop])
+        return out
 
     def _writes(self, addr, values):
-        values = values[:65535 - 2]
-        length = len(values)
-        header = b'w' + bytes(bytearray([0,
-                                         length & 0xFF,
-                                         (length >> 8) & 0xFF,
-                                         addr & 0xFF,
-                                         (addr >> 8) & 0xFF,
-                                         (addr >> 16) & 0xFF,
-                                         (addr >> 24) & 0xFF]))
-        # send header+body
-        self.socket.send(header +
-                         np.array(values, dtype=np.uint32).tobytes())
-        if self.socket.recv(8) == header:  # check for in-sync transmission
+        """
+        Writes of more than max_write_length words are split into chunks
+        that are sent back-to-back before the replies are awaited.
+        """
+        values = np.asarray(values, dtype=np.uint32)
+        chunks = self._chunks(len(values), self.max_write_length)
+        if self.protocol_version >= 2:
+            request_ids = [self._next_request_id() for chunk in chunks]
+            self.socket.sendall(b''.join(
+                V2_HEADER.pack(b'W', 0, 0, request_id, stop - start,
+                               addr + 4 * start) + values[start:stop].tobytes()
+                for request_id, (start, stop) in zip(request_ids, chunks)))
+            for request_id in request_ids:
+                if self._recv_v2_reply(request_id) is None:
+                    return None
             return True  # indicate successful write
-        else:  # error handling
-            self.logger.error("Error: wrong control sequence from server")
-            self.emptybuffer()
-            return None
+        headers = [self._header(b'w', addr + 4 * start, stop - start)
+                   for start, stop in chunks]
+        # send headers+bodies
+        self.socket.sendall(b''.join(
+            header + values[start:stop].tobytes()
+            for header, (start, stop) in zip(headers, chunks)))
+        for header in headers:
+            if not self._recv_header(header):  # error handling
+                return None
+        return True  # indicate successful write
+
+    def _transfers(self, requests, unused=None):
+        if self.protocol_version >= 2:
+            return self._transfers_v2(requests)
+        headers, messages = [], []
+        for request in requests:
+            if request.length > 65535 - 2 * (request.command == 'w'):
+                raise ValueError("Request %s is too long for a batch."
+                                 % request)
+            header = self._header(request.command.encode(), request.addr,
+                                  request.length)
+            headers.append(header)
+            messages.append(header)
+            if request.command == 'w':
+                messages.append(request.values.tobytes())
+        # send all requests before waiting for the first reply
+        self.socket.sendall(b''.join(messages))
+        results = []
+        for request, header in zip(requests, headers):
+            if not self._recv_header(header):
+                return None
+            if request.command == 'r':
+                values = np.empty(request.length, dtype=np.uint32)
+                self._recv_into(values)
+                results.append(values)
+            else:
+                results.append(True)
+        return results
+
+    def _group_requests(self, requests):
+        """
+        splits requests into groups of consecutive reads or writes that
+        are transmitted with one readv or writev command each.
+        Returns a list of [command, requests, number of words].
+        """
+        vector = self.capabilities & CAP_VECTOR
+        groups = []
+        for request in requests:
+            if request.length > (self.max_read_length if request.command == 'r'
+                                 else self.max_write_length - 2):
+                raise ValueError("Request %s is too long for a batch."
+                                 % request)
+            if vector and groups and groups[-1][0] == request.command:
+                command, group, words = groups[-1]
+                table = 2 * (len(group) + 1)  # size of the segment list
+                if command == 'r':
+                    fits = (words + request.length <= self.max_read_length
+                            and table <= self.max_write_length)
+                else:
+                    fits = (table + words + request.length
+                            <= self.max_write_length)
+                if fits:
+                    group.append(request)
+                    groups[-1][2] += request.length
+                    continue
+            groups.append([request.command, [request], request.length])
+        return groups
+
+    def _transfers_v2(self, requests):
+        groups = self._group_requests(requests)
+        messages, request_ids = [], []
+        for command, group, words in groups:
+            request_id = self._next_request_id()
+            request_ids.append(request_id)
+            if len(group) == 1:
+                request = group[0]
+                messages.append(V2_HEADER.pack(
+                    b'R' if command == 'r' else b'W', 0, 0, request_id,
+                    request.length, request.addr))
+            else:
+                messages.append(V2_HEADER.pack(
+                    b'V' if command == 'r' else b'X', 0, 0, request_id,
+                    len(group), 0))
+                messages.append(np.array([(r.addr, r.length) for r in group],
+                                         dtype=np.uint32).tobytes())
+            if command == 'w':
+                messages.extend(r.values.tobytes() for r in group)
+        # send all requests before waiting for the first reply
+        self.socket.sendall(b''.join(messages))
+        results = []
+        for (command, group, words), request_id in zip(groups, request_ids):
+            if self._recv_v2_reply(request_id) is None:
+                return None
+            if command == 'r':
+                values = np.empty(words, dtype=np.uint32)
+                self._recv_into(values)
+                offsets = np.cumsum([r.length for r in group])[:-1]
+                results.extend(np.split(values, offsets))
+            else:
+                results.extend([True] * len(group))
+        return results
 
     def emptybuffer(self):
+        self._resyncs += 1
         for i in range(100):
             n = len(self.socket.recv(16384))
             if (n <= 0):
                 return
             self.logger.debug("Read %d bytes from socket...", n)
 
-    def try_n_times(self, function, addr, value, n=5):
+    def register_volatile(self, addresses):
+        """
+        Registers the absolute addresses of registers that are changed by the
+        fpga itself (e.g. trigger arming). Writes to these registers are not
+        repeated after a connection failure, since the first attempt might
+        have been executed already.
+        """
+        self._volatile_addresses.update(addresses)
+
+    def _replayable(self, addr, length):
+        """ whether a write of length words at addr is idempotent """
+        if not self._volatile_addresses:
+            return True
+        return self._volatile_addresses.isdisjoint(
+            range(addr, addr + 4 * length, 4))
+
+    def try_n_times(self, function, addr, value, n=5, replay=True):
+        """
+        Calls function(addr, value) until it succeeds, at most n times.
+
+        After a connection failure, the socket is replaced (see reconnect())
+        and the request is transmitted again. Requests that are not
+        idempotent (replay=False) are not repeated, since they might have
+        been executed before the connection broke: an IOError is raised if
+        the connection broke, and None is returned if the reply was invalid.
+        An idle connection is pinged before such a request is transmitted.
+        """
+        if not replay and time() - self._last_transfer > self.ping_interval:
+            try:
+                self.ping()
+            except (socket.timeout, socket.error) as e:
+                self.logger.warning("Client %s did not reply to ping (%s).",
+                                    self.client_number, e)
+                self.reconnect()
         for i in range(n):
+            self._retries = i
             try:
-                value = function(addr, value)
+                result = function(addr, value)
             except (socket.timeout, socket.error):
                 self.logger.error("Error occured in reading attempt %s. "
                                   "Reconnecting at addr %s to %s value %s by "
                                   "client %s"
                                   % (i,
-                                     hex(addr),
+                                     hex(addr) if isinstance(addr, int)
+                                     else addr,
                                      function.__name__,
                                      value,
                                      self.client_number))
-                if self._restartserver is not None:
-                    self.restart()
+                if not self.reconnect():
+                    return None
+                if not replay:
+                    raise IOError("The request to %s at addr %s was not "
+                                  "repeated after a connection failure, "
+                                  "since it is not idempotent. The state of "
+                                  "the registers is unknown."
+                                  % (function.__name__,
+                                     hex(addr) if isinstance(addr, int)
+                                     else addr))
             else:
-                if value is not None:
-                    return value
+                self._last_transfer = time()
+                if result is not None or not replay:
+                    return result
 
     def restart(self):
+        """ restarts the server and connects to its new port """
+        if self._async_client is not None:
+            self._async_client.close()
+            self._async_client = None
+        self._close_socket()
+        self._port = self._restartserver()
+        self._connect()
+
+
+class AsyncMonitorClient(object):
+    """
+    asyncio-streams implementation of the monitor protocol.
+
+    The coroutines reads_async and writes_async transfer data without
+    blocking the event loop, such that several coroutines (e.g. scope
+    polling, network analyzer stepping and gui updates) can overlap.
+    Requests of concurrent coroutines are pipelined on a single connection.
+    With protocol version 2, the replies are dispatched by their request
+    id, otherwise in order.
+
+    The client opens its own connection to the monitor_server, i.e. the
+    server must accept several clients at once. If the server does not
+    reply within timeout, the connection is closed and available is False
+    for retry_interval seconds, during which MonitorClient falls back to
+    blocking transfers. The next request then opens a new connection.
+    """
+    retry_interval = 5.0
+
+    def __init__(self, hostname="192.168.1.0", port=2222, timeout=1.0,
+                 protocol_version=1, max_read_length=65535,
+                 max_write_length=65535 - 2):
+        self.logger = logging.getLogger(name=__name__)
+        self._hostname = hostname
+        self._port = port
+        self.timeout = timeout
+        self.protocol_version = protocol_version
+        self.max_read_length = max_read_length
+        self.max_write_length = max_write_length
+        self._failed_at = None  # time of the last timeout
+        self._connection = None  # task yielding (reader, writer)
+        # request id -> (header, nbytes, future) awaiting a reply
+        self._pending = dict()
+        self._request_id = 0
+        self._dispatcher = None  # task that reads the replies
+
+    @property
+    def available(self):
+        return self._failed_at is None or \
+            time() - self._failed_at > self.retry_interval
+
+    _header = MonitorClient._header  # same message format
+    _next_request_id = MonitorClient._next_request_id
+
+    _chunks = staticmethod(MonitorClient._chunks)
+
+    async def reads_async(self, addr, length):
+        """ long reads are split into chunks that are sent back-to-back """
+        chunks = self._chunks(length, self.max_read_length)
+        requests = []
+        for start, stop in chunks:
+            request_id = self._next_request_id()
+            if self.protocol_version >= 2:
+                header = V2_HEADER.pack(b'R', 0, 0, request_id, stop - start,
+                                        addr + 4 * start)
+            else:
+                header = self._header(b'r', addr + 4 * start, stop - start)
+            requests.append((header, request_id, header,
+                             (stop - start) * 4 + 8))
+        replies = await self._transfers(requests)
+        if len(replies) == 1:
+            return np.frombuffer(replies[0], dtype=np.uint32)
+        out = np.empty(length, dtype=np.uint32)
+        for (start, stop), data in zip(chunks, replies):
+            out[start:stop] = np.frombuffer(data, dtype=np.uint32)
+        return out
+
+    async def writes_async(self, addr, values):
+        """ long writes are split into chunks that are sent back-to-back """
+        values = np.asarray(values, dtype=np.uint32)
+        requests = []
+        for start, stop in self._chunks(len(values), self.max_write_length):
+            request_id = self._next_request_id()
+            if self.protocol_version >= 2:
+                header = V2_HEADER.pack(b'W', 0, 0, request_id, stop - start,
+                                        addr + 4 * start)
+            else:
+                header = self._header(b'w', addr + 4 * start, stop - start)
+            requests.append((header + values[start:stop].tobytes(),
+                             request_id, header, 8))
+        await self._transfers(requests)
+        return True  # indicate successful write
+
+    async def scope_trace_async(self, addr, length, channels=(1, 2)):
+        """ see MonitorClient.scope_trace_async (requires version 2) """
+        request_id = self._next_request_id()
+        flags = (SCOPE_CH1 if 1 in channels else 0) | \
+            (SCOPE_CH2 if 2 in channels else 0)
+        header = V2_HEADER.pack(b'S', flags, 0, request_id, length, addr)
+        # the trace can take arbitrarily long to be triggered
+        data = await self._transfer(header, request_id, header, None,
+                                    use_timeout=False)
+        return np.frombuffer(data, dtype=np.uint32)
+
+    async def _transfer(self, message, request_id, header, nbytes,
+                        use_timeout=True):
+        """
+        sends message and returns the reply without its header. For
+        protocol version 1, header and nbytes describe the expected reply.
+        """
+        replies = await self._transfers([(message, request_id, header,
+                                          nbytes)], use_timeout=use_timeout)
+        return replies[0]
+
+    async def _transfers(self, requests, use_timeout=True):
+        """
+        sends the messages of requests, a list of (message, request_id,
+        header, nbytes) as for _transfer, back-to-back and returns the list
+        of their replies
+        """
+        if not requests:
+            return []
+        if self._connection is None:
+            self._connection = ensure_future(
+                open_connection_async(self._hostname, self._port))
+        connection = self._connection
+        try:
+            reader, writer = await connection
+        except OSError:
+            if self._connection is connection:
+                self._connection = None
+            raise
+        futures = dict()
+        for message, request_id, header, nbytes in requests:
+            future = LOOP.create_future()
+            self._pending[request_id] = (header, nbytes, future)
+            writer.write(message)
+            futures[request_id] = future
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = ensure_future(self._dispatch(connection))
+        handles = []
+        if use_timeout:
+            handles = [LOOP.call_later(self.timeout, self._timeout, future)
+                       for future in futures.values()]
+        try:
+            await writer.drain()
+            replies = [await future for future in futures.values()]
+            self._failed_at = None
+            return replies
+        finally:
+            for handle in handles:
+                handle.cancel()
+            # requests abandoned by a cancelled caller are not awaited
+            # anymore. Version 2 replies are matched by their request id,
+            # such that the dispatcher discards them. Version 1 replies
+            # must still be received in order.
+            for request_id, future in futures.items():
+                if not future.done():
+                    future.cancel()
+                if future.cancelled() and self.protocol_version >= 2:
+                    self._pending.pop(request_id, None)
+
+    async def _dispatch(self, connection):
+        reader = connection.result()[0]
+        try:
+            while self._pending:
+                if self.protocol_version >= 2:
+                    await self._dispatch_v2(reader)
+                    continue
+                request_id = next(iter(self._pending))
+                header, nbytes, future = self._pending[request_id]
+                data = await reader.readexactly(nbytes)
+                if data[:8] != header:  # check for in-sync transmission
+                    raise MonitorProtocolError(
+                        "Wrong control sequence from server: %s" % data[:8])
+                del self._pending[request_id]
+                if not future.done():
+                    future.set_result(data[8:])
+        except (OSError, EOFError) as e:
+            if self._connection is connection:  # not yet closed
+                self._fail(e)
+
+    async def _dispatch_v2(self, reader):
+        """ receives one version 2 reply and passes it to its request """
+        header = await reader.readexactly(V2_HEADER.size)
+        command, status, _, request_id, length, addr = V2_HEADER.unpack(header)
+        if command not in (b'R', b'V', b'W', b'X', b'S'):
+            raise MonitorProtocolError("Wrong control sequence from server: "
+                                       "%s" % header)
+        data = b''
+        if command in (b'R', b'V', b'S') and status == STATUS_OK:
+            data = await reader.readexactly(4 * length)
+        pending = self._pending.pop(request_id, None)
+        if pending is None or pending[2].done():
+            return  # the request has been abandoned
+        if status != STATUS_OK:
+            pending[2].set_exception(IOError(
+                "Monitor_server rejected command %s of length %d at address "
+                "%s with status %d." % (command, length, hex(addr), status)))
+        else:
+            pending[2].set_result(data)
+
+    def _timeout(self, future):
+        if not future.done():
+            self._failed_at = time()
+            self._fail(asyncio.TimeoutError(
+                "No reply from monitor_server within %.1f s." % self.timeout))
+
+    def _fail(self, error):
+        """ closes the connection and passes error to all pending requests """
         self.close()
-        port = self._restartserver()
-        self.__init__(
-            hostname=self._hostname,
-            port=port,
-            restartserver=self._restartserver)
-
-
-class DummyClient(object):  # pragma: no cover
-    """Class for unitary tests without RedPitaya hardware available"""
-    class fpgadict(dict):
-        def __missing__(self, key):
-            return 1 # 0 (1 is needed to avoid division_by_zero errors for some registers)
-    fpgamemory = fpgadict({str(0x40100014): 1})  # scope decimation initial value
-
-    def read_fpgamemory(self, addr):
-        # here we implement a fraction of the memory map to simulate the actual redpitaya
-        # scope
-        offset = addr - 0x40100000
-        # scope curve buffer
-        if offset >= 0x10000 and offset < 0x30000:
-            v = int(np.random.normal(scale=2**13 - 1))//4
-            if v > 2**13-1:
-                v = 2*13-1
-            elif v < -(2**13-1):
-                v = -(2**13-1)
-            if v < 0:
-                v += 2**14
-            return v
-        # scope control register - trigger armed, trigger source etc.
-        if offset == 0:
-            return 0
-        if offset == 0x15C:  # current_timestamp lv part
-            t = int(time()*125e6)
-            return t % (2**32)
-        if offset == 0x160:  # current_timestamp mv part
-            return 0
-            t = int(time()*125e6)
-            return t - (t % (2**32))
-        if offset == 0x164:  # trigger_timestamp lv part
-            return 0
-        if offset == 0x168:  # trigger_timestamp mv part
-            return 0
-        #DSP modules
-        all = DSP_INPUTS
-        for module in DSP_INPUTS:
-            offset = addr - dsp_addr_base(module)
-            if module.startswith('pid'):
-                if offset == 0x220: # FILTERSTAGES
-                    return 4
-                elif offset == 0x228:  # MINBW
-                    return 1
-            elif module.startswith('iir'):
-                if offset == 0x200:  # IIRBITS
-                    return 64
-                elif offset == 0x204:  # IIRSHIFT
-                    return 32
-                elif offset == 0x208:  # IIRSTAGES
-                    return 16
-                elif offset == 0x220:  # filterstages
-                    return 1
-                elif offset == 0x108:  # overflow
-                    return 0
-            elif module.startswith('iq'):
-                if offset == 0x220:  # filterstages
-                    return 1
-                # rbw filter register
-                elif offset == 0x230:  # filterstages = 0x230
-                    return 2
-                elif offset == 0x234:  # shiftbits = 0x234
-                    return 2
-                elif offset == 0x238:  # minbw = 0x238
-                    return 1
-            for filter_module in ['iq', 'pid', 'iir']:
-                if module.startswith(filter_module):
-                    if offset == 0x220:  # filterstages
-                        return 1
-                    elif offset == 0x224:  # shiftbits
-                        return 2
-                    elif offset == 0x228:  # minbw
-                        return 1
-
-        # everything else is restored from the dict
-        return self.fpgamemory[str(addr)]
+        pending, self._pending = self._pending, dict()
+        for header, nbytes, future in pending.values():
+            if not future.done():
+                future.set_exception(error)
 
-    def reads(self, addr, length):
-        val = []
-        for i in range(length):
-            val.append(self.read_fpgamemory(addr+0x4*i))
-        return np.array(val, dtype=np.uint32)
-    
-    def writes(self, addr, values): # pragma: no-cover
-        for i, v in enumerate(values):
-            self.fpgamemory[str(addr+0x4*i)]=v
-    
-    def restart(self):
-        pass
-    
     def close(self):
-        pass
\ No newline at end of file
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            connection.add_done_callback(self._close_connection)
+
+    @staticmethod
+    def _close_connection(connection):
+        if not connection.cancelled() and connection.exception() is None:
+            connection.result()[1].close()
+
+
+# the former DummyClient is replaced by a simulation of the Red Pitaya
+from .simulator import SimulatorClient as DummyClient
@@ -0,0 +1,143 @@
+###############################################################################
+#    pyrpl - DSP servo controller for quantum optics with the RedPitaya
+#    Copyright (C) 2014-2016  Leonhard Neuhaus  (neuhaus@spectro.jussieu.fr)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+"""
+Averaging of scope traces with sub-sample alignment, such that the jitter
+of the trigger does not smear fast features of the averaged curve.
+
+    scope.enable_aligned_averaging(max_shift=8)
+    curve = scope.single()  # trace_average aligned traces
+
+The offset of each trace with respect to the current average is estimated
+from the peak of their cross-correlation (parabolic interpolation between
+the lags), and the trace is shifted back by a phase ramp of its spectrum.
+The averaging itself is done on the spectra, with the same weights as the
+normal averaging, and only the averaged spectrum is transformed back.
+
+The traces are processed in batches of batch traces, i.e. with one FFT
+call per batch for the spectra, the cross-correlations and the average.
+Note that the shift is circular: the first or last max_shift samples of
+the averaged curve may contain samples from the other end of the traces.
+"""
+from collections import deque
+
+import numpy as np
+
+
+class AlignedAverager(object):
+    """
+    Averages traces of shape (2, n) after aligning them on channel
+    (1 or 2) with offsets of up to max_shift samples. The offsets of the
+    last history traces are kept in shifts.
+    """
+    def __init__(self, n, channel=1, max_shift=8, batch=8, history=1000):
+        self.n = int(n)
+        self.channel = channel
+        self.max_shift = int(max_shift)
+        self.batch = int(batch)
+        self.history = int(history)
+        self._traces = np.zeros((self.batch, 2, self.n))
+        self._weights = np.zeros(self.batch)
+        # frequencies in units of cycles per sample
+        self._frequencies = np.fft.rfftfreq(self.n)
+        lags = np.arange(-self.max_shift, self.max_shift + 1)
+        self._lags = lags
+        self._lag_index = lags % self.n
+        self.reset()
+
+    def reset(self):
+        """ starts a new average """
+        self._count = 0  # traces in the batch
+        self._spectrum = None  # averaged spectrum (2, n // 2 + 1)
+        self.channels = ()
+        self.average = None  # averaged traces (2, n), NaN if not acquired
+        # estimated offsets of the last traces [samples]
+        self.shifts = deque(maxlen=self.history)
+
+    @property
+    def full(self):
+        return self._count == self.batch
+
+    def add(self, trace, weight, channels=(1, 2)):
+        """
+        Queues trace (the data of channels) with the weight (0 < weight <=
+        1) of its contribution to the average. The batch is processed when
+        it is full. The average restarts if the channels change.
+        """
+        channels = tuple(channels)
+        if channels != self.channels:
+            self._count = 0
+            self._spectrum = None
+            self.average = None
+            self.channels = channels
+        self._traces[self._count] = trace
+        self._weights[self._count] = weight
+        self._count += 1
+        if self.full:
+            self.flush()
+
+    def flush(self):
+        """ processes the queued traces and updates average """
+        if self._count == 0:
+            return self.average
+        count, self._count = self._count, 0
+        rows = [ch - 1 for ch in self.channels]
+        channel = self.channel if self.channel in self.channels \
+            else self.channels[0]
+        spectra = np.fft.rfft(self._traces[:count][:, rows], axis=-1)
+        spectrum = self._spectrum
+        if spectrum is None:  # the first trace is the reference
+            spectrum = spectra[0]
+        # cross-correlations with the average, only around lag 0
+        reference = np.conj(spectrum[rows.index(channel - 1)])
+        correlations = np.fft.irfft(
+            spectra[:, rows.index(channel - 1)] * reference, n=self.n,
+            axis=-1)[:, self._lag_index]
+        shifts = self._peak_positions(correlations)
+        self.shifts.extend(shifts.tolist())
+        # shift back by the phase ramp exp(2j pi f shift)
+        spectra *= np.exp(2j * np.pi * shifts[:, np.newaxis] *
+                          self._frequencies)[:, np.newaxis, :]
+        for weight, aligned in zip(self._weights[:count], spectra):
+            if self._spectrum is None or weight >= 1:
+                self._spectrum = aligned.copy()
+            else:
+                self._spectrum *= 1. - weight
+                self._spectrum += weight * aligned
+        average = np.full((2, self.n), np.nan)
+        average[rows] = np.fft.irfft(self._spectrum, n=self.n, axis=-1)
+        self.average = average
+        return average
+
+    def _peak_positions(self, correlations):
+        """
+        Returns the lags of the maxima of the correlations (batch, lags),
+        interpolated by a parabola through the maximum and its neighbours.
+        """
+        peak = np.argmax(correlations, axis=-1)
+        # the maximum at the border of the lag range is not interpolated
+        inner = np.clip(peak, 1, len(self._lags) - 2)
+        rows = np.arange(len(correlations))
+        left = correlations[rows, inner - 1]
+        center = correlations[rows, inner]
+        right = correlations[rows, inner + 1]
+        curvature = left - 2 * center + right
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = np.where(curvature < 0,
+                             0.5 * (left - right) / curvature, 0.)
+        delta = np.where(inner == peak, np.clip(delta, -0.5, 0.5), 0.)
+        return self._lags[peak] + delta
@@ -0,0 +1,269 @@
+###############################################################################
+#    pyrpl - DSP servo controller for quantum optics with the RedPitaya
+#    Copyright (C) 2014-2016  Leonhard Neuhaus  (neuhaus@spectro.jussieu.fr)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+"""
+Automatic measurements on the acquired scope traces.
+
+    measurements = scope.enable_measurements(['frequency', 'rise_time',
+                                              'phase'])
+    scope.single()
+    print(measurements.results['ch1_frequency'])  # of the last trace
+    print(measurements.summary()['phase']['std'])  # over all traces
+
+The low and high levels of a channel are the 5th and 95th percentiles of the
+trace. Edges are detected with a hysteresis between 10 % and 90 % of the
+amplitude, and the crossings of the 10 %, 50 % and 90 % levels are linearly
+interpolated between the samples. All measurements are vectorized, an edge
+loop in Python is never needed.
+
+Measurements of a single channel (results named ch1_<name>, ch2_<name>):
+
+    frequency, period [Hz, s]: from the first and last rising edge
+    rise_time, fall_time [s]: 10 % - 90 %, mean over all edges
+    duty_cycle: mean fraction of the period spent above the 50 % level
+    rms, mean, peak_to_peak [V]
+    amplitude [V]: high level - low level
+
+Measurements between the channels:
+
+    phase [deg]: phase of ch2 with respect to ch1 (positive if ch2 leads),
+        from the delays between the rising edges of ch1 and ch2 (50 %
+        crossings) relative to the period of ch1
+"""
+import numpy as np
+
+CHANNEL_MEASUREMENTS = ['frequency', 'period', 'rise_time', 'fall_time',
+                        'duty_cycle', 'rms', 'mean', 'peak_to_peak',
+                        'amplitude']
+MEASUREMENTS = CHANNEL_MEASUREMENTS + ['phase']
+
+LEVEL_PERCENTILES = (5, 95)
+
+
+def _crossing_times(y, j, level, t0, dt):
+    """ interpolated times where y crosses level between j and j + 1 """
+    return t0 + (j + (level - y[j]) / (y[j + 1] - y[j])) * dt
+
+
+def rising_edges(y, low, mid, high, t0=0., dt=1.):
+    """
+    Returns the interpolated times at which y crosses low, mid and high on
+    its rising edges (three arrays). An edge goes from below low to above
+    high, such that noise smaller than high - low is ignored.
+    """
+    index = np.arange(len(y))
+    last_low = np.maximum.accumulate(np.where(y <= low, index, -1))
+    last_high = np.maximum.accumulate(np.where(y >= high, index, -1))
+    last_below_mid = np.maximum.accumulate(np.where(y <= mid, index, -1))
+    is_high = last_high > last_low
+    # first samples above high after a sample below low
+    k = np.flatnonzero(is_high[1:] & ~is_high[:-1] &
+                       (last_low[:-1] >= 0)) + 1
+    return (_crossing_times(y, last_low[k], low, t0, dt),
+            _crossing_times(y, last_below_mid[k], mid, t0, dt),
+            _crossing_times(y, k - 1, high, t0, dt))
+
+
+class ChannelEdges(object):
+    """ levels and edges of one trace, computed on demand """
+    def __init__(self, y, t0, dt):
+        self.y, self.t0, self.dt = y, t0, dt
+        self._levels = None
+        self._rising = None
+        self._falling = None
+
+    @property
+    def levels(self):
+        """ (low, high) levels """
+        if self._levels is None:
+            self._levels = np.percentile(self.y, LEVEL_PERCENTILES)
+        return self._levels
+
+    def _edge_levels(self):
+        """ 10 %, 50 % and 90 % levels """
+        low, high = self.levels
+        return low + np.array([0.1, 0.5, 0.9]) * (high - low)
+
+    @property
+    def rising(self):
+        """ (t10, t50, t90) of the rising edges """
+        if self._rising is None:
+            l10, l50, l90 = self._edge_levels()
+            if l90 <= l10:
+                self._rising = (np.zeros(0),) * 3
+            else:
+                self._rising = rising_edges(self.y, l10, l50, l90, self.t0,
+                                            self.dt)
+        return self._rising
+
+    @property
+    def falling(self):
+        """ (t90, t50, t10) of the falling edges """
+        if self._falling is None:
+            l10, l50, l90 = self._edge_levels()
+            if l90 <= l10:
+                self._falling = (np.zeros(0),) * 3
+            else:
+                self._falling = rising_edges(-self.y, -l90, -l50, -l10,
+                                             self.t0, self.dt)
+        return self._falling
+
+    def period(self):
+        rising = self.rising[1]
+        if len(rising) < 2:
+            return np.nan
+        return (rising[-1] - rising[0]) / (len(rising) - 1)
+
+    def measure(self, name):
+        y = self.y
+        if name == 'frequency':
+            return 1. / self.period()
+        if name == 'period':
+            return self.period()
+        if name == 'rise_time':
+            t10, t50, t90 = self.rising
+            return np.mean(t90 - t10) if len(t10) else np.nan
+        if name == 'fall_time':
+            t90, t50, t10 = self.falling
+            return np.mean(t10 - t90) if len(t10) else np.nan
+        if name == 'duty_cycle':
+            rising, falling = self.rising[1], self.falling[1]
+            if len(rising) < 2:
+                return np.nan
+            # the first falling edge after each rising edge
+            i = np.searchsorted(falling, rising[:-1])
+            valid = i < len(falling)
+            high = falling[i[valid]] - rising[:-1][valid]
+            periods = np.diff(rising)[valid]
+            valid = high < periods
+            if not valid.any():
+                return np.nan
+            return np.mean(high[valid] / periods[valid])
+        if name == 'rms':
+            return np.sqrt(np.mean(y * y))
+        if name == 'mean':
+            return np.mean(y)
+        if name == 'peak_to_peak':
+            return np.ptp(y)
+        if name == 'amplitude':
+            low, high = self.levels
+            return high - low
+        raise ValueError("Unknown measurement %s." % name)
+
+
+def phase(ch1, ch2):
+    """
+    Phase [deg] of ch2 with respect to ch1 (ChannelEdges), the circular mean
+    over the delays from each rising edge of ch1 to the next one of ch2.
+    """
+    period = ch1.period()
+    rising1, rising2 = ch1.rising[1], ch2.rising[1]
+    i = np.searchsorted(rising2, rising1)
+    valid = i < len(rising2)
+    if np.isnan(period) or not valid.any():
+        return np.nan
+    delays = rising2[i[valid]] - rising1[valid]
+    return -np.angle(np.mean(np.exp(2j * np.pi / period * delays)),
+                     deg=True)
+
+
+class MeasurementEngine(object):
+    """
+    Computes the measurements names (see MEASUREMENTS) on each trace of the
+    channels and accumulates their statistics (mean, std, min, max).
+    Measurements that are undefined for a trace (e.g. the frequency of a
+    trace without two rising edges) are NaN and are left out of the
+    statistics.
+    """
+    def __init__(self, names=None, channels=(1, 2)):
+        if names is None:
+            names = MEASUREMENTS
+        unknown = [name for name in names if name not in MEASUREMENTS]
+        if unknown:
+            raise ValueError("Unknown measurements %s. Valid measurements "
+                             "are %s." % (unknown, MEASUREMENTS))
+        self.names = list(names)
+        self.channels = tuple(channels)
+        self.keys = ['ch%d_%s' % (ch, name) for ch in self.channels
+                     for name in self.names if name in CHANNEL_MEASUREMENTS]
+        if 'phase' in self.names and set(self.channels) >= {1, 2}:
+            self.keys.append('phase')
+        n = len(self.keys)
+        self._count = np.zeros(n, dtype=int)
+        self._mean = np.zeros(n)
+        self._m2 = np.zeros(n)
+        self._min = np.full(n, np.nan)
+        self._max = np.full(n, np.nan)
+        self.results = dict()  # of the last trace
+
+    def reset(self):
+        """ clears the statistics """
+        self._count[:] = 0
+        self._mean[:] = 0
+        self._m2[:] = 0
+        self._min[:] = np.nan
+        self._max[:] = np.nan
+        self.results = dict()
+
+    def measure(self, times, trace):
+        """
+        Measures the trace (shape (2, len(times)), NaN for channels that
+        were not acquired), updates the statistics and returns the results.
+        """
+        t0, dt = times[0], times[1] - times[0]
+        edges = {ch: ChannelEdges(trace[ch - 1], t0, dt)
+                 for ch in self.channels if not np.isnan(trace[ch - 1, 0])}
+        values = np.full(len(self.keys), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, key in enumerate(self.keys):
+                if key == 'phase':
+                    if 1 in edges and 2 in edges:
+                        values[i] = phase(edges[1], edges[2])
+                else:
+                    ch = int(key[2])
+                    if ch in edges:
+                        values[i] = edges[ch].measure(key[4:])
+        self._update(values)
+        self.results = dict(zip(self.keys, values.tolist()))
+        return self.results
+
+    def _update(self, values):
+        """ Welford update of the statistics with the values (not NaN) """
+        valid = ~np.isnan(values)
+        self._count[valid] += 1
+        delta = values[valid] - self._mean[valid]
+        self._mean[valid] += delta / self._count[valid]
+        self._m2[valid] += delta * (values[valid] - self._mean[valid])
+        self._min[valid] = np.fmin(self._min[valid], values[valid])
+        self._max[valid] = np.fmax(self._max[valid], values[valid])
+
+    def summary(self):
+        """
+        Returns {key: {'value', 'mean', 'std', 'min', 'max', 'count'}} with
+        the value of the last trace and the statistics over all traces.
+        """
+        summary = dict()
+        for i, key in enumerate(self.keys):
+            count = int(self._count[i])
+            summary[key] = dict(
+                value=self.results.get(key, np.nan),
+                mean=float(self._mean[i]) if count else np.nan,
+                std=float(np.sqrt(self._m2[i] / count)) if count else np.nan,
+                min=float(self._min[i]),
+                max=float(self._max[i]),
+                count=count)
+        return summary
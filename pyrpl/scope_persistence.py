@@ -0,0 +1,115 @@
+###############################################################################
+#    pyrpl - DSP servo controller for quantum optics with the RedPitaya
+#    Copyright (C) 2014-2016  Leonhard Neuhaus  (neuhaus@spectro.jussieu.fr)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+"""
+Persistence (density) display of the scope, e.g. for eye diagrams of lock
+error signals.
+
+Each acquired trace is binned into a 2D histogram, time x voltage or, in
+xy_mode, ch1 x ch2. The traces themselves are not stored:
+
+    persistence = scope.enable_persistence(bins=(512, 256), decay=64)
+    scope.continuous()
+    ...
+    image = persistence.image  # shape (512, 256), [x bin, y bin]
+    scope.disable_persistence()
+
+With decay, older traces fade out exponentially with a time constant of
+about decay traces (rounded to a power of two).
+"""
+import numpy as np
+
+
+class PersistenceAccumulator(object):
+    """
+    Accumulates curves into a preallocated integer grid of shape bins,
+    covering xrange x yrange. Points outside of the ranges and NaN are
+    ignored.
+    """
+    # weight of a point in the grid with decay, such that a point fades out
+    # over several traces despite the integer arithmetics
+    decay_unit = 1 << 8
+
+    def __init__(self, bins=(512, 256), xrange=(0., 1.), yrange=(-1., 1.),
+                 decay=None):
+        self.bins = tuple(int(b) for b in bins)
+        self.grid = np.zeros(self.bins, dtype=np.int64)
+        self._flat_grid = self.grid.reshape(-1)  # a view on grid
+        self._scratch = np.zeros_like(self._flat_grid)
+        self.xrange = tuple(xrange)
+        self.yrange = tuple(yrange)
+        self.decay = decay
+        self.traces = 0  # number of accumulated traces
+
+    @property
+    def decay(self):
+        return self._decay
+
+    @decay.setter
+    def decay(self, decay):
+        self._decay = decay
+        if decay is None:
+            self._shift, self._unit = None, 1
+        else:
+            self._shift = max(int(np.round(np.log2(decay))), 0)
+            self._unit = self.decay_unit
+        self.reset()
+
+    def reset(self):
+        """ clears the grid """
+        self.grid.fill(0)
+        self.traces = 0
+
+    def set_ranges(self, xrange, yrange):
+        """ changes the ranges of the grid, which is cleared if needed """
+        xrange, yrange = tuple(xrange), tuple(yrange)
+        if xrange != self.xrange or yrange != self.yrange:
+            self.xrange, self.yrange = xrange, yrange
+            self.reset()
+
+    def accumulate(self, x, y):
+        """
+        Adds the curve(s) y(x) to the grid. y may hold several curves along
+        its first axes (e.g. shape (2, len(x))).
+        """
+        y = np.asarray(y)
+        x = np.broadcast_to(np.asarray(x), y.shape)
+        (x0, x1), (y0, y1) = self.xrange, self.yrange
+        nx, ny = self.bins
+        xi = (x - x0) * (nx / float(x1 - x0))
+        yi = (y - y0) * (ny / float(y1 - y0))
+        with np.errstate(invalid='ignore'):  # NaN are out of range
+            valid = (xi >= 0) & (xi < nx) & (yi >= 0) & (yi < ny)
+        index = xi[valid].astype(np.intp) * ny + yi[valid].astype(np.intp)
+        counts = np.bincount(index, minlength=nx * ny)
+        if self._shift is not None:
+            # grid -= ceil(grid / 2 ** shift), such that points fade out
+            # completely
+            scratch = self._scratch
+            np.add(self._flat_grid, (1 << self._shift) - 1, out=scratch)
+            scratch >>= self._shift
+            self._flat_grid -= scratch
+            counts *= self._unit
+        self._flat_grid += counts
+        self.traces += 1
+
+    @property
+    def image(self):
+        """ the grid in units of points per bin """
+        if self._unit == 1:
+            return self.grid
+        return self.grid / float(self._unit)
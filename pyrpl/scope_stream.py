@@ -0,0 +1,237 @@
+###############################################################################
+#    pyrpl - DSP servo controller for quantum optics with the RedPitaya
+#    Copyright (C) 2014-2016  Leonhard Neuhaus  (neuhaus@spectro.jussieu.fr)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+"""
+Gapless streaming of the scope inputs, e.g. for hours of drift data.
+
+The scope runs in rolling mode, i.e. its circular buffers are written
+continuously. ScopeStream polls the write pointer and transfers only the
+samples written since the previous poll, such that consecutive segments
+join without gaps. If the buffers were overwritten before they could be
+read (the network is too slow for the sampling rate), the lost samples are
+counted from the fpga timestamps and reported in overruns.
+
+    with scope.stream('drift.npy', duration=3600) as stream:
+        for block in stream:
+            print(block.position, block.data.mean(axis=0))
+    data = load_stream('drift.npy')  # also possible during the recording
+
+The data are written by a background thread to a .npy file of float32
+volts with shape (samples, channels). The header of the file is updated
+after each block, such that it can be memory-mapped at any time.
+"""
+import logging
+import struct
+import threading
+from collections import namedtuple
+try:
+    from queue import Queue
+except ImportError:  # Python 2
+    from Queue import Queue
+import numpy as np
+
+from .async_utils import sleep
+from .pyrpl_utils import time
+
+# position: index of the first sample of the block in the stream
+# timestamp: fpga clock cycle of the last sample of the block
+# data: float32 array of shape (samples, channels) in volts
+# lost: number of samples lost (overrun) before the first sample of data
+StreamBlock = namedtuple('StreamBlock', ['position', 'timestamp', 'data',
+                                         'lost'])
+
+NPY_HEADER_SIZE = 128  # large enough for any shape, multiple of 64
+
+
+def npy_header(shape, dtype=np.float32):
+    """ fixed-size header of a .npy file (format version 1.0) """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" \
+             % (np.lib.format.dtype_to_descr(np.dtype(dtype)), tuple(shape))
+    length = NPY_HEADER_SIZE - 10
+    header = header.ljust(length - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', length) + \
+        header.encode('latin1')
+
+
+def load_stream(filename):
+    """ memory-maps the samples recorded so far in filename """
+    return np.load(filename, mmap_mode='r')
+
+
+class ScopeStream(object):
+    """
+    Streams the channels of scope to the file filename (optional) for
+    duration seconds (None: until stop() is called).
+
+    Iterating over the stream acquires and yields StreamBlocks until the
+    duration is reached. poll() acquires a single block. The scope must not
+    be used otherwise while the stream is running.
+    """
+    def __init__(self, scope, filename=None, duration=None, channels=None):
+        self.logger = logging.getLogger(name=__name__)
+        self.scope = scope
+        self.filename = filename
+        self.duration = duration
+        if channels is None:
+            channels = scope._acquired_channels() or (1,)
+        self.channels = tuple(channels)
+        self.position = 0  # samples in the stream
+        self.overruns = []  # (position, lost samples)
+        self.running = False
+        self._buffer = np.zeros(scope.data_length, dtype=np.uint32)
+        self._queue = None
+        self._writer = None
+
+    @property
+    def lost(self):
+        """ total number of lost samples """
+        return sum(lost for position, lost in self.overruns)
+
+    @property
+    def samples(self):
+        """ number of samples after which the stream stops """
+        if self.duration is None:
+            return None
+        return int(round(self.duration / self.sampling_time))
+
+    def start(self):
+        """ puts the scope in rolling mode and starts the stream """
+        scope = self.scope
+        if scope.running_state != 'stopped':
+            scope.stop()
+        self.sampling_time = scope.sampling_time
+        self._decimation = int(scope.decimation)
+        self.poll_interval = min(0.25 * scope.duration, 0.1)
+        scope._start_acquisition_rolling_mode()
+        self._write_pointer, self._timestamp = \
+            scope._write_pointer_and_timestamp()
+        self.position = 0
+        self.overruns = []
+        if self.filename is not None:
+            # the file exists (and can be loaded) as soon as the stream runs
+            f = open(self.filename, 'wb')
+            f.write(npy_header((0, len(self.channels))))
+            f.flush()
+            self._queue = Queue()
+            self._writer = threading.Thread(target=self._write_file,
+                                            args=(f,), name='ScopeStream')
+            self._writer.daemon = True
+            self._writer.start()
+        self.running = True
+        return self
+
+    def stop(self):
+        """ stops the stream and waits until all data have been written """
+        self.running = False
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def __iter__(self):
+        if not self.running:
+            self.start()
+        try:
+            while self.running:
+                start = time()
+                block = self.poll()
+                if block is not None:
+                    yield block
+                remaining = self.poll_interval - (time() - start)
+                if remaining > 0 and self.running:
+                    sleep(remaining)
+        finally:
+            self.stop()
+
+    def run(self):
+        """ acquires the stream until the duration is reached """
+        for block in self:
+            pass
+        return self
+
+    def poll(self):
+        """
+        Transfers the samples written since the previous poll and returns
+        them as a StreamBlock (None if there are no new samples).
+        """
+        scope, n = self.scope, self.scope.data_length
+        wp, timestamp = scope._write_pointer_and_timestamp()
+        new = (wp - self._write_pointer) % n
+        # complete buffer overwrites since the previous poll
+        elapsed = (timestamp - self._timestamp) / float(self._decimation)
+        lost = max(int(round((elapsed - new) / n)), 0) * n
+        if self.samples is not None:
+            new = min(new, max(self.samples - self.position - self.lost -
+                               lost, 0))
+        if new == 0 and lost == 0:
+            return None
+        first = (self._write_pointer + 1) % n
+        last = (first + new - 1) % n
+        timestamp -= ((wp - last) % n) * self._decimation
+        segments = [(first, first + new)] if first + new <= n \
+            else [(first, n), (0, last + 1)]
+        data = np.empty((new, len(self.channels)), dtype=np.float32)
+        for i, ch in enumerate(self.channels):
+            position = 0
+            for a, b in segments:
+                buffer = self._buffer[a:b]
+                scope._reads_into(0x10000 * ch + 4 * a, buffer)
+                np.multiply(scope._to_int14(buffer), 1. / 2 ** 13,
+                            out=data[position:position + b - a, i])
+                position += b - a
+        # samples that were overwritten during the transfer are lost as well
+        after = (scope._write_pointer_current - wp) % n
+        overwritten = min(max(after - n + (wp - first) % n + 1, 0), new)
+        if overwritten:
+            data = data[overwritten:]
+            lost += overwritten
+        if lost:
+            self.overruns.append((self.position, lost))
+            self.logger.warning("Scope stream overrun: %d samples lost after "
+                                "sample %d. Try a larger decimation.",
+                                lost, self.position)
+        block = StreamBlock(self.position, timestamp, data, lost)
+        self._write_pointer, self._timestamp = last, timestamp
+        self.position += len(data)
+        if self._queue is not None:
+            self._queue.put(block)
+        if self.samples is not None and \
+                self.position + self.lost >= self.samples:
+            self.running = False
+        return block
+
+    def _write_file(self, f):
+        """ appends the queued blocks to the open file f (writer thread) """
+        width = len(self.channels)
+        with f:
+            length = 0
+            while True:
+                block = self._queue.get()
+                if block is None:
+                    break
+                f.seek(0, 2)
+                f.write(block.data.tobytes())
+                length += len(block.data)
+                f.seek(0)
+                f.write(npy_header((length, width)))
+                f.flush()
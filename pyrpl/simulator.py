@@ -0,0 +1,583 @@
+###############################################################################
+#    pyrpl - DSP servo controller for quantum optics with the RedPitaya
+#    Copyright (C) 2014-2016  Leonhard Neuhaus  (neuhaus@spectro.jussieu.fr)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+"""
+In-process simulation of a Red Pitaya running the pyrpl FPGA design.
+
+SimulatorClient has the same interface as MonitorClient, but instead of
+talking to a monitor_server, it holds the FPGA register space in a numpy
+array. The signals of the DSP chain (asg -> iq / iir -> outputs -> analog
+inputs -> scope) are computed block-wise for arrays of clock cycles, such
+that scope traces and network analyzer points are physically meaningful
+and take about as long as with the hardware:
+
+- the simulated clock runs at 125 MHz in real time,
+- the asgs play their data tables with the programmed frequency,
+  amplitude and offset (bursts are not simulated),
+- the iq modules modulate, demodulate (with their first order filters)
+  and accumulate the network analyzer data,
+- the iir module passes its input through (the filter coefficients are
+  not simulated),
+- out1/out2 are the saturated sums of the modules whose output_direct
+  points to them. With analog_loopback=True, in1 and in2 receive out1 and
+  out2 plus noise, as with cables between the outputs and inputs,
+- the scope is armed, triggered (immediately, on the edges of its inputs
+  or on the asgs) and acquires its buffers with the programmed decimation
+  and trigger delay, or continuously in rolling mode.
+
+Feedback loops (e.g. an iq module whose input is its own output through
+the analog loopback) are truncated after a few passes through the chain.
+"""
+import logging
+import numpy as np
+from scipy.signal import lfilter
+
+from .hardware_modules.dsp import DSP_INPUTS, dsp_addr_base
+from .pyrpl_utils import time
+
+CLOCK_FREQUENCY = 125e6
+MEMORY_BASE = 0x40000000
+MEMORY_SIZE = 0x800000
+
+SCOPE_BASE = 0x40100000
+SCOPE_DATA_LENGTH = 2 ** 14
+ASG_BASE = 0x40200000
+
+# maximum number of passes through the dsp chain (for feedback loops)
+MAX_DEPTH = 6
+
+
+def dsp_number(name):
+    return DSP_INPUTS[name]
+
+
+def to_int14(volts):
+    """ converts volts into 14 bit two's complement register values """
+    values = np.clip(np.round(np.asarray(volts) * 2 ** 13),
+                     -2 ** 13, 2 ** 13 - 1).astype(np.int64)
+    return (values & 0x3FFF).astype(np.uint32)
+
+
+def from_signed(value, bits):
+    value = int(value) & (2 ** bits - 1)
+    if value >= 2 ** (bits - 1):
+        value -= 2 ** bits
+    return value
+
+
+class SimulatorClient(object):
+    """
+    Simulates a Red Pitaya with the interface of MonitorClient.
+
+    noise is the rms noise of the analog inputs in volts, and
+    analog_loopback connects out1/out2 to in1/in2.
+    """
+    def __init__(self, noise=1e-3, analog_loopback=True, seed=None):
+        self.logger = logging.getLogger(name=__name__)
+        self.noise = noise
+        self.analog_loopback = analog_loopback
+        self._random = np.random.RandomState(seed)
+        self._start_time = time()
+        # registers that have never been written read 1 (like the former
+        # DummyClient) to avoid divisions by zero
+        self.memory = np.ones(MEMORY_SIZE // 4, dtype=np.uint32)
+        self._constants = dict()
+        self._init_constants()
+        self._constant_addresses = np.array(sorted(self._constants),
+                                            dtype=np.int64)
+        self._constant_values = np.array(
+            [self._constants[a] for a in self._constant_addresses],
+            dtype=np.uint32)
+        self._write(self._constant_addresses, self._constant_values)
+        self._write([SCOPE_BASE + 0x14], [1])  # initial scope decimation
+        # registers whose value is computed upon each read
+        self._dynamic = dict()
+        self._init_dynamic_registers()
+        self._dynamic_addresses = np.array(sorted(self._dynamic),
+                                           dtype=np.int64)
+        self._control_addresses = np.array(
+            [SCOPE_BASE, SCOPE_BASE + 0x4, ASG_BASE] +
+            [dsp_addr_base(name) + 0x108 for name in ['iq0', 'iq1', 'iq2']],
+            dtype=np.int64)
+        # scope state
+        self._scope_armed = False
+        self._scope_arm_time = 0
+        self._scope_written = -1  # last sample written since arm (rolling)
+        self._scope_checked_until = 0  # trigger search has reached this time
+        self._scope_hysteresis_ok = False
+        self._scope_trigger_time = None
+        self._scope_end_time = None
+        self._scope_trigger_timestamp = 0
+        self._scope_wp_trigger = 0
+        self._scope_wp_current = 0
+        self._scope_acquired = True
+        # asg trigger times (None while waiting for a trigger)
+        self._asg_trigger_time = [None, None]
+        # start of network analyzer averaging for each iq module
+        self._na_start = dict()
+        # recursion depth of signal()
+        self._depth = 0
+
+    # the interface of MonitorClient
+    def reads(self, addr, length):
+        self._advance()
+        values = np.zeros(length, dtype=np.uint32)
+        start = (addr - MEMORY_BASE) // 4
+        lo, hi = max(start, 0), min(start + length, len(self.memory))
+        if hi > lo:
+            values[lo - start:hi - start] = self.memory[lo:hi]
+        i, j = np.searchsorted(self._dynamic_addresses,
+                               [addr, addr + 4 * length])
+        for dynamic_addr in self._dynamic_addresses[i:j]:
+            values[(dynamic_addr - addr) // 4] = \
+                self._dynamic[dynamic_addr]() & 0xFFFFFFFF
+        return values
+
+    def writes(self, addr, values):
+        values = np.asarray(values, dtype=np.uint32)
+        self._advance()
+        addresses = addr + 4 * np.arange(len(values), dtype=np.int64)
+        # writes only have side effects on a few control registers
+        control = np.isin(addresses, self._control_addresses)
+        previous = [self._register(a) for a in addresses[control]]
+        self._write(addresses, values)
+        # read-only registers keep their value
+        i, j = np.searchsorted(self._constant_addresses,
+                               [addr, addr + 4 * len(values)])
+        self._write(self._constant_addresses[i:j], self._constant_values[i:j])
+        for a, value, old in zip(addresses[control], values[control],
+                                 previous):
+            self._on_write(int(a), int(value), old)
+
+    def reads_into(self, addr, out):
+        out[:] = self.reads(addr, len(out))
+        return out
+
+    def batch(self):
+        from .redpitaya_client import MonitorBatch
+        return MonitorBatch(self)
+
+    def transfers(self, requests):
+        results = []
+        for request in requests:
+            if request.command == 'r':
+                results.append(self.reads(request.addr, request.length))
+            else:
+                self.writes(request.addr, request.values)
+                results.append(True)
+        return results
+
+    async def reads_async(self, addr, length):
+        return self.reads(addr, length)
+
+    async def writes_async(self, addr, values):
+        return self.writes(addr, values)
+
+    def restart(self):
+        pass
+
+    def close(self):
+        pass
+
+    # memory and clock
+    def _write(self, addresses, values):
+        index = (np.asarray(addresses, dtype=np.int64) - MEMORY_BASE) // 4
+        valid = (index >= 0) & (index < len(self.memory))
+        self.memory[index[valid]] = np.asarray(values)[valid]
+
+    def _register(self, addr):
+        return int(self.memory[(addr - MEMORY_BASE) // 4])
+
+    def now(self):
+        """ current time in clock cycles """
+        return int((time() - self._start_time) * CLOCK_FREQUENCY)
+
+    def _init_constants(self):
+        """ read-only registers that describe the FPGA design """
+        c = self._constants
+        for name in ['pid0', 'pid1', 'pid2']:
+            base = dsp_addr_base(name)
+            c[base + 0x220] = 4  # filterstages
+            c[base + 0x224] = 2  # shiftbits
+            c[base + 0x228] = 1  # minbw
+        for name in ['iq0', 'iq1', 'iq2', 'iir']:
+            base = dsp_addr_base(name)
+            c[base + 0x220] = 1  # filterstages
+            c[base + 0x224] = 2  # shiftbits
+            c[base + 0x228] = 1  # minbw
+        for name in ['iq0', 'iq1', 'iq2']:
+            base = dsp_addr_base(name)
+            c[base + 0x230] = 2  # filterstages of the bandwidth
+            c[base + 0x234] = 2  # shiftbits
+            c[base + 0x238] = 1  # minbw
+        base = dsp_addr_base('iir')
+        c[base + 0x200] = 64  # IIRBITS
+        c[base + 0x204] = 32  # IIRSHIFT
+        c[base + 0x208] = 16  # IIRSTAGES
+        c[base + 0x108] = 0  # overflow
+
+    def _init_dynamic_registers(self):
+        d = self._dynamic
+        d[SCOPE_BASE + 0x0] = self._scope_state
+        d[SCOPE_BASE + 0x18] = lambda: self._scope_wp_current
+        d[SCOPE_BASE + 0x1C] = lambda: self._scope_wp_trigger
+        d[SCOPE_BASE + 0x2C] = self._scope_we_cnt
+        d[SCOPE_BASE + 0x154] = lambda: self._now_int14('in1')
+        d[SCOPE_BASE + 0x158] = lambda: self._now_int14('in2')
+        d[SCOPE_BASE + 0x15C] = lambda: self.now()
+        d[SCOPE_BASE + 0x160] = lambda: self.now() >> 32
+        d[SCOPE_BASE + 0x164] = lambda: self._scope_trigger_timestamp
+        d[SCOPE_BASE + 0x168] = lambda: self._scope_trigger_timestamp >> 32
+        d[SCOPE_BASE + 0x16C] = lambda: 1  # pretrig_ok
+        trig = dsp_addr_base('trig')
+        d[trig + 0x15C] = lambda: self.now()
+        d[trig + 0x160] = lambda: self.now() >> 32
+        for name, number in DSP_INPUTS.items():
+            if name in ('off', 'iq2_2'):
+                continue
+            # current_output_signal
+            d[dsp_addr_base(name) + 0x10] = \
+                lambda number=number: self._now_int14(number)
+        for name in ['iq0', 'iq1', 'iq2']:
+            base = dsp_addr_base(name)
+            for i in range(4):
+                d[base + 0x140 + 4 * i] = \
+                    lambda name=name, i=i: self._nadata(name)[i]
+
+    def _on_write(self, addr, value, previous):
+        """ side effects of register writes """
+        now = self.now()
+        if addr == SCOPE_BASE:
+            if value & 2:  # reset of the write state machine
+                self._scope_armed = False
+                self._scope_trigger_time = None
+                self._scope_wp_trigger = 0
+                self._scope_wp_current = 0
+                self._scope_trigger_timestamp = now
+            if value & 1:  # arm
+                self._scope_armed = True
+                self._scope_acquired = False
+                self._scope_arm_time = now
+                self._scope_written = -1
+                self._scope_checked_until = now
+                self._scope_hysteresis_ok = False
+                self._scope_trigger_time = None
+        elif addr == SCOPE_BASE + 0x4:
+            if value == 1 and self._scope_armed:  # software trigger
+                self._scope_trigger(now)
+        elif addr == ASG_BASE:
+            for ch in (0, 1):
+                shift = 16 * ch
+                source = (value >> shift) & 0x7
+                reset = (value >> (6 + shift)) & 1
+                old_source = (previous >> shift) & 0x7
+                old_reset = (previous >> (6 + shift)) & 1
+                if reset or source not in (1, 5):  # immediately, high
+                    self._asg_trigger_time[ch] = None
+                elif old_reset or old_source != source \
+                        or self._asg_trigger_time[ch] is None:
+                    self._asg_trigger_time[ch] = now
+        else:
+            for name in ['iq0', 'iq1', 'iq2']:
+                if addr == dsp_addr_base(name) + 0x108:  # frequency
+                    self._na_start[name] = now
+
+    # the signals of the dsp chain
+    def signal(self, source, t):
+        """
+        returns the signal source (dsp name or number) in volts at the
+        clock cycles t (int64 array)
+        """
+        if not isinstance(source, int):
+            source = dsp_number(source)
+        if self._depth >= MAX_DEPTH:
+            return np.zeros(len(t))
+        self._depth += 1
+        try:
+            return self._signal(source, np.asarray(t, dtype=np.int64))
+        finally:
+            self._depth -= 1
+
+    def _signal(self, number, t):
+        if number in (DSP_INPUTS['in1'], DSP_INPUTS['in2']):
+            x = self._random.normal(scale=self.noise, size=len(t)) \
+                if self.noise else np.zeros(len(t))
+            if self.analog_loopback:
+                x += self.signal(number + 2, t)  # out1 -> in1, out2 -> in2
+            return np.clip(x, -1, 1 - 2 ** -13)
+        if number in (DSP_INPUTS['out1'], DSP_INPUTS['out2']):
+            channel = 1 if number == DSP_INPUTS['out1'] else 2
+            x = np.zeros(len(t))
+            for name in ['asg0', 'asg1', 'iq0', 'iq1', 'iq2', 'iir']:
+                if self._output_direct(name) & channel:
+                    x += self._direct_signal(name, t)
+            return np.clip(x, -1, 1 - 2 ** -13)
+        if number in (DSP_INPUTS['asg0'], DSP_INPUTS['asg1']):
+            return self._asg(0 if number == DSP_INPUTS['asg0'] else 1, t)
+        if number in (DSP_INPUTS['iq0'], DSP_INPUTS['iq1'],
+                      DSP_INPUTS['iq2'], DSP_INPUTS['iq2_2']):
+            name = 'iq2' if number == DSP_INPUTS['iq2_2'] else \
+                [k for k, v in DSP_INPUTS.items() if v == number][0]
+            return self._iq_signal(name, t,
+                                   quadrature=number == DSP_INPUTS['iq2_2'])
+        if number == DSP_INPUTS['iir']:
+            return self._direct_signal('iir', t)
+        return np.zeros(len(t))  # pids, trig and off
+
+    def _input(self, name, t):
+        return self.signal(self._register(dsp_addr_base(name)) & 0xF, t)
+
+    def _output_direct(self, name):
+        return self._register(dsp_addr_base(name) + 0x4) & 0x3
+
+    def _direct_signal(self, name, t):
+        """ the signal of module name at its output_direct """
+        if name in ('asg0', 'asg1'):
+            return self._asg(int(name[-1]), t)
+        if name == 'iir':
+            base = dsp_addr_base('iir')
+            if self._register(base + 0x104) & 1:  # on
+                return self._input('iir', t)
+            return np.zeros(len(t))
+        return self._iq_direct(name, t)
+
+    def _asg(self, ch, t):
+        value_offset = 0x20 * ch
+        control = self._register(ASG_BASE) >> (16 * ch)
+        if control & (1 << 7):  # output turned off
+            return np.zeros(len(t))
+        scale_offset = self._register(ASG_BASE + 0x4 + value_offset)
+        scale = (scale_offset & 0x3FFF) / 2. ** 13
+        offset = from_signed(scale_offset >> 16, 14) / 2. ** 13
+        wrap = self._register(ASG_BASE + 0x8 + value_offset) + 1
+        start = self._register(ASG_BASE + 0xC + value_offset)
+        step = self._register(ASG_BASE + 0x10 + value_offset)
+        trigger_time = self._asg_trigger_time[ch]
+        if trigger_time is None:
+            counter = np.full(len(t), start % wrap, dtype=np.int64)
+        else:
+            elapsed = np.maximum(t - trigger_time, 0) % wrap
+            counter = (start + step * elapsed) % wrap
+        data_offset = 0x10000 * (ch + 1)
+        index = (ASG_BASE + data_offset - MEMORY_BASE) // 4 + \
+            ((counter >> 16) & 0x3FFF)
+        table = self.memory[index].astype(np.int64) & 0x3FFF
+        table = np.where(table >= 2 ** 13, table - 2 ** 14, table) / 2. ** 13
+        return np.clip(table * scale + offset, -1, 1 - 2 ** -13)
+
+    def _iq_parameters(self, name):
+        base = dsp_addr_base(name)
+        on = self._register(base + 0x100) & 1
+        phase = self._register(base + 0x104) / 2. ** 32 * 2 * np.pi
+        omega = self._register(base + 0x108) / 2. ** 32 * 2 * np.pi
+        gain = from_signed(self._register(base + 0x110), 18) / 2. ** 11
+        amplitude = from_signed(self._register(base + 0x114), 18) / 2. ** 17
+        quadrature_factor = from_signed(self._register(base + 0x118), 18)
+        return on, phase, omega, gain, amplitude, quadrature_factor
+
+    def _iq_quadratures(self, name, t, omega, phase):
+        """ demodulated and low-pass filtered input (complex) """
+        x = self._input(name, t) * 2 * np.exp(-1j * (omega * t - phase))
+        base = dsp_addr_base(name)
+        stages = self._register(base + 0x230)
+        shiftbits = self._register(base + 0x234)
+        minbw = max(self._register(base + 0x238), 1)
+        maxshift = int(np.floor(np.log2(CLOCK_FREQUENCY / minbw))) + 1
+        settings = self._register(base + 0x124)
+        dt = float(t[1] - t[0]) if len(t) > 1 else 1.
+        for i in range(stages):
+            v = (settings >> (8 * i)) & 0xFF
+            if not v >> 7:
+                continue
+            alpha = 2. ** (v & (2 ** shiftbits - 1)) / 2 ** maxshift
+            a = (1 - alpha) ** dt  # the filter on the grid of t
+            lowpass = lfilter([1 - a], [1, -a], x)
+            x = x - lowpass if (v >> 6) & 1 else lowpass
+        return x
+
+    def _iq_direct(self, name, t):
+        on, phase, omega, gain, amplitude, qf = self._iq_parameters(name)
+        if not on:
+            return np.zeros(len(t))
+        x = amplitude * np.cos(omega * t)
+        if gain != 0:
+            z = self._iq_quadratures(name, t, omega, phase)
+            x = x + gain * np.real(z * np.exp(1j * omega * t))
+        return np.clip(x, -1, 1 - 2 ** -13)
+
+    def _iq_signal(self, name, t, quadrature=False):
+        """ the output_signal of the iq module """
+        on, phase, omega, gain, amplitude, qf = self._iq_parameters(name)
+        output_signal = self._register(dsp_addr_base(name) + 0x10C) & 0x7
+        if not on or output_signal in (2, 3):  # pfd and off
+            return np.zeros(len(t))
+        if output_signal == 1 and not quadrature:
+            return self._iq_direct(name, t)
+        z = self._iq_quadratures(name, t, omega, phase)
+        x = np.imag(z) if quadrature else np.real(z)
+        return np.clip(qf * x / 2 ** 8, -1, 1 - 2 ** -13)
+
+    def _now_int14(self, source):
+        return int(to_int14(self.signal(source, np.array([self.now()])))[0])
+
+    def _nadata(self, name):
+        """ the network analyzer accumulators of iq module name """
+        base = dsp_addr_base(name)
+        on, phase, omega, gain, amplitude, qf = self._iq_parameters(name)
+        averages = self._register(base + 0x130)
+        start = self._na_start.get(name, 0) + self._register(base + 0x134)
+        # the average over the averaging window is estimated with a
+        # stratified random sample of the window
+        n = int(min(averages, 4096))
+        if n > 0:
+            t = start + ((np.arange(n) + self._random.uniform(size=n))
+                         * averages / n).astype(np.int64)
+            x = self._input(name, t) * np.exp(-1j * (omega * t - phase))
+            total = np.mean(x) * averages * 2 ** 23
+        else:
+            total = 0j
+        words = []
+        for value in (total.real, total.imag):
+            value = int(np.round(value)) % 2 ** 62
+            words += [value & 0x7FFFFFFF, value >> 31]
+        return words
+
+    # the scope
+    def _scope_parameters(self):
+        decimation = max(self._register(SCOPE_BASE + 0x14), 1)
+        delay = self._register(SCOPE_BASE + 0x10)
+        source = self._register(SCOPE_BASE + 0x4) & 0xF
+        return decimation, delay, source
+
+    def _scope_state(self):
+        running = self._scope_trigger_time is not None and \
+            not self._scope_acquired
+        keep = self._register(SCOPE_BASE) & 0x8
+        return keep | (4 if running else 0) | \
+            (1 if self._scope_armed else 0)
+
+    def _scope_we_cnt(self):
+        decimation, delay, source = self._scope_parameters()
+        if not self._scope_armed:
+            return 0
+        end = self.now() if self._scope_trigger_time is None \
+            else self._scope_trigger_time
+        return min((end - self._scope_arm_time) // decimation, 2 ** 32 - 1)
+
+    def _scope_trigger(self, time):
+        decimation, delay, source = self._scope_parameters()
+        # the trigger needs enough data before the trigger event
+        if delay < SCOPE_DATA_LENGTH:
+            time = max(time, self._scope_arm_time + decimation *
+                       (SCOPE_DATA_LENGTH - delay))
+        self._scope_trigger_time = time
+        self._scope_end_time = time + delay * decimation
+        self._scope_trigger_timestamp = time
+        self._scope_wp_trigger = \
+            ((time - self._scope_arm_time) // decimation) % SCOPE_DATA_LENGTH
+
+    def _find_trigger(self, now):
+        """ searches the trigger event in the signals since the last call """
+        decimation, delay, source = self._scope_parameters()
+        start = self._scope_checked_until
+        self._scope_checked_until = now
+        if source in (8, 9):  # asg0, asg1
+            trigger_time = self._asg_trigger_time[source - 8]
+            if trigger_time is not None and trigger_time >= \
+                    self._scope_arm_time:
+                self._scope_trigger(trigger_time)
+            return
+        # triggers are only accepted once the pretrigger buffer is filled
+        if delay < SCOPE_DATA_LENGTH:
+            start = max(start, self._scope_arm_time + decimation *
+                        (SCOPE_DATA_LENGTH - delay))
+        if source not in (2, 3, 4, 5) or now <= start:
+            return  # off, immediately (see _on_write), external and dsp
+        ch = 1 if source in (2, 3) else 2
+        # at most 2**16 samples per block
+        step = max(decimation, (now - start) // 2 ** 16 + 1)
+        t = np.arange(start, now, step, dtype=np.int64)
+        x = self._scope_input(ch, t)
+        threshold = from_signed(self._register(
+            SCOPE_BASE + 0x4 + 4 * ch), 14) / 2. ** 13
+        hysteresis = (self._register(SCOPE_BASE + 0x1C + 4 * ch)
+                      & 0x3FFF) / 2. ** 13
+        if source in (3, 5):  # negative edge
+            x, threshold = -x, -threshold
+        below = x < threshold - hysteresis
+        ready = np.maximum.accumulate(below) | self._scope_hysteresis_ok
+        events = np.flatnonzero(ready & (x >= threshold))
+        if len(events) > 0:
+            self._scope_trigger(int(t[events[0]]))
+        else:
+            self._scope_hysteresis_ok = bool(ready[-1]) if len(ready) \
+                else self._scope_hysteresis_ok
+
+    def _scope_input(self, ch, t):
+        # the scope inputs are selected with the input registers of the asgs
+        select = self._register(dsp_addr_base('asg%d' % (ch - 1))) & 0xF
+        return self.signal(select, t)
+
+    def _acquire(self, end_time, wp_last):
+        """ writes the buffers with the samples up to end_time """
+        decimation, delay, source = self._scope_parameters()
+        t = end_time - decimation * np.arange(SCOPE_DATA_LENGTH - 1, -1, -1,
+                                              dtype=np.int64)
+        index = (wp_last - np.arange(SCOPE_DATA_LENGTH - 1, -1, -1)) \
+            % SCOPE_DATA_LENGTH
+        self._write_samples(t, index)
+
+    def _acquire_rolling(self, now):
+        """
+        writes the samples that were acquired in rolling mode since the
+        previous call, such that register accesses only synthesize the new
+        samples
+        """
+        decimation, delay, source = self._scope_parameters()
+        last = (now - self._scope_arm_time) // decimation
+        if last > self._scope_written:
+            first = max(self._scope_written + 1, last - SCOPE_DATA_LENGTH + 1)
+            k = np.arange(first, last + 1, dtype=np.int64)
+            self._write_samples(self._scope_arm_time + decimation * k,
+                                k % SCOPE_DATA_LENGTH)
+            self._scope_written = last
+        self._scope_wp_current = last % SCOPE_DATA_LENGTH
+
+    def _write_samples(self, t, index):
+        """ writes the scope inputs at the times t to the buffers """
+        for ch in (1, 2):
+            offset = (SCOPE_BASE + 0x10000 * ch - MEMORY_BASE) // 4
+            self.memory[offset + index] = to_int14(self._scope_input(ch, t))
+
+    def _advance(self):
+        """ brings the scope state up to the current time """
+        if not self._scope_armed:
+            return
+        now = self.now()
+        decimation, delay, source = self._scope_parameters()
+        if self._scope_trigger_time is None:
+            self._find_trigger(now)
+        if self._scope_trigger_time is None:
+            if source == 0:  # rolling mode: the buffers are always filled
+                self._acquire_rolling(now)
+            return
+        if now >= self._scope_end_time:
+            wp_last = (self._scope_wp_trigger + delay) % SCOPE_DATA_LENGTH
+            self._acquire(self._scope_end_time, wp_last)
+            self._scope_wp_current = wp_last
+            self._scope_acquired = True
+            self._scope_armed = self._register(SCOPE_BASE) & 0x8 != 0
@@ -381,10 +381,18 @@ class NetworkAnalyzer(AcquisitionModule, SignalModule):
         # frequency
         # only one read operation per point
         y = self.iq._nadata_total / self._cached_na_averages
+        amp = self.iq.amplitude  # get amplitude for normalization
+        return self._normalize_point(index, y, amp)
+
+    async def _get_point_async(self, index):
+        """ same as _get_point without blocking the event loop """
+        y = await self.iq._nadata_total_async() / self._cached_na_averages
+        amp = await self.iq._get_async('amplitude')
+        return self._normalize_point(index, y, amp)
 
+    def _normalize_point(self, index, y, amp):
         tf = self._tf_values[index]
 
-        amp = self.iq.amplitude  # get amplitude for normalization
         if amp == 0:  # normalize immediately
             y *= self._rescale  # avoid division by zero
         else:
@@ -492,7 +500,7 @@ class NetworkAnalyzer(AcquisitionModule, SignalModule):
             await self._resume_event.wait()
         await self._start_point_acquisition(index)
         await self._data_ready_async(min_delay_ms)
-        return self._get_point(index)
+        return await self._get_point_async(index)
 
     async def _trace_async(self, min_delay_ms):
         if self.current_point==0:
@@ -407,7 +407,7 @@ class SpectrumAnalyzer(AcquisitionModule):
         """
         :return: complex iq time trace
         """
-        res = self.scope._get_trace()
+        res = self.scope._read_trace(channels=(1, 2))  # not kept
 
         if self.baseband:
             return res[0][:self.data_length] + 1j*res[1][:self.data_length]
@@ -694,9 +694,11 @@ class SpectrumAnalyzer(AcquisitionModule):
         the db_system. Also, returns the list [curve_ch1, curve_ch2]...
         """
         if not self.baseband:
-            return super(SpectrumAnalyzer, self)._save_curve(self.data_x,
+            curve = super(SpectrumAnalyzer, self)._save_curve(self.data_x,
                                                   self.data_avg,
                                                   **self.setup_attributes)
+            self._save_statistics(curve)
+            return curve
         else:
             d = self.setup_attributes
             curves = [None, None]
@@ -709,6 +711,7 @@ class SpectrumAnalyzer(AcquisitionModule):
                     curves[ch] = self._save_curve(self.data_x,
                                                   self.data_avg[ch],
                                                   **d)
+                    self._save_statistics(curves[ch], ch)
             if self.display_cross_amplitude:
                 d.update({'ch': 'cross',
                           'name': self.curve_name + ' cross'})
@@ -0,0 +1,15 @@
+from ..redpitaya import RedPitaya
+
+
+class SimulatorFixture(object):
+    """
+    base class for tests that run on the simulated Red Pitaya (see
+    pyrpl.simulator), available as self.r
+    """
+    @classmethod
+    def setUpAll(cls):
+        cls.r = RedPitaya(hostname='_FAKE_')
+
+    @classmethod
+    def setup_class(cls):
+        cls.setUpAll()
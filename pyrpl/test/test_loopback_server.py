@@ -0,0 +1,250 @@
+import logging
+logger = logging.getLogger(name=__name__)
+import numpy as np
+from ..pyrpl_utils import time
+from ..async_utils import ensure_future, wait
+from ..redpitaya_client import MonitorClient, AsyncMonitorClient, \
+    MonitorProtocolError, CAP_VECTOR
+from ..async_utils import LOOP, sleep
+from ..loopback_server import LoopbackServer
+from ..simulator import SimulatorClient
+
+
+class TestLoopbackServer(object):
+    def test_protocol(self):
+        with LoopbackServer() as server:
+            client = MonitorClient('127.0.0.1', server.port)
+            assert client.protocol_version == 2
+            assert client.capabilities & CAP_VECTOR
+            client.writes(0x40000100, [1, 2, 3])
+            assert list(client.reads(0x40000100, 3)) == [1, 2, 3]
+            with client.batch() as batch:
+                batch.writes(0x40000200, [4, 5])
+                batch.writes(0x40000300, [6])
+                first = batch.reads(0x40000200, 2)
+                second = batch.read(0x40000300)
+            assert list(first.result()) == [4, 5]
+            assert second.result()[0] == 6
+            client.close()
+
+    def test_protocol_v1(self):
+        with LoopbackServer(protocol_version=1) as server:
+            client = MonitorClient('127.0.0.1', server.port)
+            assert client.protocol_version == 1
+            client.writes(0x40000100, [7, 8])
+            assert list(client.reads(0x40000100, 2)) == [7, 8]
+            client.close()
+
+    def test_scope_push(self):
+        base, n = 0x40100000, 1000
+        samples = np.arange(2 * 16384, dtype=np.uint32)
+        with LoopbackServer() as server:
+            server.memory.writes(base + 0x10000, samples)
+            server.memory.writes(base + 0x10, [50])  # trigger delay
+            server.memory.writes(base + 0x1C, [100])  # write pointer
+            client = AsyncMonitorClient('127.0.0.1', server.port,
+                                        protocol_version=2)
+            data = wait(ensure_future(client.scope_trace_async(base, n,
+                                                               (2,))),
+                        timeout=5)
+            # the last n samples of channel 2 up to the end of the
+            # acquisition, wrapping around the end of the buffer
+            end = 100 + 50 + 1
+            assert (data[2:] == 16384 + (np.arange(end - n, end) % 16384)
+                    ).all()
+            client.close()
+
+    def test_chunked_transfers(self):
+        values = np.arange(3500, dtype=np.uint32)
+        with LoopbackServer(max_read_length=1000,
+                            max_write_length=1000) as server:
+            client = MonitorClient('127.0.0.1', server.port)
+            commands = server.commands
+            client.writes(0x40010000, values)
+            out = np.zeros(3500, dtype=np.uint32)
+            assert client.reads_into(0x40010000, out) is out
+            assert (out == values).all()
+            assert server.commands - commands == 8
+            async_client = AsyncMonitorClient(
+                '127.0.0.1', server.port, protocol_version=2,
+                max_read_length=1000, max_write_length=1000)
+
+            async def transfer():
+                await async_client.writes_async(0x40020000, values[::-1])
+                return await async_client.reads_async(0x40020000, 3500)
+            result = wait(ensure_future(transfer()), timeout=5)
+            assert (result == values[::-1]).all()
+            async_client.close()
+            client.close()
+        with LoopbackServer(protocol_version=1) as server:
+            client = MonitorClient('127.0.0.1', server.port)
+            values = np.arange(150000, dtype=np.uint32)
+            client.writes(0x40010000, values)
+            assert (client.reads(0x40010000, 150000) == values).all()
+            client.close()
+
+    def test_memory_model(self):
+        with LoopbackServer(memory=SimulatorClient()) as server:
+            client = MonitorClient('127.0.0.1', server.port)
+            assert client.reads(0x40340200, 1)[0] == 64  # IIRBITS
+            client.close()
+
+    def test_latency(self):
+        with LoopbackServer(latency=0.02) as server:
+            client = MonitorClient('127.0.0.1', server.port)
+            start = time()
+            for i in range(5):
+                client.reads(0x40000000, 1)
+            assert time() - start >= 5 * 0.02
+            # pipelined requests overlap their latencies
+            start = time()
+            with client.batch() as batch:
+                for i in range(5):
+                    batch.write(0x40000000 + 4 * i, i)
+            assert time() - start < 2 * 0.02
+            client.close()
+
+    def test_bandwidth(self):
+        with LoopbackServer(bandwidth=2e6) as server:
+            client = MonitorClient('127.0.0.1', server.port)
+            start = time()
+            client.reads(0x40000000, 100000)
+            assert time() - start >= 0.9 * 4e5 / 2e6
+            client.close()
+
+    def test_restart(self):
+        with LoopbackServer() as server:
+            client = MonitorClient('127.0.0.1', server.port,
+                                   restartserver=server.restart)
+            client.writes(0x40000100, [9])
+            server.drop_connections()
+            # the client reconnects and repeats the transfer
+            assert client.reads(0x40000100, 1)[0] == 9
+            assert server.connections == 2
+            client.close()
+
+    def test_dropped_connections(self):
+        with LoopbackServer(drop_probability=0.1, seed=1) as server:
+            client = MonitorClient('127.0.0.1', server.port,
+                                   restartserver=server.restart)
+            for i in range(30):
+                client.writes(0x40000000 + 4 * i, [i])
+            assert (client.reads(0x40000000, 30) == np.arange(30)).all()
+            assert server.dropped > 0
+            client.close()
+
+    def test_reconnect(self):
+        with LoopbackServer(latency=0.001) as server:
+            client = MonitorClient('127.0.0.1', server.port)
+            assert 0.001 <= client.ping() < 1
+            client.writes(0x40000100, [9])
+            server.drop_connections()
+            # the socket is replaced without restarting the server
+            assert client.reads(0x40000100, 1)[0] == 9
+            assert server.connections == 2
+            assert client._reconnects == 1
+            client.close()
+
+    def test_reconnect_backoff(self):
+        with LoopbackServer() as server:
+            restarts = []
+
+            def restartserver():
+                restarts.append(time())
+                server.start()
+                return server.port
+            client = MonitorClient('127.0.0.1', server.port,
+                                   restartserver=restartserver)
+            client.writes(0x40000100, [9])
+            server.stop()
+            start = time()
+            assert client.reads(0x40000100, 1)[0] == 9
+            # the server is only restarted after reconnect_attempts
+            # attempts with exponentially growing delays
+            assert len(restarts) == 1
+            assert restarts[0] - start >= 0.01 + 0.02 + 0.04 + 0.08
+            client.close()
+
+    def test_async_recovery(self):
+        with LoopbackServer() as server:
+            client = MonitorClient('127.0.0.1', server.port,
+                                   async_transport=True)
+            client.writes(0x40000100, [5])
+            async_client = client._get_async_client()
+            async_client.retry_interval = 0.05
+            # a timeout only disables the asynchronous transport for
+            # retry_interval
+            async_client._timeout(LOOP.create_future())
+            assert client._get_async_client() is None
+            assert wait(ensure_future(client.reads_async(0x40000100, 1)))[0] \
+                == 5
+            sleep(0.06)
+            assert client._get_async_client() is async_client
+            assert wait(ensure_future(
+                async_client.reads_async(0x40000100, 1)))[0] == 5
+            # invalid replies disable it for good
+            client._async_failed(MonitorProtocolError("test"))
+            assert client._get_async_client() is None
+            client.close()
+
+    def test_no_replay(self):
+        with LoopbackServer() as server:
+            client = MonitorClient('127.0.0.1', server.port)
+            client.register_volatile([0x40000104])
+            server.drop_connections()
+            # the write of a volatile register is not repeated
+            try:
+                client.writes(0x40000100, [1, 2])
+            except IOError:
+                pass
+            else:
+                assert False, "the dropped write was not reported"
+            assert client._reconnects == 1
+            assert list(client.reads(0x40000100, 2)) == [0, 0]
+            # other writes are replayed
+            server.drop_connections()
+            assert client.writes(0x40000108, [3])
+            assert client.reads(0x40000108, 1)[0] == 3
+            # nor after an invalid reply
+            calls = []
+
+            def invalid_reply(addr, values):
+                calls.append(addr)
+            client._writes = invalid_reply
+            assert client.writes(0x40000100, [1, 2]) is None
+            assert len(calls) == 1
+            del client._writes
+            client.close()
+
+
+class TestTransferStatistics(object):
+    def test_statistics(self):
+        with LoopbackServer(latency=0.005) as server:
+            client = MonitorClient('127.0.0.1', server.port,
+                                   restartserver=server.restart)
+            statistics = client.statistics
+            statistics.register_module('scope', 0x40100000)
+            statistics.register_module('asg0', 0x40200000)
+            client.reads(0x40100000, 10)
+            with statistics.profile() as profile:
+                client.writes(0x40200004, [1, 2])
+                with client.batch() as batch:
+                    batch.read(0x40110000)  # scope data
+                    batch.read(0x40200008)
+            assert statistics.count == 4
+            snapshot = statistics.snapshot(by='module')
+            assert snapshot['scope']['count'] == 2
+            assert snapshot['scope']['words'] == 11
+            assert snapshot['asg0']['writes'] == 1
+            assert snapshot['scope']['mean_time'] >= 0.005 / 2
+            assert sum(snapshot['scope']['histogram']) == 2
+            assert 0x40100000 in statistics.snapshot(by='addr')
+            # the profile only contains the transfers of the with-block
+            assert profile.count == 3
+            assert profile.snapshot(by='command')['w']['count'] == 1
+            assert 'asg0' in profile.report()
+            # retries survive the reconnection
+            server.drop_connections()
+            client.reads(0x40100000, 1)
+            assert statistics.records()['retries'][-1] == 1
+            client.close()
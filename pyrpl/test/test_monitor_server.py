@@ -0,0 +1,330 @@
+import logging
+logger = logging.getLogger(name=__name__)
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import SkipTest
+import numpy as np
+import asyncio
+from ..async_utils import ensure_future, wait, sleep_async
+from ..redpitaya_client import MonitorClient, AsyncMonitorClient, \
+    CAP_MULTICLIENT, CAP_VECTOR, CAP_SCOPE_PUSH
+
+
+def start_local_server():
+    """
+    compiles monitor_server.c for this machine and starts it in local test
+    mode. Returns (process, port, tempdir).
+    """
+    if not sys.platform.startswith('linux') or shutil.which('gcc') is None:
+        raise SkipTest("Local monitor_server requires gcc on Linux.")
+    source = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                          'monitor_server', 'monitor_server.c')
+    tempdir = tempfile.mkdtemp()
+    binary = os.path.join(tempdir, 'monitor_server_local')
+    subprocess.check_call(['gcc', '-O2', '-o', binary, source])
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    process = subprocess.Popen([binary, str(port), '-l'])
+    for i in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+        except socket.error:
+            time.sleep(0.05)
+        else:
+            break
+    return process, port, tempdir
+
+
+def start_v1_server():
+    """
+    starts a minimal single-client server of protocol version 1 in a
+    thread, like the monitor_server of old boards. Returns (socket, memory).
+    """
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    memory = dict()
+
+    def recv(connection, n):
+        data = b''
+        while len(data) < n:
+            chunk = connection.recv(n - len(data))
+            if not chunk:
+                raise socket.error("closed")
+            data += chunk
+        return data
+
+    def serve():
+        connection = server.accept()[0]
+        try:
+            while True:
+                header = recv(connection, 8)
+                length = header[2] + (header[3] << 8)
+                addr = int.from_bytes(header[4:], 'little')
+                if header[:1] == b'c':
+                    break
+                elif length == 0:
+                    continue
+                elif header[:1] == b'r':
+                    values = [memory.get(addr + 4 * i, 0)
+                              for i in range(length)]
+                    connection.sendall(header + np.array(
+                        values, dtype=np.uint32).tobytes())
+                elif header[:1] == b'w':
+                    data = np.frombuffer(recv(connection, 4 * length),
+                                         dtype=np.uint32)
+                    for i, v in enumerate(data):
+                        memory[addr + 4 * i] = int(v)
+                    connection.sendall(header)
+                else:
+                    break
+        except socket.error:
+            pass
+        connection.close()
+        server.close()
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    return server, memory
+
+
+class TestMonitorServer(object):
+    @classmethod
+    def setUpAll(cls):
+        cls.process, cls.port, cls.tempdir = start_local_server()
+
+    @classmethod
+    def tearDownAll(cls):
+        cls.process.kill()
+        cls.process.wait()
+        shutil.rmtree(cls.tempdir, ignore_errors=True)
+
+    setup_class = setUpAll
+    teardown_class = tearDownAll
+
+    def client(self):
+        return MonitorClient('127.0.0.1', self.port)
+
+    def test_concurrent_clients(self):
+        c1, c2 = self.client(), self.client()
+        c1.writes(0x40000100, [1, 2, 3])
+        assert list(c2.reads(0x40000100, 3)) == [1, 2, 3]
+        c2.writes(0x40000104, [7])
+        assert c1.reads(0x40000104, 1)[0] == 7
+        # closing one client must not affect the others
+        c1.close()
+        assert c2.reads(0x40000100, 1)[0] == 1
+        c2.close()
+
+    def test_pipelined_batch(self):
+        client = self.client()
+        with client.batch() as batch:
+            for i in range(100):
+                batch.write(0x40001000 + 4 * i, i)
+            result = batch.reads(0x40001000, 100)
+        assert (result.result() == np.arange(100)).all()
+        client.close()
+
+    def test_large_reads(self):
+        client = self.client()
+        values = np.arange(65533, dtype=np.uint32)
+        client.writes(0x40100000, values)
+        out = np.zeros(65535, dtype=np.uint32)
+        client.reads_into(0x40100000, out)
+        assert (out[:65533] == values).all()
+        # outside of the simulated memory, zeros are returned
+        assert client.reads(0x50000000, 4).sum() == 0
+        client.close()
+
+    def test_async_client(self):
+        sync = self.client()
+        client = AsyncMonitorClient('127.0.0.1', self.port)
+
+        async def transfer():
+            await client.writes_async(0x40002000, [11, 12])
+            return await client.reads_async(0x40002000, 2)
+        assert list(wait(ensure_future(transfer()), timeout=5)) == [11, 12]
+        assert list(sync.reads(0x40002000, 2)) == [11, 12]
+        client.close()
+        sync.close()
+
+    def test_negotiation(self):
+        client = self.client()
+        assert client.protocol_version == 2
+        assert client.capabilities & CAP_MULTICLIENT
+        assert client.capabilities & CAP_VECTOR
+        assert client.max_read_length > 65535
+        client.close()
+
+    def test_long_transfers(self):
+        client = self.client()
+        values = np.arange(150000, dtype=np.uint32)
+        with client.batch() as batch:
+            for start in range(0, len(values), 60000):
+                batch.writes(0x40200000 + 4 * start, values[start:start+60000])
+        assert (client.reads(0x40200000, len(values)) == values).all()
+        client.close()
+
+    def test_vector_batch(self):
+        client = self.client()
+        with client.batch() as batch:
+            batch.writes(0x40003000, [1, 2])
+            batch.writes(0x40003100, [3])
+            first = batch.reads(0x40003000, 2)
+            second = batch.read(0x40003100)
+            third = batch.reads(0x40003004, 1)
+            # consecutive reads and writes form one writev and one readv
+            assert len(client._group_requests(batch.requests)) == 2
+        assert list(first.result()) == [1, 2]
+        assert second.result()[0] == 3
+        assert third.result()[0] == 2
+        client.close()
+
+    def test_stale_replies(self):
+        client = self.client()
+        client.writes(0x40004000, [5, 6])
+        # the reply to a request that was never received is skipped
+        client._send_v2(b'R', 0x40004000, 1)
+        assert list(client.reads(0x40004000, 2)) == [5, 6]
+        client.close()
+
+    def test_async_client_v2(self):
+        sync = self.client()
+        client = AsyncMonitorClient('127.0.0.1', self.port,
+                                    protocol_version=2,
+                                    max_read_length=sync.max_read_length,
+                                    max_write_length=sync.max_write_length)
+        values = np.arange(70000, dtype=np.uint32)
+
+        async def transfer():
+            await client.writes_async(0x40300000, values[:60000])
+            await client.writes_async(0x40300000 + 4 * 60000, values[60000:])
+            return await asyncio.gather(client.reads_async(0x40300000, 70000),
+                                        client.reads_async(0x40300004, 1))
+        full, single = wait(ensure_future(transfer()), timeout=5)
+        assert (full == values).all()
+        assert single[0] == 1
+        client.close()
+        sync.close()
+
+    def test_scope_push(self):
+        sync = self.client()
+        assert sync.capabilities & CAP_SCOPE_PUSH
+        sync._async_transport = True
+        base, n = 0x40500000, 16384
+        samples = np.arange(2 * n, dtype=np.uint32)
+        sync.writes(base, [1])  # armed
+        sync.writes(base + 0x10, [50])  # trigger delay
+        sync.writes(base + 0x1C, [100])  # write pointer at trigger
+        sync.writes(base + 0x164, [12345, 1])  # trigger timestamp
+        with sync.batch() as batch:
+            for start in range(0, 2 * n, 8192):
+                batch.writes(base + 0x10000 + 4 * start,
+                             samples[start:start + 8192])
+
+        async def acquire():
+            trace = ensure_future(sync.scope_trace_async(base, n))
+            await sleep_async(0.05)
+            assert not trace.done()  # the scope is still armed
+            await sync.writes_async(base, [0])
+            return await asyncio.wait_for(trace, 1)
+        data = wait(ensure_future(acquire()), timeout=5)
+        assert list(data[:2]) == [12345, 1]
+        shift = 100 + 50 + 1
+        assert (data[2:2 + n] == np.roll(samples[:n], -shift)).all()
+        assert (data[2 + n:] == np.roll(samples[n:], -shift)).all()
+        sync.close()
+
+    def test_scope_push_channels(self):
+        sync = self.client()
+        client = AsyncMonitorClient('127.0.0.1', self.port,
+                                    protocol_version=2)
+        base, n = 0x40700000, 1000
+        samples = np.arange(2 * 16384, dtype=np.uint32)
+        sync.writes(base, [0])  # acquisition complete
+        sync.writes(base + 0x10, [50])  # trigger delay
+        sync.writes(base + 0x1C, [100])  # write pointer at trigger
+        with sync.batch() as batch:
+            for start in range(0, 2 * 16384, 8192):
+                batch.writes(base + 0x10000 + 4 * start,
+                             samples[start:start + 8192])
+        data = wait(ensure_future(client.scope_trace_async(base, n, (2,))),
+                    timeout=5)
+        # the last n samples up to the end of the acquisition, which wrap
+        # around the end of the buffer of channel 2
+        assert len(data) == 2 + n
+        end = 100 + 50 + 1
+        assert (data[2:] == 16384 + (np.arange(end - n, end) % 16384)).all()
+        client.close()
+        sync.close()
+
+    def test_scope_push_abandoned(self):
+        sync = self.client()
+        client = AsyncMonitorClient('127.0.0.1', self.port,
+                                    protocol_version=2)
+        base = 0x40780000
+        sync.writes(base, [1])  # armed
+
+        async def acquire():
+            try:
+                await asyncio.wait_for(client.scope_trace_async(base, 16),
+                                       0.05)
+            except asyncio.TimeoutError:
+                pass
+            # the cancelled request is forgotten, the connection still works
+            assert client._pending == dict()
+            return await client.reads_async(base, 1)
+        assert wait(ensure_future(acquire()), timeout=5)[0] == 1
+        client.close()
+        sync.close()
+
+    def test_scope_push_cancel(self):
+        sync = self.client()
+        client = AsyncMonitorClient('127.0.0.1', self.port,
+                                    protocol_version=2)
+        base = 0x40600000
+        sync.writes(base, [1])
+
+        async def acquire():
+            first = ensure_future(client.scope_trace_async(base, 16))
+            await sleep_async(0.01)
+            # a new request cancels the first one
+            second = ensure_future(client.scope_trace_async(base, 16))
+            try:
+                await first
+            except IOError:
+                cancelled = True
+            else:
+                cancelled = False
+            sync.writes(base, [0])
+            return cancelled, len(await second)
+        assert wait(ensure_future(acquire()), timeout=5) == (True, 2 + 2 * 16)
+        client.close()
+        sync.close()
+
+
+class TestProtocolV1Fallback(object):
+    def test_v1_server(self):
+        server, memory = start_v1_server()
+        client = MonitorClient('127.0.0.1', server.getsockname()[1],
+                               async_transport=True)
+        assert client.protocol_version == 1
+        assert client.max_read_length == 65535
+        client.writes(0x40000010, [3, 4])
+        assert memory[0x40000014] == 4
+        with client.batch() as batch:
+            batch.write(0x40000018, 5)
+            result = batch.reads(0x40000010, 3)
+        assert list(result.result()) == [3, 4, 5]
+        # a single-client server is not used for asynchronous transport
+        assert client._get_async_client() is None
+        client.close()
+
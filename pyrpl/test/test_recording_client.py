@@ -0,0 +1,113 @@
+import logging
+logger = logging.getLogger(name=__name__)
+import os
+import tempfile
+import numpy as np
+from ..async_utils import ensure_future, wait
+from ..redpitaya import RedPitaya
+from ..simulator import SimulatorClient
+from ..recording_client import RecordingClient, ReplayClient, \
+    ReplayError, load_recording
+
+
+class TestRecordingClient(object):
+    @classmethod
+    def setUpAll(cls):
+        cls.directory = tempfile.mkdtemp()
+
+    setup_class = setUpAll
+
+    def filename(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_record_replay(self):
+        filename = self.filename('session.rec')
+        client = RecordingClient(SimulatorClient(seed=0), filename)
+        client.writes(0x40400000, np.arange(5))
+        first = client.reads(0x40400000, 5)
+        with client.batch() as batch:
+            batch.write(0x40400010, 7)
+            second = batch.reads(0x40400000, 5)
+        out = client.reads_into(0x40100154, np.empty(2, dtype=np.uint32))
+        third = wait(ensure_future(client.reads_async(0x40400004, 2)))
+        client.close()
+        records = load_recording(filename)
+        assert [r[0] for r in records] == ['w', 'r', 'w', 'r', 'r', 'r']
+        assert list(records[0][5]) == list(range(5))
+
+        replay = ReplayClient(filename, strict=True)
+        replay.writes(0x40400000, np.arange(5))
+        assert (replay.reads(0x40400000, 5) == first).all()
+        with replay.batch() as batch:
+            batch.write(0x40400010, 7)
+            result = batch.reads(0x40400000, 5)
+        assert (result.result() == second.result()).all()
+        assert (replay.reads_into(0x40100154, np.empty(2, dtype=np.uint32))
+                == out).all()
+        assert (wait(ensure_future(replay.reads_async(0x40400004, 2)))
+                == third).all()
+        assert replay.remaining == 0
+        # deviations from the recorded session
+        replay.rewind()
+        try:
+            replay.reads(0x40400000, 5)
+        except ReplayError:
+            pass
+        else:
+            assert False, "ReplayError expected"
+        replay = ReplayClient(filename)
+        assert (replay.reads(0x40400000, 5) == first).all()
+        assert replay.mismatches == 1
+        # registers without a matching record return the last known values
+        assert (replay.reads(0x40400000, 5) == second.result()).all()
+        assert replay.reads(0x40500000, 1)[0] == 0
+        assert replay.mismatches == 3
+        # written values are compared with the recording
+        replay = ReplayClient(filename, strict=True)
+        try:
+            replay.writes(0x40400000, np.arange(1, 6))
+        except ReplayError:
+            pass
+        else:
+            assert False, "ReplayError expected"
+        replay = ReplayClient(filename)
+        replay.writes(0x40400000, np.arange(1, 6))
+        assert replay.mismatches == 1
+        assert (replay.reads(0x40400000, 5) == first).all()
+        assert replay.mismatches == 1
+
+    def test_scope_trace(self):
+        filename = self.filename('trace.rec')
+        simulator = SimulatorClient(seed=0)
+
+        async def scope_trace_async(addr, length, channels=(1, 2)):
+            return np.arange(2 + length * len(channels), dtype=np.uint32)
+        simulator.scope_trace_async = scope_trace_async
+        client = RecordingClient(simulator, filename)
+        trace = wait(ensure_future(client.scope_trace_async(0x40100000, 8,
+                                                            (2,))))
+        client.writes(0x40400000, [3])
+        client.close()
+        records = load_recording(filename)
+        assert [r[0] for r in records] == ['s', 'w']
+        assert (records[0][5] == trace).all()
+        replay = ReplayClient(filename, strict=True)
+        assert (wait(ensure_future(replay.scope_trace_async(
+            0x40100000, 8, (2,)))) == trace).all()
+        assert replay.remaining == 1
+
+    def test_replay_redpitaya(self):
+        filename = self.filename('na.rec')
+        r = RedPitaya(hostname='_FAKE_')
+        r.client = RecordingClient(r.client, filename)
+        r.makemodules()
+        kwargs = dict(start=1e5, stop=1e6, points=3, rbw=1e4, amplitude=0.5,
+                      input='in1', output_direct='out1')
+        x, y = r.iq0.na_trace(**kwargs)
+        r.client.close()
+        assert r.client.count > 0
+        r.client = ReplayClient(filename, strict=True)
+        r.makemodules()
+        x2, y2 = r.iq0.na_trace(**kwargs)
+        assert (x == x2).all() and (y == y2).all()
+        assert r.client.remaining == 0
@@ -0,0 +1,130 @@
+import logging
+logger = logging.getLogger(name=__name__)
+import os
+import shutil
+import tempfile
+import asyncio
+import numpy as np
+from ..async_utils import LOOP, ensure_future, wait
+from ..redpitaya_client import DummyClient, MonitorBatch, AsyncMonitorClient, \
+    TransferStatistics
+
+
+class TestMonitorBatch(object):
+    def test_batch_order(self):
+        client = DummyClient()
+        addr = 0x40300100
+        with client.batch() as batch:
+            batch.writes(addr, [1, 2, 3])
+            before = batch.reads(addr, 3)
+            batch.write(addr + 4, 7)
+            after = batch.reads(addr, 3)
+            assert not after.done()
+        assert (before.result() == [1, 2, 3]).all()
+        assert (after.result() == [1, 7, 3]).all()
+
+    def test_batch_send(self):
+        client = DummyClient()
+        batch = MonitorBatch(client)
+        assert batch.send() == []
+        batch.writes(0x40300200, [5])
+        batch.read(0x40300200)
+        assert len(batch) == 2
+        results = batch.send()
+        assert len(batch) == 0
+        assert results[0] is True
+        assert results[1][0] == 5
+
+    def test_no_send_on_exception(self):
+        client = DummyClient()
+        addr = 0x40300300
+        try:
+            with client.batch() as batch:
+                batch.write(addr, 3)
+                raise ValueError()
+        except ValueError:
+            pass
+        assert client.reads(addr, 1)[0] != 3
+
+
+class TestReadsInto(object):
+    def test_reads_into(self):
+        client = DummyClient()
+        client.writes(0x40300500, [4, 5, 6])
+        out = np.zeros(3, dtype=np.uint32)
+        assert client.reads_into(0x40300500, out) is out
+        assert list(out) == [4, 5, 6]
+
+
+class TestAsyncMonitorClient(object):
+    """ tests AsyncMonitorClient against a minimal monitor protocol server """
+    memory = dict()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(8)
+                length = header[2] + (header[3] << 8)
+                addr = int.from_bytes(header[4:], 'little')
+                if header[:1] == b'r':
+                    values = [self.memory.get(addr + 4 * i, 0)
+                              for i in range(length)]
+                    writer.write(header + np.array(values,
+                                                   dtype=np.uint32).tobytes())
+                elif header[:1] == b'w':
+                    data = await reader.readexactly(4 * length)
+                    for i, v in enumerate(np.frombuffer(data, np.uint32)):
+                        self.memory[addr + 4 * i] = int(v)
+                    writer.write(header)
+        except asyncio.IncompleteReadError:
+            writer.close()
+
+    def test_pipelined_transfers(self):
+        async def run():
+            server = await LOOP.create_server(
+                lambda: asyncio.StreamReaderProtocol(
+                    asyncio.StreamReader(loop=LOOP), self.handle, loop=LOOP),
+                '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            client = AsyncMonitorClient('127.0.0.1', port)
+            await client.writes_async(0x100, [1, 2, 3])
+            # concurrent requests are pipelined and answered in order
+            results = await asyncio.gather(client.reads_async(0x100, 3),
+                                           client.writes_async(0x104, [5]),
+                                           client.reads_async(0x104, 1))
+            client.close()
+            server.close()
+            return results
+        results = wait(ensure_future(run()), timeout=5)
+        assert list(results[0]) == [1, 2, 3]
+        assert results[1] is True
+        assert results[2][0] == 5
+
+    def test_dummy_client(self):
+        client = DummyClient()
+        wait(ensure_future(client.writes_async(0x40300400, [9])))
+        assert wait(ensure_future(client.reads_async(0x40300400, 1)))[0] == 9
+
+
+class TestTransferStatistics(object):
+    def test_ring_buffer(self):
+        statistics = TransferStatistics(size=4)
+        for i in range(6):
+            statistics.record('r', 0x40000000 + 4 * i, 1, 20, 1e-3)
+        records = statistics.records()
+        assert list(records['addr'] - 0x40000000) == [8, 12, 16, 20]
+        assert statistics.module_names(records['addr'])[0] == 'unknown'
+        statistics.register_module('hk', 0x40000000)
+        assert list(statistics.snapshot()) == ['hk']
+
+    def test_export(self):
+        statistics = TransferStatistics()
+        statistics.register_module('scope', 0x40100000)
+        statistics.record('w', 0x40100004, 2, 24, 2e-4, retries=1)
+        filename = os.path.join(tempfile.mkdtemp(), 'transfers.csv')
+        statistics.export(filename)
+        with open(filename) as f:
+            lines = f.read().splitlines()
+        assert lines[0].endswith('module')
+        assert lines[1].split(',')[-1] == 'scope'
+        shutil.rmtree(os.path.dirname(filename))
@@ -0,0 +1,72 @@
+import logging
+logger = logging.getLogger(name=__name__)
+import numpy as np
+from ..scope_alignment import AlignedAverager
+from .simulator_fixture import SimulatorFixture
+
+
+def pulse(n, center, width=3.):
+    return np.exp(-0.5 * ((np.arange(n) - center) / width) ** 2)
+
+
+class TestAlignedAverager(object):
+    def test_alignment(self):
+        n, offsets = 1024, [0, 1.3, -2.7, 0.45, 4.2, -0.8, 2.5]
+        noise = np.random.RandomState(0).normal(scale=0.01,
+                                                size=(len(offsets), n))
+        averager = AlignedAverager(n, max_shift=8, batch=4)
+        for i, offset in enumerate(offsets):
+            trace = np.full((2, n), np.nan)
+            trace[0] = pulse(n, 500 + offset) + noise[i]
+            averager.add(trace, 1. / (i + 1), channels=(1,))
+        assert averager.average is not None  # first batch
+        average = averager.flush()
+        # offsets with respect to the first trace
+        assert np.allclose(averager.shifts, offsets, atol=0.1)
+        assert np.isnan(average[1]).all()
+        # the aligned average keeps the shape of the pulse, whereas the
+        # plain average is smeared out by the offsets
+        assert np.abs(average[0] - pulse(n, 500)).max() < 0.05
+        plain = np.mean([pulse(n, 500 + o) for o in offsets], axis=0)
+        assert np.abs(plain - pulse(n, 500)).max() > 0.2
+
+    def test_channels_changed(self):
+        n = 256
+        averager = AlignedAverager(n, batch=2, history=3)
+        trace = pulse(n, 100)[np.newaxis].repeat(2, 0)
+        for channels in [(1, 2), (1, 2), (1,), (1, 2), (1, 2), (1, 2)]:
+            averager.add(trace, 0.5, channels)
+        average = averager.flush()
+        # the average restarted with the last channels
+        assert averager.channels == (1, 2)
+        assert np.allclose(average, trace)
+        assert len(averager.shifts) == 3
+
+    def test_max_shift(self):
+        n = 256
+        averager = AlignedAverager(n, max_shift=2, batch=1)
+        for offset in [0, 10]:
+            averager.add(pulse(n, 100 + offset)[np.newaxis].repeat(2, 0),
+                         0.5)
+        assert abs(averager.shifts[1]) <= 2
+
+
+class TestScopeAlignment(SimulatorFixture):
+    def test_single(self):
+        scope = self.r.scope
+        self.r.asg0.setup(waveform='sin', frequency=1e4, amplitude=0.2,
+                          trigger_source='immediately')
+        scope.setup(input1='asg0', input2='asg0', duration=0.001,
+                    trigger_source='ch1_positive_edge', threshold=0,
+                    rolling_mode=False, trace_average=3)
+        averager = scope.enable_aligned_averaging(batch=2)
+        try:
+            scope.single()
+            assert averager.channel == 1
+            assert len(averager.shifts) == 3
+            # single acquisitions are not processed in batches
+            assert averager.average is scope.data_avg
+            assert np.allclose(scope.data_avg[0], scope.data_avg[1])
+            assert np.abs(scope.data_avg).max() < 0.21
+        finally:
+            scope.disable_aligned_averaging()
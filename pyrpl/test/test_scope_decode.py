@@ -0,0 +1,19 @@
+import logging
+logger = logging.getLogger(name=__name__)
+import numpy as np
+from ..hardware_modules.scope import Scope
+
+
+class TestScopeDecoding(object):
+    def test_rawdata_conversion(self):
+        raw = np.array([0, 1, 2**13 - 1, 2**13, 2**14 - 1], dtype=np.uint32)
+        x = Scope._to_int14(raw)
+        assert list(x) == [0, 1, 2**13 - 1, -2**13, -1], x
+
+    def test_decode(self):
+        raw = np.random.randint(0, 2**14, 1000).astype(np.uint32)
+        expected = np.roll(np.where(raw >= 2**13, raw - 2.**14, raw),
+                           -300) / 2**13
+        out = np.zeros(1000)
+        assert Scope._decode(raw.copy(), 1300, out) is out
+        assert (out == expected).all()
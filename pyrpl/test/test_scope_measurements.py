@@ -0,0 +1,75 @@
+import logging
+logger = logging.getLogger(name=__name__)
+import numpy as np
+from ..scope_measurements import MeasurementEngine
+from .simulator_fixture import SimulatorFixture
+
+
+class TestMeasurementEngine(object):
+    def test_measurements(self):
+        times = np.arange(16000) * 1e-6  # 16 periods
+        f, amplitude = 1e3, 0.4
+        phi = 2 * np.pi * f * times
+        # trapezoidal pulses with 20 % rise time and 30 % duty cycle at 50%
+        ch1 = amplitude * np.clip(np.interp(phi % (2 * np.pi) / np.pi / 2,
+                                            [0, 0.2, 0.3, 0.5, 1],
+                                            [0, 1, 1, 0, 0]), 0, 1)
+        ch2 = np.sin(phi + 0.5)
+        engine = MeasurementEngine()
+        results = engine.measure(times, np.array([ch1, ch2]))
+        assert abs(results['ch1_frequency'] - f) < 1e-6 * f
+        assert abs(results['ch1_rise_time'] - 0.8 * 0.2 / f) < 1e-8
+        assert abs(results['ch1_fall_time'] - 0.8 * 0.2 / f) < 1e-8
+        assert abs(results['ch1_duty_cycle'] - 0.3) < 1e-3
+        assert abs(results['ch1_amplitude'] - amplitude) < 1e-9
+        assert abs(results['ch1_peak_to_peak'] - amplitude) < 1e-9
+        assert abs(results['ch2_rms'] - np.sqrt(0.5)) < 1e-2
+        assert abs(results['ch2_frequency'] - f) < 1e-6 * f
+        # the rising edges (50 %) of ch1 are at 0.1 periods, those of ch2
+        # at -0.5 rad
+        assert abs(results['phase'] - (0.1 * 360 + 0.5 * 180 / np.pi)) < 0.01
+
+    def test_statistics(self):
+        times = np.arange(1000) * 1e-3
+        engine = MeasurementEngine(['rms', 'frequency'], channels=(1,))
+        assert engine.keys == ['ch1_rms', 'ch1_frequency']
+        traces = np.random.RandomState(0).normal(size=(10, 2, 1000))
+        for trace in traces:
+            engine.measure(times, trace)
+        summary = engine.summary()
+        rms = np.sqrt((traces[:, 0] ** 2).mean(axis=1))
+        assert abs(summary['ch1_rms']['mean'] - rms.mean()) < 1e-12
+        assert abs(summary['ch1_rms']['std'] - rms.std()) < 1e-12
+        assert summary['ch1_rms']['max'] == rms.max()
+        assert summary['ch1_rms']['value'] == rms[-1]
+        # a channel that was not acquired is not measured
+        engine.reset()
+        engine.measure(times, np.full((2, 1000), np.nan))
+        assert engine.summary()['ch1_rms']['count'] == 0
+
+
+class TestScopeMeasurements(SimulatorFixture):
+    def test_scope(self):
+        scope = self.r.scope
+        self.r.asg0.setup(waveform='sin', frequency=1e3, amplitude=0.2,
+                          trigger_source='immediately')
+        scope.setup(input1='asg0', input2='asg0', duration=0.01,
+                    trigger_source='immediately', rolling_mode=False,
+                    ch1_active=True, ch2_active=True, xy_mode=False,
+                    trace_average=3)
+        engine = scope.enable_measurements(['frequency', 'phase', 'rms'])
+        try:
+            scope.single()
+            summary = scope._display_curve()[2]
+            assert summary['ch1_frequency']['count'] == 3
+            assert abs(summary['ch1_frequency']['mean'] - 1e3) < 1
+            assert abs(summary['phase']['mean']) < 1
+            assert abs(summary['ch2_rms']['value'] - 0.2 / np.sqrt(2)) < 0.01
+            curves = scope.save_curve()
+            try:
+                assert curves[0].params['measurements'] == summary
+            finally:
+                for curve in curves:
+                    curve.delete()
+        finally:
+            scope.disable_measurements()
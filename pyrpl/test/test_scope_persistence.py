@@ -0,0 +1,61 @@
+import logging
+logger = logging.getLogger(name=__name__)
+import numpy as np
+from ..scope_persistence import PersistenceAccumulator
+from .simulator_fixture import SimulatorFixture
+
+
+class TestPersistenceAccumulator(object):
+    def test_histogram(self):
+        x = (np.arange(1000) + 0.5) / 1000  # no points on the bin edges
+        y = np.random.RandomState(0).normal(scale=0.5, size=(2, 1000))
+        y[1, :10] = np.nan
+        persistence = PersistenceAccumulator((50, 20), (0, 1), (-1, 1))
+        persistence.accumulate(x, y)
+        persistence.accumulate(x, y[0])
+        expected = sum(np.histogram2d(xx, yy, bins=(50, 20),
+                                      range=((0, 1), (-1, 1)))[0]
+                       for xx, yy in [(x, y[0]), (x[10:], y[1, 10:]),
+                                      (x, y[0])])
+        assert (persistence.image == expected).all()
+        assert persistence.traces == 2
+        persistence.set_ranges((0, 1), (-2, 2))
+        assert persistence.image.sum() == 0
+
+    def test_decay(self):
+        persistence = PersistenceAccumulator((4, 4), (0, 4), (0, 4),
+                                             decay=4)
+        persistence.accumulate([0.5], [0.5])
+        assert persistence.image[0, 0] == 1
+        for i in range(100):
+            persistence.accumulate([2.5], [2.5])
+        # the first point has faded out, the steady state of the second
+        # one is about decay points
+        assert persistence.image[0, 0] == 0
+        assert 3 < persistence.image[2, 2] < 5
+
+
+class TestScopePersistence(SimulatorFixture):
+    def test_xy_mode(self):
+        scope = self.r.scope
+        self.r.asg0.setup(waveform='sin', frequency=1e3, amplitude=0.2,
+                          trigger_source='immediately')
+        self.r.asg1.setup(waveform='cos', frequency=1e3, amplitude=0.2,
+                          trigger_source='immediately')
+        scope.setup(input1='asg0', input2='asg1', duration=0.01,
+                    trigger_source='immediately', rolling_mode=False,
+                    xy_mode=True, trace_average=1)
+        persistence = scope.enable_persistence(bins=(100, 100))
+        try:
+            scope.single()
+            assert persistence.traces == 1
+            assert persistence.image.sum() == scope.data_length
+            expected = np.histogram2d(scope.data_avg[0], scope.data_avg[1],
+                                      bins=(100, 100),
+                                      range=((-1, 1), (-1, 1)))[0]
+            assert (persistence.image == expected).all()
+            scope.single()
+            assert persistence.traces == 2
+        finally:
+            scope.disable_persistence()
+            scope.xy_mode = False
@@ -0,0 +1,64 @@
+import logging
+logger = logging.getLogger(name=__name__)
+from .simulator_fixture import SimulatorFixture
+
+
+class TestShadowRegisters(SimulatorFixture):
+    @classmethod
+    def setUpAll(cls):
+        super(TestShadowRegisters, cls).setUpAll()
+        cls.reads = []
+        client_reads = cls.r.client.reads
+
+        def reads(addr, length):
+            cls.reads.append((addr, length))
+            return client_reads(addr, length)
+        cls.r.client.reads = reads
+
+    def teardown_method(self, method=None):
+        for module in self.r.modules.values():
+            module.shadow_registers = False
+        self.r.asg0.clear_shadow_registers()
+
+    def count_reads(self, fn):
+        n = len(self.reads)
+        fn()
+        return len(self.reads) - n
+
+    def test_cached_reads(self):
+        asg = self.r.asg0
+        asg.shadow_registers = True
+        asg.cycles_per_burst = 7
+        # write-through: no read required
+        assert self.count_reads(lambda: asg.cycles_per_burst) == 0
+        assert asg.cycles_per_burst == 7
+        # sm_reset is volatile and shares its address with 'on'
+        assert self.count_reads(lambda: asg.on) == 1
+        asg.setup_attributes
+        assert self.count_reads(lambda: asg.setup_attributes) == 1
+        asg.clear_shadow_registers()
+        assert self.count_reads(lambda: asg.cycles_per_burst) == 1
+
+    def test_disabled(self):
+        asg = self.r.asg1
+        asg.cycles_per_burst = 5
+        assert self.count_reads(lambda: asg.cycles_per_burst) == 1
+
+    def test_shared_shadow(self):
+        asg0, asg1 = self.r.asg0, self.r.asg1
+        assert asg0._shadow is asg1._shadow
+        asg0.shadow_registers = True
+        asg0.bursts = 3
+        # a module without shadow keeps the shared copy up to date
+        addr = 0x1C + asg0._VALUE_OFFSET
+        asg1._writes(asg0.addr_base - asg1.addr_base + addr, [4])
+        assert self.count_reads(lambda: asg0.bursts) == 0
+        assert asg0.bursts == 4
+
+    def test_volatile(self):
+        scope = self.r.scope
+        scope.shadow_registers = True
+        scope.threshold = 0.1
+        assert self.count_reads(lambda: scope.threshold) == 0
+        assert self.count_reads(lambda: scope.current_timestamp) == 1
+        assert self.count_reads(lambda: scope.voltage_in1) == 1
@@ -0,0 +1,344 @@
+import logging
+logger = logging.getLogger(name=__name__)
+import os
+import tempfile
+import numpy as np
+from ..async_utils import TimeoutError, sleep_async
+from ..pyrpl_utils import time
+from ..simulator import SimulatorClient, SCOPE_BASE
+from ..scope_stream import load_stream
+from .simulator_fixture import SimulatorFixture
+
+
+class TestSimulatorClient(object):
+    def test_memory(self):
+        client = SimulatorClient()
+        client.writes(0x40400000, np.arange(1000))
+        assert (client.reads(0x40400000, 1000) == np.arange(1000)).all()
+        # read-only registers keep their value
+        client.writes(0x40340200, [5])  # IIRBITS
+        assert client.reads(0x40340200, 1)[0] == 64
+        # outside of the fpga memory, zeros are returned
+        assert client.reads(0x50000000, 2).sum() == 0
+
+    def test_timestamp(self):
+        client = SimulatorClient()
+        t0 = client.reads(SCOPE_BASE + 0x15C, 1)[0]
+        t1 = client.reads(SCOPE_BASE + 0x15C, 1)[0]
+        assert t1 > t0
+
+
+class TestSimulatedRedPitaya(SimulatorFixture):
+    def test_asg_scope(self):
+        asg, scope = self.r.asg0, self.r.scope
+        asg.setup(waveform='sin', frequency=1e5, amplitude=0.2, offset=0,
+                  trigger_source='immediately', output_direct='out1')
+        scope.input1 = 'asg0'
+        scope.input2 = 'in1'  # out1 through the analog loopback
+        scope.duration = 1e-3
+        scope.trigger_source = 'immediately'
+        scope.rolling_mode = False
+        ch1, ch2 = scope.single()
+        assert abs(ch1.max() - 0.2) < 0.01
+        assert abs(ch2.std() - 0.2 / np.sqrt(2)) < 0.01
+        frequencies = np.fft.rfftfreq(len(ch1), scope.sampling_time)
+        peak = frequencies[np.argmax(abs(np.fft.rfft(ch1)))]
+        assert abs(peak - 1e5) < 2e3
+        # edge trigger
+        scope.trigger_source = 'ch1_positive_edge'
+        scope.threshold = 0.1
+        scope.trigger_delay = 0
+        ch1, ch2 = scope.single()
+        i = np.argmin(abs(scope.times))
+        assert ch1[i - 1] <= 0.1 + 0.01 and ch1[i + 1] >= 0.1 - 0.01
+        assert ch1[i + 1] > ch1[i - 1]
+        asg.output_direct = 'off'
+
+    def test_inactive_channel(self):
+        scope = self.r.scope
+        scope.setup(input1='in1', input2='in2', duration=1e-3,
+                    trigger_source='immediately', rolling_mode=False,
+                    trace_average=2, ch1_active=True, ch2_active=False)
+        reads = []
+        client_reads_async = self.r.client.reads_async
+
+        async def reads_async(addr, length):
+            reads.append(addr)
+            return await client_reads_async(addr, length)
+        self.r.client.reads_async = reads_async
+        try:
+            ch1, ch2 = scope.single()
+        finally:
+            del self.r.client.reads_async
+            scope.ch2_active = True
+        # only the data of channel 1 is transferred and averaged
+        assert SCOPE_BASE + 0x20000 not in reads
+        assert reads.count(SCOPE_BASE + 0x10000) == 2
+        assert np.isnan(ch2).all() and not np.isnan(ch1).any()
+
+    def test_trace_buffer(self):
+        scope = self.r.scope
+        scope.setup(input1='in1', input2='in2', duration=1e-3,
+                    trigger_source='immediately', rolling_mode=False)
+        first = scope._get_trace()
+        # _get_trace returns a copy, _read_trace the shared buffer
+        assert not np.shares_memory(first, scope._get_trace())
+        assert scope._read_trace() is scope._read_trace()
+        assert not np.shares_memory(first, scope._read_trace())
+
+    def test_channel_enabled_during_averaging(self):
+        scope = self.r.scope
+        scope.setup(input1='in1', input2='in2', duration=1e-3,
+                    trigger_source='immediately', rolling_mode=False,
+                    trace_average=2, ch1_active=True, ch2_active=False)
+        scope._prepare_averaging()
+        try:
+            for scope.current_avg in [1, 2]:
+                scope.data_avg = scope._average(scope._get_trace())
+                scope.ch2_active = True
+        finally:
+            scope.ch2_active = True
+        assert not np.isnan(scope.data_avg).any()
+
+    def test_rolling_mode(self):
+        scope, client = self.r.scope, self.r.client
+        self.r.asg0.setup(waveform='sin', frequency=10, amplitude=0.2,
+                          trigger_source='immediately', output_direct='out1')
+        scope.setup(input1='asg0', input2='in1', duration=0.5,
+                    trigger_source='immediately', rolling_mode=True,
+                    ch1_active=True, ch2_active=True)
+        scope._start_acquisition_rolling_mode()
+        now = client.now()
+        reads = []
+        client_reads_into = client.reads_into
+
+        def reads_into(addr, out):
+            reads.append(len(out))
+            return client_reads_into(addr, out)
+        client.reads_into = reads_into
+        client.now = lambda: now  # freeze the simulated clock
+        client.noise = 0
+        try:
+            times, first = scope._get_rolling_curve()
+            assert reads == [scope.data_length] * 2
+            now += 1000 * int(scope.decimation)
+            del reads[:]
+            times, second = scope._get_rolling_curve()
+            # only the new samples are transferred
+            assert sum(reads) == 2 * 1000
+            # the mirrored buffers equal the fpga buffers
+            assert (second[0] == scope._data_ch1_current).all()
+            assert (second[1] == scope._data_ch2_current).all()
+            assert (second[:, :-1000] == first[:, 1000:]).all()
+            assert abs(second[0].max() - 0.2) < 0.01
+            # nothing is transferred without new samples
+            del reads[:]
+            scope._get_rolling_curve()
+            assert reads == []
+            # a channel that was not mirrored is transferred completely
+            scope.ch2_active = False
+            scope._get_rolling_curve()
+            scope.ch2_active = True
+            del reads[:]
+            times, third = scope._get_rolling_curve()
+            assert reads == [scope.data_length] * 2
+            assert (third == second).all()
+        finally:
+            del client.reads_into
+            del client.now
+            scope.ch2_active = True
+            client.noise = 1e-3
+            scope.rolling_mode = False
+            self.r.asg0.output_direct = 'off'
+
+    def test_segmented(self):
+        scope = self.r.scope
+        self.r.asg0.setup(waveform='sin', frequency=1e3, amplitude=0.2,
+                          trigger_source='immediately')
+        scope.setup(input1='asg0', input2='in1',
+                    trigger_source='ch1_positive_edge', threshold=0,
+                    hysteresis=0.01, trigger_delay=0, rolling_mode=False,
+                    ch1_active=True, ch2_active=False)
+        scope.decimation = 64
+        data, timestamps = scope.segmented(5, 1000, timeout=2)
+        assert data.shape == (5, 2, 1000)
+        assert np.isnan(data[:, 1]).all()
+        # each segment is centered at a positive edge of the sine
+        assert (abs(data[:, 0, 499]) < 0.005).all()
+        assert (data[:, 0, 510] > data[:, 0, 490]).all()
+        # the triggers are separated by whole periods of the sine
+        periods = np.diff(timestamps) / 125e3
+        assert (periods >= 1).all()
+        assert (abs(periods - np.round(periods)) < 0.01).all()
+
+    def test_segmented_timeout(self):
+        scope = self.r.scope
+        scope.setup(input1='in1', input2='in2',
+                    trigger_source='ch1_positive_edge', threshold=0.5,
+                    rolling_mode=False, ch1_active=True, ch2_active=True)
+        scope.decimation = 1
+        scope._adc_we_keep = True
+        try:
+            start = time()
+            try:
+                scope.segmented(2, 100, timeout=0.2)
+            except TimeoutError:
+                pass
+            else:
+                assert False, "segmented() did not time out"
+            assert time() - start < 1
+            # the arm writes keep the other bits of the control word
+            assert scope._adc_we_keep
+        finally:
+            scope._adc_we_keep = False
+
+    def test_trigger_timeout(self):
+        scope = self.r.scope
+        scope.setup(input1='in1', input2='in2', duration=0.001,
+                    trigger_source='ch1_positive_edge', threshold=0.5,
+                    rolling_mode=False, trace_average=1)
+        scope.trigger_timeout = 0.2
+        try:
+            start = time()
+            try:
+                scope.single()
+            except TimeoutError:
+                pass
+            else:
+                assert False, "single() did not time out"
+            assert time() - start < 1
+        finally:
+            del scope.trigger_timeout
+            scope.stop()
+
+    def test_pushed_trace_timeout(self):
+        scope, client = self.r.scope, self.r.client
+        scope.setup(input1='in1', input2='in2', duration=0.001,
+                    trigger_source='immediately', rolling_mode=False,
+                    trace_average=1)
+        requests = []
+
+        async def scope_trace_async(addr, length, channels=(1, 2)):
+            requests.append(channels)
+            await sleep_async(10)  # the trace is never pushed
+        client.scope_trace_async = scope_trace_async
+        scope.trigger_timeout = 0.2
+        try:
+            start = time()
+            try:
+                scope.single()
+            except TimeoutError:
+                pass
+            else:
+                assert False, "single() did not time out"
+            assert time() - start < 1
+            assert requests == [scope._acquired_channels()]
+        finally:
+            del client.scope_trace_async
+            del scope.trigger_timeout
+            scope.stop()
+
+    def test_display_decimation(self):
+        scope = self.r.scope
+        scope.setup(input1='in1', input2='in2', duration=0.01,
+                    trigger_source='immediately', rolling_mode=False,
+                    ch1_active=True, ch2_active=True, xy_mode=False,
+                    ch_math_active=False, trace_average=1)
+        scope.single()
+        scope.display_points = 1000
+        try:
+            times, data = scope._display_curve()
+        finally:
+            scope.display_points = None
+        assert len(times) == 1000 and data.shape == (2, 1000)
+        assert scope.data_avg.shape == (2, scope.data_length)
+        # each bin is represented by its minimum and maximum
+        starts = np.arange(500) * scope.data_length // 500
+        bins = np.split(scope.data_avg, starts[1:], axis=1)
+        assert (data[:, 0::2].T == [b.min(axis=1) for b in bins]).all()
+        assert (data[:, 1::2].T == [b.max(axis=1) for b in bins]).all()
+        assert (times[0::2] == scope.data_x[starts]).all()
+
+    def test_trigger_waiter(self):
+        scope, client = self.r.scope, self.r.client
+        self.r.asg0.setup(waveform='sin', frequency=20, amplitude=0.2,
+                          trigger_source='immediately')
+        scope.setup(input1='asg0', input2='in1',
+                    trigger_source='ch1_positive_edge', threshold=0,
+                    hysteresis=0.01, trigger_delay=0, rolling_mode=False,
+                    ch1_active=True, ch2_active=False, trace_average=1)
+        scope.decimation = 64
+        reads = []
+        client_reads_async = client.reads_async
+
+        async def reads_async(addr, length):
+            reads.append(addr)
+            return await client_reads_async(addr, length)
+        client.reads_async = reads_async
+        try:
+            for trigger_delay in [0, 0.02]:
+                scope.trigger_delay = trigger_delay
+                del reads[:]
+                ch1 = scope.single()[0]
+                # the trigger arrives within 50 ms, the status is polled
+                # at growing intervals meanwhile
+                assert reads.count(SCOPE_BASE) < 12
+                index = np.argmin(abs(scope.times - trigger_delay))
+                assert abs(ch1[index] - 0.2 * np.sin(
+                    2 * np.pi * 20 * trigger_delay)) < 0.01
+        finally:
+            del client.reads_async
+            scope.trigger_delay = 0
+
+    def test_na_loopback(self):
+        x, y = self.r.iq0.na_trace(start=1e5, stop=1e6, points=2, rbw=1e4,
+                                   amplitude=0.5, input='in1',
+                                   output_direct='out1')
+        assert (abs(abs(y) - 1) < 0.05).all()
+
+
+class TestScopeStream(SimulatorFixture):
+    @classmethod
+    def setUpAll(cls):
+        super(TestScopeStream, cls).setUpAll()
+        cls.directory = tempfile.mkdtemp()
+
+    def test_stream(self):
+        scope, client = self.r.scope, self.r.client
+        self.r.asg0.setup(waveform='sin', frequency=100, amplitude=0.2,
+                          trigger_source='immediately', output_direct='off')
+        scope.setup(input1='asg0', input2='in1', duration=0.134,
+                    ch1_active=True, ch2_active=False)
+        n, decimation = scope.data_length, int(scope.decimation)
+        now = [client.now()]
+        client.now = lambda: now[0]  # the simulated clock is advanced below
+        filename = os.path.join(self.directory, 'stream.npy')
+        samples = 1000 + (n - 10) + 2 * n + 500 + 300
+        stream = scope.stream(filename,
+                              duration=samples * scope.sampling_time)
+        try:
+            stream.start()
+            blocks = []
+            for step in [1000, n - 10, 2 * n + 500, 5000]:
+                now[0] += step * decimation
+                blocks.append(stream.poll())
+                if step < n:
+                    # the stream continues with the new samples in the buffer
+                    data = blocks[-1].data[:, 0]
+                    assert (data == scope._data_ch1_current[-step:]
+                            [:len(data)]).all()
+                # the file can be read during the recording
+                assert len(load_stream(filename)) <= stream.position
+            # the buffer was overwritten twice before the third poll
+            assert [len(b.data) for b in blocks] == [1000, n - 10, 500, 300]
+            assert [b.lost for b in blocks] == [0, 0, 2 * n, 0]
+            assert stream.overruns == [(1000 + n - 10, 2 * n)]
+            assert not stream.running  # the duration is reached
+        finally:
+            stream.stop()
+            del client.now
+        data = load_stream(filename)
+        assert data.shape == (1000 + n - 10 + 500 + 300, 1)
+        assert (data[:1000, 0] == blocks[0].data[:, 0]).all()
+        # consecutive blocks join without gaps
+        assert abs(np.diff(data[:1000 + n - 10, 0])).max() < 0.002
@@ -0,0 +1,77 @@
+import logging
+logger = logging.getLogger(name=__name__)
+import numpy as np
+from ..acquisition_module import TraceStatistics
+from .simulator_fixture import SimulatorFixture
+
+
+class TestTraceStatistics(object):
+    def test_equal_weights(self):
+        traces = np.random.RandomState(0).normal(size=(20, 2, 100))
+        statistics = TraceStatistics()
+        for n, trace in enumerate(traces):
+            statistics.update(trace, 1. / (n + 1))
+        assert statistics.count == 20
+        assert np.allclose(statistics.std, traces.std(axis=0))
+        assert (statistics.min == traces.min(axis=0)).all()
+        assert (statistics.max == traces.max(axis=0)).all()
+        assert (statistics.peak == abs(traces).max(axis=0)).all()
+        # the arrays are reused after a reset
+        std = statistics._var
+        statistics.reset()
+        statistics.update(traces[0], 1.)
+        assert statistics._var is std and (statistics.std == 0).all()
+        assert (statistics.max == traces[0]).all()
+
+    def test_moving_window(self):
+        traces = np.random.RandomState(1).normal(size=(2000, 10))
+        statistics = TraceStatistics()
+        for n, trace in enumerate(traces):
+            statistics.update(trace, 1. / min(n + 1, 100))
+        # exponential window of about 100 traces
+        assert np.allclose(statistics.std, 1, atol=0.3)
+        assert (statistics.max == traces.max(axis=0)).all()
+
+    def test_ema(self):
+        traces = np.random.RandomState(2).normal(size=(3000, 10))
+        traces[1000:] += 5  # a step after 1000 traces
+        statistics = TraceStatistics(ema_traces=50)
+        assert 'ema_peak' in statistics.names
+        for n, trace in enumerate(traces):
+            statistics.update(trace, 1. / (n + 1))  # equal weights
+        # the moving averages follow the step, the mean does not
+        assert np.allclose(statistics.ema, 5, atol=0.5)
+        assert np.allclose(statistics._mean, 10 / 3., atol=0.1)
+        # the decaying envelopes only cover the last traces
+        assert (statistics.ema_max < statistics.max).all()
+        assert (statistics.ema_min > 2).all()
+        assert (statistics.ema_min <= traces[-1]).all()
+        assert (statistics.ema_peak >= abs(traces[-1])).all()
+        assert np.allclose(statistics.ema_min, 5 - 1.5, atol=1)
+
+
+class TestAcquisitionStatistics(SimulatorFixture):
+    def test_scope(self):
+        scope = self.r.scope
+        scope.setup(input1='in1', input2='in2', duration=0.01,
+                    trigger_source='immediately', rolling_mode=False,
+                    ch1_active=True, ch2_active=False, trace_average=5)
+        scope.ema_traces = 3
+        scope.single()
+        assert scope.statistics.count == 5
+        assert scope.data_std.shape == scope.data_avg.shape
+        # the simulated inputs are noise of 1 mV
+        assert 0.5e-3 < np.mean(scope.data_std[0]) < 2e-3
+        assert np.isnan(scope.data_std[1]).all()
+        assert (scope.data_min[0] <= scope.data_avg[0]).all()
+        assert (scope.data_avg[0] <= scope.data_max[0]).all()
+        curve = scope.save_curve()[0]
+        try:
+            assert curve.params['averages'] == 5
+            assert np.allclose(curve.get_child('std').data[1],
+                               scope.data_std[0])
+            assert np.allclose(curve.get_child('ema').data[1],
+                               scope.data_ema[0])
+        finally:
+            curve.delete()
+            scope.ema_traces = None
@@ -0,0 +1,127 @@
+import logging
+logger = logging.getLogger(name=__name__)
+from .simulator_fixture import SimulatorFixture
+
+
+class TestWriteCoalescing(SimulatorFixture):
+    @classmethod
+    def setUpAll(cls):
+        super(TestWriteCoalescing, cls).setUpAll()
+        cls.transfers = []
+        cls.in_batch = False
+        client = cls.r.client
+        client_writes, client_transfers = client.writes, client.transfers
+
+        def writes(addr, values):
+            if not cls.in_batch:
+                cls.transfers.append([('w', addr, len(values))])
+            return client_writes(addr, values)
+
+        def transfers(requests):
+            cls.transfers.append([(r.command, r.addr, r.length)
+                                  for r in requests])
+            cls.in_batch = True  # the simulator executes batches one by one
+            try:
+                return client_transfers(requests)
+            finally:
+                cls.in_batch = False
+        client.writes = writes
+        client.transfers = transfers
+
+    def test_contiguous_writes(self):
+        iq = self.r.iq1
+        del self.transfers[:]
+        with iq.do_setup:
+            iq._writes(0x110, [1, 2])
+            iq._writes(0x118, [3])
+            iq._write(0x11C, 4)
+            iq._write(0x130, 5)
+            # buffered registers are read back without transfer
+            assert iq._read(0x114) == 2
+            assert self.transfers == []
+        # one batch with one burst per contiguous range
+        assert self.transfers == [[('w', iq.addr_base + 0x110, 4),
+                                   ('w', iq.addr_base + 0x130, 1)]]
+        assert list(self.r.client.reads(iq.addr_base + 0x110, 4)) \
+            == [1, 2, 3, 4]
+
+    def test_order(self):
+        iq = self.r.iq1
+        del self.transfers[:]
+        with iq.do_setup:
+            with iq.do_setup:  # nested blocks flush at the outer end
+                iq._write(0x130, 1)
+            iq._write(0x130, 0)
+            assert self.transfers == []
+        # the same register is written twice in the original order
+        assert self.transfers == [[('w', iq.addr_base + 0x130, 1),
+                                   ('w', iq.addr_base + 0x130, 1)]]
+        assert iq._read(0x130) == 0
+
+    def test_setup(self):
+        iq = self.r.iq2
+        iq.setup(frequency=1e6, bandwidth=[1e4], gain=0.5, phase=10,
+                 acbandwidth=1e5, amplitude=0.1, input='in1',
+                 output_direct='off', output_signal='quadrature',
+                 quadrature_factor=2)
+        del self.transfers[:]
+        iq.setup(frequency=2e6, gain=0.2, amplitude=0.05)
+        writes = [t for t in self.transfers if t[0][0] == 'w']
+        # the writes before the synchronization of the iqs are flushed in
+        # one batch, the pulse on the volatile _sync register is written
+        # directly
+        assert len(writes) == 3
+        assert [len(t) for t in writes[1:]] == [1, 1]
+        assert abs(iq.frequency - 2e6) < 1
+        assert abs(iq.amplitude - 0.05) < 1e-3
+
+    def test_volatile(self):
+        asg = self.r.asg1
+        del self.transfers[:]
+        with asg.do_setup:
+            asg.cycles_per_burst = 3
+            asg._write(0x0, 1 << 22)  # sm_reset of asg1
+            # the write to the volatile control register is not buffered,
+            # and follows the pending writes
+            burst = type(asg).cycles_per_burst.address
+            assert self.transfers == [[('w', asg.addr_base + burst, 1)],
+                                      [('w', asg.addr_base + 0x0, 1)]]
+            assert asg.sm_reset
+        assert asg.cycles_per_burst == 3
+
+    def test_arm_during_setup(self):
+        scope = self.r.scope
+        scope.stop()
+        del self.transfers[:]
+        try:
+            with scope.do_setup:
+                scope.decimation = 64
+                scope._start_trace_acquisition()
+                # the arm write reaches the board before the end of the
+                # block, after the configuration writes
+                writes = [addr - scope.addr_base for t in self.transfers
+                          for command, addr, length in t if command == 'w']
+                assert writes[-2:] == [0x0, 0x4]  # arm, trigger source
+                assert {0x10, 0x14} <= set(writes[:-2])
+        finally:
+            scope.stop()
+
+    def test_other_module_status(self):
+        iq, scope = self.r.iq1, self.r.scope
+        del self.transfers[:]
+        with iq.do_setup:
+            iq._write(0x130, 7)
+            # reads of cacheable registers that are not buffered do not
+            # flush the buffer
+            iq._read(0x134)
+            assert self.transfers == []
+            # the status of another module might depend on the writes
+            scope._trigger_armed
+            assert self.transfers == [[('w', iq.addr_base + 0x130, 1)]]
+            iq._write(0x130, 0)
+            # the writes of modules that are not coalescing follow the
+            # buffered writes
+            scope._write(0x10, 100)
+            assert self.transfers[1:] == [[('w', iq.addr_base + 0x130, 1)],
+                                          [('w', scope.addr_base + 0x10, 1)]]
+        assert len(self.transfers) == 3
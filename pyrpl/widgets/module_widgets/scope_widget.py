@@ -117,6 +117,12 @@ class ScopeWidget(AcquisitionModuleWidget):
         self.button_layout.addWidget(aws["xy_mode"])
         self.button_layout.addWidget(aws["trace_average"])
         self.button_layout.addWidget(aws["curve_name"])
+        self.checkbox_persistence = QtWidgets.QCheckBox("Persistence")
+        self.checkbox_persistence.setChecked(
+            self.module.persistence is not None)
+        self.checkbox_persistence.stateChanged.connect(
+            self.persistence_toggled)
+        self.button_layout.addWidget(self.checkbox_persistence)
 
 
         #self.setLayout(self.main_layout)
@@ -137,7 +143,17 @@ class ScopeWidget(AcquisitionModuleWidget):
                                                 #,trans)) \
                        for color, trans in zip(self.ch_color,
                                                self.ch_transparency)]
+        # 2D histogram of the traces (see Scope.enable_persistence)
+        self.persistence_image = pg.ImageItem()
+        self.persistence_image.setZValue(-1)  # behind the curves
+        self.persistence_image.setVisible(False)
+        self.plot_item.addItem(self.persistence_image)
         self.main_layout.addWidget(self.win, stretch=10)
+        # results of Scope.measurements
+        self.measurement_label = QtWidgets.QLabel()
+        self.measurement_label.setWordWrap(True)
+        self.measurement_label.setVisible(False)
+        self.main_layout.addWidget(self.measurement_label)
 
 
         #self.button_layout.addWidget(self.button_single)
@@ -181,6 +197,13 @@ class ScopeWidget(AcquisitionModuleWidget):
         #self.button_layout.setStretchFactor(self.button_continuous, 1)
         #self.button_layout.setStretchFactor(self.button_save, 1)
 
+    def resizeEvent(self, event):
+        """
+        The scope reduces the displayed curves to twice the plot width.
+        """
+        super(ScopeWidget, self).resizeEvent(event)
+        self.module.display_points = 2 * max(self.win.width(), 1)
+
     def update_attribute_by_name(self, name, new_value_list):
         """
         Updates all attributes on the gui when their values have changed.
@@ -217,7 +240,9 @@ class ScopeWidget(AcquisitionModuleWidget):
         """
         Displays all active channels on the graph.
         """
-        times, (ch1, ch2) = list_of_arrays
+        times, (ch1, ch2) = list_of_arrays[:2]
+        self.display_measurements(list_of_arrays[2]
+                                  if len(list_of_arrays) > 2 else None)
         disp = [(ch1, self.module.ch1_active), (ch2, self.module.ch2_active)]
         if self.module.xy_mode:
             self.curves[0].setData(ch1, ch2)
@@ -246,8 +271,40 @@ class ScopeWidget(AcquisitionModuleWidget):
                 self.curves[2].setVisible(True)
             else:
                 self.curves[2].setVisible(False)
+        self.display_persistence()
         self.update_current_average() # to update the number of averages
 
+    def display_persistence(self):
+        """
+        Displays the persistence histogram of the scope behind the curves.
+        """
+        persistence = self.module.persistence
+        self.persistence_image.setVisible(persistence is not None)
+        if persistence is not None:
+            (x0, x1), (y0, y1) = persistence.xrange, persistence.yrange
+            self.persistence_image.setImage(persistence.image,
+                                            autoLevels=True)
+            self.persistence_image.setRect(
+                QtCore.QRectF(x0, y0, x1 - x0, y1 - y0))
+
+    def display_measurements(self, summary):
+        """
+        Displays the last value and the mean +- std of the measurements.
+        """
+        self.measurement_label.setVisible(summary is not None)
+        if summary is not None:
+            self.measurement_label.setText("    ".join(
+                "%s: %.4g (%.4g +- %.2g)" % (key, result['value'],
+                                             result['mean'], result['std'])
+                for key, result in summary.items()))
+
+    def persistence_toggled(self):
+        if self.checkbox_persistence.isChecked():
+            self.module.enable_persistence()
+        else:
+            self.module.disable_persistence()
+        self.display_persistence()
+
     def set_rolling_mode(self):
         """
         Set rolling mode on or off based on the module's attribute